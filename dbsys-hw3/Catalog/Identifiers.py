@@ -44,16 +44,23 @@ class FileId:
 
 class PageId:
   """
-  A page identifier class, storing a file identifier and an unsigned short
+  A page identifier class, storing a file identifier and an unsigned int
   representing a page number.
 
+  Page numbers are global to a file, thus a page id remains valid when
+  its file is split into multiple segments on disk.
+
   >>> pId1 = PageId(FileId(5), 100)
   >>> pId2 = PageId.unpack(pId1.pack())
   >>> pId1 == pId2
   True
+
+  >>> pId3 = PageId(FileId(5), 2**20)
+  >>> PageId.unpack(pId3.pack()).pageIndex
+  1048576
   """
 
-  binrepr = struct.Struct("H")
+  binrepr = struct.Struct("I") # represents unsigned int
   size    = FileId.binrepr.size + binrepr.size
 
   def __init__(self, fileId, pageIndex):
@@ -93,6 +100,9 @@ class TupleId:
   >>> tId2 = TupleId.unpack(tId1.pack())
   >>> tId1 == tId2
   True
+
+  >>> TupleId.size
+  8
   """
 
   binrepr = struct.Struct("H")
@@ -1,6 +1,6 @@
-import json, re
+import json, operator, re
 from collections import namedtuple, OrderedDict
-from struct import Struct
+from struct import Struct, calcsize
 
 class Types:
   """
@@ -197,6 +197,14 @@ class DBSchema:
   >>> projectedSchema.unpack(schema.projectBinary(schema.pack(e1), projectedSchema))
   employeeId(id=1)
 
+  Binary projections copy the bytes of each attribute from its offset in the packed tuple.
+  >>> schema.offsets
+  [0, 4, 16]
+
+  >>> payroll = DBSchema('payroll', [('salary', 'int'), ('dob', 'char(10)')])
+  >>> payroll.unpack(schema.projector(payroll)(memoryview(schema.pack(e1))))
+  payroll(salary=100000, dob='1990-01-01')
+
   >>> schema.match(DBSchema('employee2', [('id', 'int'), ('dob', 'char(10)'), ('salary', 'int')]))
   True
   """
@@ -209,6 +217,12 @@ class DBSchema:
       self.clazz   = namedtuple(self.name, self.fields)
       self.binrepr = Struct(''.join([Types.formatType(x) for x in self.types]))
       self.size    = self.binrepr.size
+
+      # Byte offsets and sizes of the attributes in the binary representation.
+      formats      = [Types.formatType(x) for x in self.types]
+      self.sizes   = [calcsize(f) for f in formats]
+      self.offsets = [calcsize(''.join(formats[:i+1])) - self.sizes[i] for i in range(len(formats))]
+      self.projectors = {}
     else:
       raise ValueError("Invalid attributes when constructing a schema")
 
@@ -265,9 +279,43 @@ class DBSchema:
     return schema.instantiate(*fields)
 
   # Project a packed tuple to a binary representation of the given schema.
-  # TODO: make this more efficient by direct field access and copying.
   def projectBinary(self, binaryInstance, schema):
-    return schema.pack(self.project(self.unpack(binaryInstance), schema))
+    return self.projector(schema)(binaryInstance)
+
+  # Returns a function projecting a packed tuple (as bytes or a memoryview) to a binary
+  # representation of the given schema. Projectors are compiled once per target schema,
+  # and copy the bytes of each attribute from its offset in this schema's representation,
+  # without unpacking the tuple. Projections converting between types, or requiring
+  # alignment padding in the target schema, unpack and repack the tuple instead.
+  def projector(self, schema):
+    key = tuple(schema.schema())
+    if key not in self.projectors:
+      self.projectors[key] = self.compileProjector(schema)
+    return self.projectors[key]
+
+  def compileProjector(self, schema):
+    slices = []
+    for (i, f) in enumerate(schema.fields):
+      if f not in self.fields:
+        raise ValueError("Invalid field in projection: "+f)
+
+      j = self.fields.index(f)
+      if self.types[j] != schema.types[i] or schema.offsets[i] != sum(schema.sizes[:i]):
+        return lambda binaryInstance: schema.pack(self.project(self.unpack(binaryInstance), schema))
+
+      # Merge adjacent attributes into a single slice.
+      (start, end) = (self.offsets[j], self.offsets[j] + self.sizes[j])
+      if slices and slices[-1][1] == start:
+        slices[-1] = (slices[-1][0], end)
+      else:
+        slices.append((start, end))
+
+    if len(slices) == 1:
+      s = slice(*slices[0])
+      return lambda binaryInstance: bytes(binaryInstance[s])
+
+    getter = operator.itemgetter(*[slice(start, end) for (start, end) in slices])
+    return lambda binaryInstance: b''.join(getter(binaryInstance))
 
   # Return a binary representation of the instance
   def pack(self, instance):
@@ -26,7 +26,8 @@ class Database:
 
     else:
       storageArgs = {k:v for (k,v) in kwargs.items() \
-                      if k in ["pageSize", "poolSize", "dataDir", "indexDir"]}
+                      if k in ["pageSize", "poolSize", "dataDir", "indexDir", "directIO", "indexType", \
+                               "transactional", "groupCommitSize", "memoryBudget", "memorySplit"]}
 
       self.relationMap     = kwargs.get("relations", {})
       self.defaultPageSize = kwargs.get("pageSize", io.DEFAULT_BUFFER_SIZE)
@@ -76,11 +77,13 @@ class Database:
       return self.relationMap[relationName]
 
   # DDL statements
-  def createRelation(self, relationName, relationFields):
+  # Creates a relation, passing any storage options (e.g., 'pageSize') to the storage engine.
+  # Relations keep zone maps for scan skipping unless 'zoneMaps' is set to False.
+  def createRelation(self, relationName, relationFields, **kwargs):
     if relationName not in self.relationMap:
       schema = DBSchema(relationName, relationFields)
       self.relationMap[relationName] = schema
-      self.storage.createRelation(relationName, schema)
+      self.storage.createRelation(relationName, schema, **dict({"zoneMaps": True}, **kwargs))
       self.checkpoint()
     else:
       raise ValueError("Relation '" + relationName + "' already exists")
@@ -108,6 +111,23 @@ class Database:
   def updateTuple(self, tupleId, tupleData):
     self.storage.updateTuple(tupleId, tupleData)
 
+  # Inserts a list of tuples, returning their tuple ids in input order.
+  def insertTuples(self, relationName, tupleDataList):
+    if relationName in self.relationMap:
+      return self.storage.insertTuples(relationName, tupleDataList)
+    else:
+      raise ValueError("Unknown relation '" + relationName + "' while inserting tuples")
+
+  # Commits all tuple operations since the last commit, when the database is opened
+  # with the 'transactional' keyword argument.
+  def commit(self):
+    self.storage.commit()
+
+  # Moves memory between the buffer pool and index cache, when the database is opened
+  # with the 'memoryBudget' keyword argument (see StorageEngine.rebalanceMemory).
+  def rebalanceMemory(self):
+    return self.storage.rebalanceMemory()
+
   # Queries
 
   # Returns an empty query builder that can access the current database.
@@ -0,0 +1,111 @@
+from Catalog.Schema import Types
+
+class Batch:
+  """
+  A columnar batch of tuples, exchanged by operators using the batch protocol.
+
+  A batch holds one list of attribute values per field of its schema, with character
+  attributes decoded as DBSchema.unpack would, and a selection vector listing the
+  indexes of the rows present in the batch. Operators filter a batch by replacing
+  its selection vector, without copying its columns.
+
+  Batches read from a page keep the page's unpacked tuples, and only build the columns
+  accessed by their consumers.
+
+  >>> from Catalog.Schema import DBSchema
+  >>> schema = DBSchema('employee', [('id', 'int'), ('name', 'char(8)')])
+  >>> batch  = Batch.fromTuples(schema, [schema.pack(schema.instantiate(i, n)) for (i, n) in enumerate('abc')])
+  >>> (len(batch), batch.column(1))
+  (3, ['a', 'b', 'c'])
+
+  >>> evens = batch.select([0, 2])
+  >>> (len(evens), evens.values())
+  (2, [(0, 'a'), (2, 'c')])
+
+  # Batches convert back to packed tuples for the page protocol.
+  >>> [schema.unpack(t) for t in evens.tuples()]
+  [employee(id=0, name='a'), employee(id=2, name='c')]
+
+  >>> computed = Batch.fromValues(schema, [(7, 'x'), (8, 'y')])
+  >>> [schema.unpack(t) for t in computed.tuples()] == [schema.instantiate(7, 'x'), schema.instantiate(8, 'y')]
+  True
+  """
+
+  def __init__(self, schema, **kwargs):
+    self.schema    = schema
+    self.rows      = kwargs.get("rows", None)
+    self.columns   = kwargs.get("columns", None) or [None] * len(schema.fields)
+    self.selection = kwargs.get("selection", None)
+
+    if self.rows is None and None in self.columns:
+      raise ValueError("Invalid batch, expected either rows or columns")
+
+  # Returns a batch over the unpacked tuples of a page.
+  @classmethod
+  def fromPage(cls, schema, page):
+    return cls(schema, rows=list(map(schema.binrepr.unpack, page)))
+
+  # Returns a batch over a list of packed tuples.
+  @classmethod
+  def fromTuples(cls, schema, tuples):
+    return cls(schema, rows=list(map(schema.binrepr.unpack, tuples)))
+
+  # Returns a batch over a list of tuples of decoded attribute values.
+  @classmethod
+  def fromValues(cls, schema, values):
+    columns = list(map(list, zip(*values))) if values else [[] for _ in schema.fields]
+    return cls(schema, columns=columns)
+
+  # Returns the number of selected rows in the batch.
+  def __len__(self):
+    return self.numRows() if self.selection is None else len(self.selection)
+
+  # Returns the number of rows in the batch, whether selected or not.
+  def numRows(self):
+    return len(self.rows) if self.rows is not None else len(self.columns[0]) if self.columns else 0
+
+  # Returns the selection vector of the batch.
+  def selected(self):
+    return range(self.numRows()) if self.selection is None else self.selection
+
+  # Returns a batch with the given selection vector, sharing this batch's rows and columns.
+  def select(self, selection):
+    return Batch(self.schema, rows=self.rows, columns=self.columns, selection=selection)
+
+  # Returns the values of a field for all rows of the batch, decoding the column on first access.
+  def column(self, index):
+    values = self.columns[index]
+    if values is None:
+      values = [row[index] for row in self.rows]
+      if self.schema.types[index].startswith(("char", "text")):
+        values = [v.decode().rstrip("\x00 \n") for v in values]
+      self.columns[index] = values
+    return values
+
+  # Returns the selected rows as tuples of decoded attribute values.
+  def values(self):
+    columns = [self.column(i) for i in range(len(self.schema.fields))]
+    if self.selection is not None:
+      columns = [[column[i] for i in self.selection] for column in columns]
+    return list(zip(*columns))
+
+  # Returns the selected rows as packed tuples.
+  def tuples(self):
+    pack = self.schema.binrepr.pack
+    if self.rows is not None:
+      rows = self.rows if self.selection is None else [self.rows[i] for i in self.selection]
+      return [pack(*row) for row in rows]
+
+    columns = []
+    for (column, typeDesc) in zip(self.columns, self.schema.types):
+      if self.selection is not None:
+        column = [column[i] for i in self.selection]
+      if typeDesc.startswith(("char", "text")):
+        column = [Types.formatValue(v, typeDesc) for v in column]
+      columns.append(column)
+    return [pack(*row) for row in zip(*columns)]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,3 +1,8 @@
+from Catalog.Identifiers import FileId, PageId
+from Storage.File        import StorageFile
+from Query.Batch         import Batch
+from Query.OutputWriter  import OutputWriter
+
 class Operator:
   """
   An abstract base class for all operator implementations.
@@ -45,15 +50,23 @@ class Operator:
     self.storage = database.storageEngine()
 
   # Create a temporary output relation, removing any existing relation.
+  # Pipelined operators have no output relation, and instead pass transient
+  # output pages directly to their parent.
   def initializeOutput(self):
-    relId = self.relationId()
+    self.outputPages = []
+    if self.pipelined:
+      self.transientPages = 0
 
-    if self.storage.hasRelation(relId):
-      self.storage.removeRelation(relId)
+    else:
+      relId = self.relationId()
 
-    self.storage.createRelation(relId, self.schema())
-    self.tempFile = self.storage.fileMgr.relationFile(relId)[1]
-    self.outputPages = []
+      if self.storage.hasRelation(relId):
+        self.storage.removeRelation(relId)
+
+      self.storage.createRelation(relId, self.schema())
+      self.tempFile = self.storage.fileMgr.relationFile(relId)[1]
+
+    self.outputWriter = OutputWriter(self)
 
   # Returns an identifier for this operator's output relation
   def relationId(self):
@@ -69,31 +82,23 @@ class Operator:
   # Page processing and control methods
 
   # Used during operator processing to indicate a new output tuple.
-  # The operator implementation must store this tuple in an output page, allocating a
+  # The operator's output writer stores this tuple in an output page, allocating a
   # new output page as necessary.
   def emitOutputTuple(self, tupleData):
-    if self.tempFile is None:
-      self.initializeOutput()
-
-    allocatePage = not(self.outputPages and self.outputPages[-1][1].header.hasFreeTuple())
-    if allocatePage:
-      # Flush the most recently updated output page, which updates the storage file's
-      # free page list to ensure correct new page allocation.
-      if self.outputPages:
-        self.storage.bufferPool.flushPage(self.outputPages[-1][0])
-      outputPageId = self.tempFile.availablePage()
-      outputPage   = self.storage.bufferPool.getPage(outputPageId)
-      self.outputPages.append((outputPageId, outputPage))
-    else:
-      outputPage = self.outputPages[-1][1]
-
-    outputPage.insertTuple(tupleData)
+    self.outputWriter.write(tupleData)
 
     if self.sampled:
       self.estimatedCardinality += 1
     else:
       self.actualCardinality += 1
 
+  # Returns a new output page held in memory only, outside of the buffer pool and of
+  # any storage file. Transient pages have no file, and are numbered per operator run.
+  def transientPage(self):
+    self.transientPages += 1
+    pageId = PageId(FileId(None), self.transientPages)
+    return StorageFile.defaultPageClass(pageId=pageId, buffer=bytes(self.storage.bufferPool.pageSize), schema=self.schema())
+
   # Returns whether this operator has an output page ready for its iterator.
   # This method can raise a StopIteration exception to end this operator's processing.
   def isOutputPageReady(self):
@@ -106,9 +111,16 @@ class Operator:
   # This method must raise a StopIteration exception when no output pages are available.
   def outputPage(self):
     if self.outputPages:
+      self.outputWriter.sealPage()
       return self.outputPages.pop(0)
     raise StopIteration
 
+  # Returns an iterator over the operator's output relation, once the operator
+  # has emitted all of its output tuples.
+  def outputRelationPages(self):
+    self.outputWriter.close()
+    return self.storage.pages(self.relationId())
+
   # Page-at-a-time operator processing
   # This method can raise a StopIteration exception to end this operator's processing.
   def processInputPage(self, pageId, page):
@@ -118,6 +130,31 @@ class Operator:
   def processAllPages(self):
     raise NotImplementedError
 
+  # Batch processing methods
+
+  # Iterator over this operator's output as columnar batches (see Query.Batch).
+  # By default, this adapts the operator's output pages, one batch per page.
+  # Operators processing batches directly override this method, consuming the
+  # batches of their inputs.
+  def batches(self):
+    for (pageId, page) in self:
+      yield Batch.fromPage(self.schema(), page)
+
+  # Used during batch processing to indicate a new output batch, returning the batch.
+  def emitOutputBatch(self, batch):
+    if self.sampled:
+      self.estimatedCardinality += len(batch)
+    else:
+      self.actualCardinality += len(batch)
+    return batch
+
+  # Returns the number of tuples of the given schema fitting in the storage engine's
+  # work memory, or None if the storage engine has no work memory budget.
+  def workMemoryTuples(self, schema):
+    pages = self.storage.workMemoryPages()
+    if pages is not None:
+      return max(1, (pages * self.storage.bufferPool.pageSize) // schema.size)
+
   # Expression evaluation methods.
 
   # Loads (i.e., binds) all the fields in the given schema and tuple
@@ -145,6 +182,14 @@ class Operator:
     for childOp in self.inputs():
       childOp.useSampling(sampled, sampleFactor)
 
+  # Instructs this operator to pass its output pages directly to its parent, rather
+  # than materializing them in a temporary relation.
+  # This propagates the pipelining mode over all of our children.
+  def usePipelining(self, pipelined):
+    self.pipelined = pipelined
+    for childOp in self.inputs():
+      childOp.usePipelining(pipelined)
+
   # Returns the number of tuples this operator produces, either
   # as an estimate or a profiled actual cardinality.
   def cardinality(self, estimated):
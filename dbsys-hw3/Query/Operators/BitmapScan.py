@@ -0,0 +1,68 @@
+from Query.Operators.TupleIdScan import TupleIdScan
+from Storage.Index.BitmapIndex   import BitmapIndex
+
+class BitmapScan(TupleIdScan):
+  """
+  A bitmap index scan operator implementation.
+
+  This retrieves the tuples of a relation matching a tree of equality terms over
+  attributes with bitmap indexes, as derived from the predicate of a selection (see
+  ExpressionInfo.equalityTerms). The bitmaps of each term's values are combined with
+  a bitwise OR, and those of conjunctive and disjunctive terms with bitwise AND and OR
+  operations. The resulting bitmap yields tuple ids in page and slot order, which are
+  fetched as in any TupleIdScan.
+
+  A bitmap scan does not evaluate the predicate itself, and is used beneath a
+  selection that checks any remaining conjuncts.
+  """
+
+  def __init__(self, relId, schema, terms, **kwargs):
+    if relId and schema and terms:
+      super().__init__(relId, schema, **kwargs)
+      self.terms     = terms
+      self.bitmap    = None
+    else:
+      raise ValueError("Invalid relation name, schema or terms for a bitmap scan")
+
+  # Returns a string describing the operator type
+  def operatorType(self):
+    return "BitmapScan"
+
+  # Returns the bitmap of the tuples matching the scan's terms.
+  # This is cached for cardinality estimation prior to execution.
+  def matchingBitmap(self):
+    if self.bitmap is None:
+      indexManager = self.storage.fileMgr.indexManager
+      self.bitmap  = indexManager.evaluateBitmaps(self.relId, self.terms)
+    return self.bitmap
+
+  # Returns the ids of the tuples matching the scan's terms, sorted by page and tuple index.
+  def matchingTupleIds(self):
+    (fileId, _) = self.storage.fileMgr.relationFile(self.relId)
+    return BitmapIndex.tupleIds(fileId, self.matchingBitmap())
+
+  def clearMatches(self):
+    self.bitmap = None
+
+
+  # Plan and statistics information
+
+  # Returns a description of a tree of equality terms.
+  def describe(self, term):
+    if term[0] == 'eq':
+      values = term[2]
+      return term[1] + (" == " + repr(values[0]) if len(values) == 1 else " in " + repr(tuple(values)))
+
+    return "(" + (" " + term[0] + " ").join(self.describe(t) for t in term[1]) + ")"
+
+  # Returns a single line description of the operator.
+  def explain(self):
+    return super().explain() + "(" + self.relId + ", terms=" + repr(self.describe(self.terms)) + ")"
+
+  # Returns the number of tuples matching the scan's terms.
+  def cardinality(self, estimated):
+    return BitmapIndex.count(self.matchingBitmap())
+
+  # Returns the number of heap pages holding matching tuples, one per page of the bitmap.
+  def pagesFetched(self, estimated):
+    return len(self.matchingBitmap())
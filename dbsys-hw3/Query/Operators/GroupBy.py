@@ -1,13 +1,11 @@
 from Catalog.Schema import DBSchema
+from Query.Batch    import Batch
 from Query.Operator import Operator
 
 class GroupBy(Operator):
   def __init__(self, subPlan, **kwargs):
     super().__init__(**kwargs)
 
-    if self.pipelined:
-      raise ValueError("Pipelined group-by-aggregate operator not supported")
-
     self.subPlan     = subPlan
     self.subSchema   = subPlan.schema()
     self.groupSchema = kwargs.get("groupSchema", None)
@@ -57,15 +55,33 @@ class GroupBy(Operator):
   def inputs(self):
     return [self.subPlan]
 
-  # Iterator abstraction for selection operator.
+  # Iterator abstraction for group-by operator.
+  # Pipelined group-bys pass their output pages to their parent as these fill up,
+  # once their input is partitioned, aggregating one partition at a time.
   def __iter__(self):
     self.initializeOutput()
     self.partitionFiles = {}
-    self.outputIterator = self.processAllPages()
+
+    if self.pipelined:
+      self.inputIterator = self.groupSteps()
+      self.inputFinished = False
+    else:
+      self.outputIterator = self.processAllPages()
+
     return self
 
   def __next__(self):
-    return next(self.outputIterator)
+    if self.pipelined:
+      while not(self.inputFinished or self.isOutputPageReady()):
+        try:
+          next(self.inputIterator)
+        except StopIteration:
+          self.inputFinished = True
+
+      return self.outputPage()
+
+    else:
+      return next(self.outputIterator)
 
 
   # Page-at-a-time operator processing
@@ -90,6 +106,21 @@ class GroupBy(Operator):
 
   # Set-at-a-time operator processing
   def processAllPages(self):
+    for _ in self.groupSteps():
+      pass
+
+    # Return an iterator for the output file.
+    return self.outputRelationPages()
+
+  # Runs the group-by, pausing after each partition's groups are emitted, and
+  # removing the partition files once it ends or is abandoned.
+  def groupSteps(self):
+    try:
+      yield from self.aggregatePartitions()
+    finally:
+      self.removePartitionFiles()
+
+  def aggregatePartitions(self):
     # Create partitions of the input records by hashing the group-by values
     for (pageId, page) in self.subPlan:
       for tup in page:
@@ -98,7 +129,7 @@ class GroupBy(Operator):
         self.emitPartitionTuple(groupId, tup)
 
     # We assume that the partitions fit in main memory.
-    for partRelId in self.partitionFiles.values():
+    for partRelId in list(self.partitionFiles.values()):
       partFile = self.storage.fileMgr.relationFile(partRelId)[1]
 
       # Use an in-memory Python dict to accumulate the aggregates.
@@ -125,15 +156,41 @@ class GroupBy(Operator):
         outputTuple = self.outputSchema.instantiate(*(list(groupVal) + finalVals))
         self.emitOutputTuple(self.outputSchema.pack(outputTuple))
 
-      # No need to track anything but the last output page when in batch mode.
-      if self.outputPages:
-        self.outputPages = [self.outputPages[-1]]
-
-    # Clean up partitions.
-    self.removePartitionFiles()
+      yield
+
+  # Batch-at-a-time operator processing.
+  # This accumulates the aggregates of each partition in memory rather than in partition
+  # files, and produces a single output batch, ordered by partition as processAllPages.
+  # If the groups outgrow the work memory budget, this falls back to the page path.
+  def batches(self):
+    partitions = {}
+    numGroups  = 0
+    maxGroups  = self.workMemoryTuples(self.outputSchema)
+    for batch in self.subPlan.batches():
+      for values in batch.values():
+        namedTup = self.subSchema.clazz._make(values)
+        groupVal = self.ensureTuple(self.groupExpr(namedTup))
+
+        aggregates = partitions.setdefault(self.groupHashFn(groupVal), {})
+        if groupVal not in aggregates:
+          # Fall back to the partitioned page path once the groups exceed work memory.
+          numGroups += 1
+          if maxGroups is not None and numGroups > maxGroups:
+            yield from super().batches()
+            return
+
+          aggregates[groupVal] = self.initialExprs()
+
+        aggregates[groupVal] = [incr(acc, namedTup) for (incr, acc) in zip(self.incrExprs(), aggregates[groupVal])]
+
+    outputValues = []
+    for aggregates in partitions.values():
+      for (groupVal, aggVals) in aggregates.items():
+        finalVals = [finalize(acc) for (finalize, acc) in zip(self.finalizeExprs(), aggVals)]
+        outputValues.append(tuple(groupVal) + tuple(finalVals))
 
-    # Return an iterator for the output file.
-    return self.storage.pages(self.relationId())
+    if outputValues:
+      yield self.emitOutputBatch(Batch.fromValues(self.outputSchema, outputValues))
 
   # Bucket construction helpers.
   def partitionRelationId(self, partitionId):
@@ -0,0 +1,130 @@
+import random
+from Catalog.Identifiers import TupleId
+from Catalog.Schema      import DBSchema
+from Query.Operator      import Operator
+
+class IndexOnlyScan(Operator):
+  """
+  An index-only scan operator implementation.
+
+  This scans a covering index of a relation, that is an index whose key and included
+  attributes hold every attribute referenced by the operators above it. Output tuples
+  are constructed from the index entries alone, without accessing the relation's pages.
+  The output schema consists of the key attributes followed by the included attributes,
+  and tuples are produced in index key order.
+  """
+
+  def __init__(self, relId, schema, indexId, keySchema, includeSchema=None, **kwargs):
+    if relId and schema and keySchema:
+      super().__init__(**kwargs)
+      self.relId         = relId
+      self.relSchema     = schema
+      self.indexId       = indexId
+      self.keySchema     = keySchema
+      self.includeSchema = includeSchema
+
+      includeFields     = list(zip(includeSchema.fields, includeSchema.types)) if includeSchema else []
+      self.outputSchema = DBSchema(self.relationId(), list(zip(keySchema.fields, keySchema.types)) + includeFields)
+
+      # Binary representations used to repack index entries as output tuples.
+      self.keyRepr     = keySchema.binrepr
+      self.includeRepr = includeSchema.binrepr if includeSchema else None
+    else:
+      raise ValueError("Invalid relation name, schema or index key for an index-only scan")
+
+  # Returns the output schema of this operator
+  def schema(self):
+    return self.outputSchema
+
+  # Returns any input schemas for the operator if present
+  def inputSchemas(self):
+    return None
+
+  # Returns a string describing the operator type
+  def operatorType(self):
+    return "IndexOnlyScan"
+
+  # Returns child operators if present
+  def inputs(self):
+    return []
+
+
+  # Iterator abstraction for index-only scans.
+
+  def __iter__(self):
+    self.initializeOutput()
+    self.inputIterator = self.storage.fileMgr.indexManager.scanByIndex(self.indexId)
+    self.inputFinished = False
+
+    if self.inputIterator is None:
+      raise ValueError("Invalid index for an index-only scan on " + self.relId)
+
+    if not self.pipelined:
+      self.outputIterator = self.processAllPages()
+
+    return self
+
+  def __next__(self):
+    if self.pipelined:
+      while not(self.inputFinished or self.isOutputPageReady()):
+        try:
+          key, value = next(self.inputIterator)
+          self.processIndexEntry(key, value)
+        except StopIteration:
+          self.inputFinished = True
+
+      return self.outputPage()
+
+    else:
+      return next(self.outputIterator)
+
+
+  # Page processing and control methods
+
+  # Constructs an output tuple from a (key, value) index entry.
+  # The binary key and included attributes are repacked directly into the output
+  # schema's representation, avoiding the decoding of string attributes.
+  # When sampling, entries are kept with a probability of 1/sampleFactor.
+  def processIndexEntry(self, key, value):
+    if self.sampled and random.random() * self.sampleFactor >= 1.0:
+      return
+
+    fields = self.keyRepr.unpack(key)
+    if self.includeRepr:
+      fields += self.includeRepr.unpack_from(value, TupleId.size)
+    self.emitOutputTuple(self.outputSchema.binrepr.pack(*fields))
+
+  # Index-only scans do not consume input pages.
+  def processInputPage(self, pageId, page):
+    raise ValueError("Invalid use of processInputPage in an index-only scan")
+
+  # Set-at-a-time operator processing
+  def processAllPages(self):
+    for (key, value) in self.inputIterator:
+      self.processIndexEntry(key, value)
+
+    # Return an iterator to the output relation
+    return self.outputRelationPages()
+
+
+  # Plan and statistics information
+
+  # Returns a single line description of the operator.
+  def explain(self):
+    include = ", include=" + self.includeSchema.toString() if self.includeSchema else ""
+    return super().explain() + "(" + self.relId + ", index=" + self.keySchema.toString() + include + ")"
+
+  # Returns the table's cardinality by using the storage engine.
+  def cardinality(self, estimated):
+    _, _, r = self.storage.relationStats(self.relId)
+    return r
+
+  # Returns the scan's cost as the product of the table cardinality and the per-tuple cost,
+  # scaled by the size of the index entries relative to the relation's tuples.
+  def cost(self, estimated):
+    entrySize = self.outputSchema.size + TupleId.size
+    return self.cardinality(estimated) * self.tupleCost * min(1.0, entrySize / self.relSchema.size)
+
+  # An index-only scan returns a constant selectivity.
+  def selectivity(self, estimated):
+    return 1.0
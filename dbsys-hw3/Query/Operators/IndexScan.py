@@ -0,0 +1,76 @@
+import math
+from Catalog.Identifiers         import TupleId
+from Query.Operators.TupleIdScan import TupleIdScan
+
+class IndexScan(TupleIdScan):
+  """
+  An index scan operator implementation.
+
+  This retrieves the tuples of a relation whose indexed attribute lies in a key range,
+  as derived from the predicates of a selection. The range applies to the leading
+  attribute of the index key, with either bound optional. Matching tuple ids are
+  collected from the index and sorted by page, and fetched as in any TupleIdScan,
+  reading each heap page once regardless of the index order.
+
+  An index scan does not evaluate the predicate itself, and is used beneath a
+  selection that checks any remaining conjuncts. Its estimated cardinality is
+  derived from the index's key bounds, without scanning the range.
+  """
+
+  def __init__(self, relId, schema, indexId, keySchema, low=None, high=None, \
+                 lowInclusive=True, highInclusive=True, **kwargs):
+    if relId and schema and keySchema:
+      super().__init__(relId, schema, **kwargs)
+      self.indexId       = indexId
+      self.keySchema     = keySchema
+      self.low           = low
+      self.high          = high
+      self.lowInclusive  = lowInclusive
+      self.highInclusive = highInclusive
+      self.tupleIds      = None
+    else:
+      raise ValueError("Invalid relation name, schema or index key for an index scan")
+
+  # Returns a string describing the operator type
+  def operatorType(self):
+    return "IndexScan"
+
+  # Returns the tuple ids in the scan's key range, sorted by page and tuple index.
+  # These are cached for cardinality estimation prior to execution.
+  def matchingTupleIds(self):
+    if self.tupleIds is None:
+      entries = self.storage.fileMgr.indexManager.rangeByIndex(self.relId, self.indexId, \
+                  self.low, self.high, self.lowInclusive, self.highInclusive)
+      tupleIds = [TupleId.unpack(value) for (_, value) in entries]
+      self.tupleIds = sorted(tupleIds, key=lambda t: (t.pageId.pageIndex, t.tupleIndex))
+    return self.tupleIds
+
+  def clearMatches(self):
+    self.tupleIds = None
+
+
+  # Plan and statistics information
+
+  # Returns a single line description of the operator.
+  def explain(self):
+    low   = ("[" if self.lowInclusive else "(") + ("-inf" if self.low is None else repr(self.low))
+    high  = ("inf" if self.high is None else repr(self.high)) + ("]" if self.highInclusive else ")")
+    return super().explain() + "(" + self.relId + ", index=" + self.keySchema.toString() \
+             + ", range=" + low + ", " + high + ")"
+
+  # Returns the number of tuples in the scan's key range, either as estimated from
+  # the index (see IndexManager.estimateRange), or as retrieved by the scan.
+  def cardinality(self, estimated):
+    if estimated:
+      _, _, r = self.storage.relationStats(self.relId)
+      return round(self.storage.fileMgr.indexManager.estimateRange(self.relId, self.indexId, r, \
+                     self.low, self.high, self.lowInclusive, self.highInclusive))
+    return len(self.matchingTupleIds())
+
+  # Tuples in a key range of a relation clustered on this index lie on consecutive pages.
+  def pagesFetched(self, estimated):
+    fileMgr = self.storage.fileMgr
+    if fileMgr.isClustered(self.relId) and fileMgr.indexManager.isPrimaryIndex(self.relId, self.indexId):
+      _, numPages, numTuples = self.storage.relationStats(self.relId)
+      return min(numPages, math.ceil(self.cardinality(estimated) * numPages / numTuples)) if numTuples else 0
+    return super().pagesFetched(estimated)
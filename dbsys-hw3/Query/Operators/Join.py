@@ -1,15 +1,14 @@
 import itertools
 
-from Catalog.Schema import DBSchema
-from Query.Operator import Operator
+from Catalog.Schema       import DBSchema
+from Query.Batch          import Batch
+from Query.Operator       import Operator
+from Utils.ExpressionInfo import ExpressionInfo
 
 class Join(Operator):
   def __init__(self, lhsPlan, rhsPlan, **kwargs):
     super().__init__(**kwargs)
 
-    if self.pipelined:
-      raise ValueError("Pipelined join operator not supported")
-
     self.lhsPlan    = lhsPlan
     self.rhsPlan    = rhsPlan
     self.joinExpr   = kwargs.get("expr", None)
@@ -72,6 +71,12 @@ class Join(Operator):
       if self.indexId is None or self.lhsKeySchema is None:
         raise ValueError("Invalid index for use in join operator")
 
+    # Hash joins may build Bloom filters over the keys of their LHS partitions,
+    # with the 'bloomFilters' keyword argument.
+    elif self.joinMethod == "hash":
+      self.useBloomFilters = kwargs.get("bloomFilters", False)
+      self.bloomSkipped    = 0
+
   # Returns the output schema of this operator
   def schema(self):
     return self.joinSchema
@@ -92,15 +97,51 @@ class Join(Operator):
   def inputs(self):
     return [self.lhsPlan, self.rhsPlan]
 
+  # Prepares the operator for execution, compiling its join predicate and hash
+  # functions once over the unpacked tuples of its inputs.
+  def prepare(self, database):
+    super().prepare(database)
+    compiled = lambda expr, schemas: \
+                 ExpressionInfo(expr).compileFunction(schemas, globals()) if expr else None
+
+    self.joinPredicate = compiled(self.joinExpr, [self.lhsSchema, self.rhsSchema])
+    self.batchJoinPredicate = ExpressionInfo(self.joinExpr).compileFunction( \
+                                [self.lhsSchema, self.rhsSchema], globals(), raw=False) if self.joinExpr else None
+    self.lhsHash       = compiled(self.lhsHashFn, [self.lhsSchema])
+    self.rhsHash       = compiled(self.rhsHashFn, [self.rhsSchema])
+
+  # Returns the packed output tuple for the unpacked values of a pair of joined tuples.
+  def joinTuple(self, lValues, rValues):
+    return self.joinSchema.binrepr.pack(*lValues, *rValues)
+
   # Iterator abstraction for join operator.
+  # Join methods are generators pausing after each LHS page or partition pair, thus
+  # pipelined joins pass their output pages to their parent as these fill up, once
+  # any partitioning of their inputs is done.
   def __iter__(self):
     self.initializeOutput()
     self.partitionFiles = {0:{}, 1:{}}
-    self.outputIterator = self.processAllPages()
+
+    if self.pipelined:
+      self.inputIterator = self.joinSteps()
+      self.inputFinished = False
+    else:
+      self.outputIterator = self.processAllPages()
+
     return self
 
   def __next__(self):
-    return next(self.outputIterator)
+    if self.pipelined:
+      while not(self.inputFinished or self.isOutputPageReady()):
+        try:
+          next(self.inputIterator)
+        except StopIteration:
+          self.inputFinished = True
+
+      return self.outputPage()
+
+    else:
+      return next(self.outputIterator)
 
   # Page-at-a-time operator processing
   def processInputPage(self, pageId, page):
@@ -108,6 +149,20 @@ class Join(Operator):
 
   # Set-at-a-time operator processing
   def processAllPages(self):
+    for _ in self.joinSteps():
+      pass
+
+    # Return an iterator to the output relation
+    return self.outputRelationPages()
+
+  # Runs the join method, removing any partition files once it ends or is abandoned.
+  def joinSteps(self):
+    try:
+      yield from self.joinMethodSteps()
+    finally:
+      self.removePartitionFiles()
+
+  def joinMethodSteps(self):
     if self.joinMethod == "nested-loops":
       return self.nestedLoops()
 
@@ -129,27 +184,20 @@ class Join(Operator):
   # Nested loops implementation
   #
   def nestedLoops(self):
+    (lhsUnpack, rhsUnpack) = (self.lhsSchema.binrepr.unpack, self.rhsSchema.binrepr.unpack)
     for (lPageId, lhsPage) in self.lhsPlan:
       for lTuple in lhsPage:
-        # Load the lhs once per inner loop.
-        joinExprEnv = self.loadSchema(self.lhsSchema, lTuple)
+        # Unpack the lhs once per inner loop.
+        lValues = lhsUnpack(lTuple)
 
         for (rPageId, rhsPage) in self.rhsPlan:
           for rTuple in rhsPage:
-            # Load the RHS tuple fields.
-            joinExprEnv.update(self.loadSchema(self.rhsSchema, rTuple))
-
             # Evaluate the join predicate, and output if we have a match.
-            if eval(self.joinExpr, globals(), joinExprEnv):
-              outputTuple = self.joinSchema.instantiate(*[joinExprEnv[f] for f in self.joinSchema.fields])
-              self.emitOutputTuple(self.joinSchema.pack(outputTuple))
-
-        # No need to track anything but the last output page when in batch mode.
-        if self.outputPages:
-          self.outputPages = [self.outputPages[-1]]
+            rValues = rhsUnpack(rTuple)
+            if self.joinPredicate(lValues, rValues):
+              self.emitOutputTuple(self.joinTuple(lValues, rValues))
 
-    # Return an iterator to the output relation
-    return self.storage.pages(self.relationId())
+      yield
 
 
   ##################################
@@ -157,19 +205,21 @@ class Join(Operator):
   # Block nested loops implementation
   #
   # This attempts to use all the free pages in the buffer pool
-  # for its block of the outer relation.
+  # for its block of the outer relation, up to the storage engine's
+  # work memory if it has a memory budget.
 
   # Accesses a block of pages from an iterator.
   # This method pins pages in the buffer pool during its access.
   # We track the page ids in the block to unpin them after processing the block.
   def accessPageBlock(self, bufPool, pageIterator):
     pageBlock = []
+    blockSize = self.storage.workMemoryPages()
     try:
       while True:
         (pageId, page) = next(pageIterator)
         pageBlock.append((pageId, page))
         bufPool.pinPage(pageId)
-        if bufPool.numFreePages() == 0:
+        if bufPool.numFreePages() == 0 or len(pageBlock) == blockSize:
           break
     except StopIteration:
       pass
@@ -182,80 +232,87 @@ class Join(Operator):
     lhsIter    = iter(self.lhsPlan)
     lPageBlock = self.accessPageBlock(bufPool, lhsIter)
 
+    (lhsUnpack, rhsUnpack) = (self.lhsSchema.binrepr.unpack, self.rhsSchema.binrepr.unpack)
     while lPageBlock:
       for (lPageId, lhsPage) in lPageBlock:
         for lTuple in lhsPage:
-          # Load the lhs once per inner loop.
-          joinExprEnv = self.loadSchema(self.lhsSchema, lTuple)
+          # Unpack the lhs once per inner loop.
+          lValues = lhsUnpack(lTuple)
 
           for (rPageId, rhsPage) in self.rhsPlan:
             for rTuple in rhsPage:
-              # Load the RHS tuple fields.
-              joinExprEnv.update(self.loadSchema(self.rhsSchema, rTuple))
-
               # Evaluate the join predicate, and output if we have a match.
-              if eval(self.joinExpr, globals(), joinExprEnv):
-                outputTuple = self.joinSchema.instantiate(*[joinExprEnv[f] for f in self.joinSchema.fields])
-                self.emitOutputTuple(self.joinSchema.pack(outputTuple))
-
-          # No need to track anything but the last output page when in batch mode.
-          if self.outputPages:
-            self.outputPages = [self.outputPages[-1]]
+              rValues = rhsUnpack(rTuple)
+              if self.joinPredicate(lValues, rValues):
+                self.emitOutputTuple(self.joinTuple(lValues, rValues))
 
         # Unpin the page after joining with the RHS relation.
         # Thus future accesses can evict the page while reading the next block.
         bufPool.unpinPage(lPageId)
+        yield
 
       # Move to the next page block after processing it.
       lPageBlock = self.accessPageBlock(bufPool, lhsIter)
 
-    # Return an iterator to the output relation
-    return self.storage.pages(self.relationId())
-
 
   ##################################
   #
   # Indexed nested loops implementation
   #
-  # TODO: test
+  # The join keys of each LHS page are probed in a single batched index lookup,
+  # and the matching RHS tuples are fetched in page order, reading each RHS page
+  # once per LHS page. Output tuples follow the order of the LHS tuples.
   def indexedNestedLoops(self):
     if self.storage.getIndex(self.indexId) is None:
       raise ValueError("Missing index in storage manager: %s" % self.indexId)
     if self.indexId:
-      bufPool = self.storage.bufferPool
+      bufPool  = self.storage.bufferPool
+      lhsKey   = self.lhsSchema.projector(self.lhsKeySchema)
+      rhsRelId = self.rhsPlan.relationId()
+      (lhsUnpack, rhsUnpack) = (self.lhsSchema.binrepr.unpack, self.rhsSchema.binrepr.unpack)
       for (lPageId, lhsPage) in self.lhsPlan:
-        for lTuple in lhsPage:
-          # Load the lhs once per inner loop.
-          joinExprEnv = self.loadSchema(self.lhsSchema, lTuple)
+        # Match the page's join keys against RHS tuples using the index.
+        lTuples = [(lhsKey(lTuple), bytes(lTuple)) for lTuple in lhsPage]
+        matches = dict(self.storage.fileMgr.lookupMany(rhsRelId, self.indexId, [k for (k, _) in lTuples]))
+        rTuples = self.fetchTuples(bufPool, [tId for tIds in matches.values() for tId in tIds])
 
-          # Match against RHS tuples using the index.
-          joinKey = self.lhsSchema.projectBinary(lTuple, self.lhsKeySchema)
-          matches = self.storage.fileMgr.lookupByIndex(self.rhsPlan.relationId(), self.indexId, joinKey)
+        for (joinKey, lTuple) in lTuples:
+          if joinKey not in matches:
+            continue
 
-          for rhsTupId in matches:
-            rhsPage = bufPool.getPage(rhsTupId.pageId)
-            rTuple  = rhsPage.getTuple(rhsTupId)
+          # Unpack the lhs once per inner loop.
+          lValues = lhsUnpack(lTuple)
 
-            # Load the RHS tuple fields.
-            joinExprEnv.update(self.loadSchema(self.rhsSchema, rTuple))
+          for rhsTupId in matches[joinKey]:
+            rTuple = rTuples.get(rhsTupId, None)
+            if rTuple is None:
+              continue
 
             # Evaluate any remaining join predicate, and output if we have a match.
-            fullMatch = eval(self.joinExpr, globals(), joinExprEnv) if self.joinExpr else True
+            rValues   = rhsUnpack(rTuple)
+            fullMatch = self.joinPredicate(lValues, rValues) if self.joinPredicate else True
             if fullMatch:
-              outputTuple = self.joinSchema.instantiate(*[joinExprEnv[f] for f in self.joinSchema.fields])
-              self.emitOutputTuple(self.joinSchema.pack(outputTuple))
+              self.emitOutputTuple(self.joinTuple(lValues, rValues))
 
-          # No need to track anything but the last output page when in batch mode.
-          if self.outputPages:
-            self.outputPages = [self.outputPages[-1]]
-
-      # Return an iterator to the output relation
-      return self.storage.pages(self.relationId())
+        yield
 
     else:
       raise ValueError("No index found while using an indexed nested loops join")
 
 
+  # Returns a dictionary of the tuples with the given ids, reading them page by page.
+  def fetchTuples(self, bufPool, tupleIds):
+    result = {}
+    byPage = sorted(set(tupleIds), key=lambda t: (t.pageId.pageIndex, t.tupleIndex))
+    for (pageId, pageTupleIds) in itertools.groupby(byPage, key=lambda t: t.pageId):
+      page = bufPool.getPage(pageId)
+      for tupleId in pageTupleIds:
+        tupleData = page.getTuple(tupleId)
+        if tupleData:
+          result[tupleId] = bytes(tupleData)
+    return result
+
+
   ##################################
   #
   # Hash join implementation.
@@ -263,43 +320,102 @@ class Join(Operator):
   def hashJoin(self):
     # Partition the LHS and RHS inputs, creating a temporary file for each partition.
     # We assume one-level of partitioning is sufficient and skip recurring.
+    (lhsUnpack, rhsUnpack) = (self.lhsSchema.binrepr.unpack, self.rhsSchema.binrepr.unpack)
     for (lPageId, lPage) in self.lhsPlan:
       for lTuple in lPage:
-        lPartEnv = self.loadSchema(self.lhsSchema, lTuple)
-        lPartKey = eval(self.lhsHashFn, globals(), lPartEnv)
+        lPartKey = self.lhsHash(lhsUnpack(lTuple))
         self.emitPartitionTuple(lPartKey, lTuple, left=True)
 
+    # Build a Bloom filter over the join keys of each LHS partition, sized from the
+    # partition file's tuple count. RHS tuples whose key is absent from the filter of
+    # their matching LHS partition are never written to a partition file, and an RHS
+    # partition without any matches is never created, nor read when pairing partitions.
+    if self.useBloomFilters:
+      for lPartRelId in self.partitionFiles[0].values():
+        self.storage.fileMgr.createBloomFilter(lPartRelId, self.lhsKeySchema, persist=False)
+
+    self.bloomSkipped = 0
     for (rPageId, rPage) in self.rhsPlan:
       for rTuple in rPage:
-        rPartEnv = self.loadSchema(self.rhsSchema, rTuple)
-        rPartKey = eval(self.rhsHashFn, globals(), rPartEnv)
+        rPartKey = self.rhsHash(rhsUnpack(rTuple))
+        if self.useBloomFilters and not self.partitionMayMatch(rPartKey, rTuple):
+          self.bloomSkipped += 1
+          continue
         self.emitPartitionTuple(rPartKey, rTuple, left=False)
 
     # Iterate over partition pairs and output matches
     # evaluating the join expression as necessary.
+    # Join keys are compared as byte slices of the packed tuples, before unpacking the RHS tuple.
+    lhsKey = self.lhsSchema.projector(self.lhsKeySchema)
+    rhsKey = self.rhsSchema.projector(self.rhsKeySchema)
     for ((lPageId, lPage), (rPageId, rPage)) in self.partitionPairs():
       for lTuple in lPage:
-        joinExprEnv = self.loadSchema(self.lhsSchema, lTuple)
+        lValues = lhsUnpack(lTuple)
+        lKey    = lhsKey(lTuple)
         for rTuple in rPage:
-          joinExprEnv.update(self.loadSchema(self.rhsSchema, rTuple))
-          output = \
-            ( self.lhsSchema.projectBinary(lTuple, self.lhsKeySchema) \
-                == self.rhsSchema.projectBinary(rTuple, self.rhsKeySchema) ) \
-            and ( eval(self.joinExpr, globals(), joinExprEnv) if self.joinExpr else True )
+          if lKey != rhsKey(rTuple):
+            continue
 
-          if output:
-            outputTuple = self.joinSchema.instantiate(*[joinExprEnv[f] for f in self.joinSchema.fields])
-            self.emitOutputTuple(self.joinSchema.pack(outputTuple))
+          rValues = rhsUnpack(rTuple)
+          output  = self.joinPredicate(lValues, rValues) if self.joinPredicate else True
 
-      # No need to track anything but the last output page when in batch mode.
-      if self.outputPages:
-        self.outputPages = [self.outputPages[-1]]
+          if output:
+            self.emitOutputTuple(self.joinTuple(lValues, rValues))
 
-    # Clean up partitions.
-    self.removePartitionFiles()
+      yield
 
-    # Return an iterator to the output relation
-    return self.storage.pages(self.relationId())
+  ##################################
+  #
+  # Batch-at-a-time implementation.
+  #
+  # The RHS batches are built into an in-memory table, hashed on the RHS join key
+  # for hash joins, and probed by the rows of each LHS batch. Nested loops joins
+  # compare each LHS row with all RHS rows. Indexed joins adapt their output pages,
+  # since their RHS is accessed through its index rather than its batches.
+  # With a work memory budget, the RHS is built in blocks fitting in work memory,
+  # and the LHS batches are rescanned once per block, as in block nested loops.
+  def batches(self):
+    if self.joinMethod == "indexed":
+      yield from super().batches()
+      return
+
+    predicate = self.batchJoinPredicate
+    if self.joinMethod == "hash":
+      lhsKey = [self.lhsSchema.fields.index(f) for f in self.lhsKeySchema.fields]
+      rhsKey = [self.rhsSchema.fields.index(f) for f in self.rhsKeySchema.fields]
+
+    for rhsValues in self.rhsBlocks(self.workMemoryTuples(self.rhsSchema)):
+      if self.joinMethod == "hash":
+        table = {}
+        for rValues in rhsValues:
+          table.setdefault(tuple(rValues[i] for i in rhsKey), []).append(rValues)
+        matches = lambda lValues: table.get(tuple(lValues[i] for i in lhsKey), ())
+      else:
+        matches = lambda lValues: rhsValues
+
+      for batch in self.lhsPlan.batches():
+        outputValues = []
+        for lValues in batch.values():
+          for rValues in matches(lValues):
+            if predicate is None or predicate(lValues, rValues):
+              outputValues.append(lValues + rValues)
+
+        if outputValues:
+          yield self.emitOutputBatch(Batch.fromValues(self.joinSchema, outputValues))
+
+  # Iterator over the RHS rows in blocks of at most the given number of rows,
+  # or in a single block if no block size is given.
+  def rhsBlocks(self, blockSize):
+    block = []
+    for batch in self.rhsPlan.batches():
+      for values in batch.values():
+        block.append(values)
+        if blockSize and len(block) >= blockSize:
+          yield block
+          block = []
+
+    if block:
+      yield block
 
   # Hash join helpers.
   def partitionRelationId(self, left, partitionId):
@@ -322,6 +438,16 @@ class Join(Operator):
     if partFile:
       partFile.insertTuple(partitionTuple)
 
+  # Returns whether an RHS tuple may join with the LHS partition of the given id,
+  # based on the partition's Bloom filter.
+  def partitionMayMatch(self, partitionId, rTuple):
+    lPartRelId = self.partitionFiles[0].get(partitionId, None)
+    if lPartRelId is None:
+      return False
+
+    rKey = self.rhsSchema.projector(self.rhsKeySchema)(rTuple)
+    return self.storage.fileMgr.mayContainKey(lPartRelId, self.lhsKeySchema, rKey)
+
   # Return pairs of pages from matching partitions.
   def partitionPairs(self):
     lKeys = self.partitionFiles[0].keys()
@@ -361,6 +487,7 @@ class Join(Operator):
             "rhsKeySchema=" + self.rhsKeySchema.toString() ,
             "lhsHashFn='" + self.lhsHashFn + "'" ,
             "rhsHashFn='" + self.rhsHashFn + "'" ]
+        + [ "bloomFilters=True" if self.useBloomFilters else None ]
         ))) + ")"
 
     return super().explain() + exprs
@@ -377,7 +504,7 @@ class Join(Operator):
     tS = self.rhsPlan.cardinality(estimated)
     pR = tR / (self.storage.bufferPool.pageSize / self.lhsPlan.schema().size)
     pS = tS / (self.storage.bufferPool.pageSize / self.rhsPlan.schema().size)
-    M = self.storage.bufferPool.numPages()
+    M = self.storage.workMemoryPages() or self.storage.bufferPool.numPages()
     pIDX = 0.5
     pK = 0.5
 
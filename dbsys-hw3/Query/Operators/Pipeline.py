@@ -0,0 +1,172 @@
+from Catalog.Schema            import Types
+from Query.Operator            import Operator
+from Query.Operators.TableScan import TableScan
+from Query.Operators.Select    import Select
+from Query.Operators.Project   import Project
+from Utils.ExpressionInfo      import ExpressionInfo
+
+class Pipeline(Operator):
+  """
+  A fused pipeline of selection and projection operators over a single input.
+
+  This requires the pipeline's stages as its parameters, as a list of Select and
+  Project operators ordered from the one closest to the input to the outermost one.
+
+  The stages are compiled into a single function per input page, which decodes each
+  input tuple, checks the selection predicates in order and encodes the projected
+  output tuple, without materializing the intermediate results of the stages.
+  Attributes are only decoded as needed by the next stage, thus tuples rejected by
+  a predicate are not decoded any further.
+  """
+  def __init__(self, subPlan, stages, **kwargs):
+    super().__init__(**kwargs)
+    self.subPlan = subPlan
+    self.stages  = stages
+
+    if not(self.stages) or any(not isinstance(stage, (Select, Project)) for stage in self.stages):
+      raise ValueError("Invalid pipeline stages, expected selections and projections")
+
+  # Returns the output schema of this operator
+  def schema(self):
+    return self.stages[-1].schema()
+
+  # Returns any input schemas for the operator if present
+  def inputSchemas(self):
+    return [self.subPlan.schema()]
+
+  # Returns a string describing the operator type
+  def operatorType(self):
+    return "Pipeline"
+
+  # Returns child operators if present
+  def inputs(self):
+    return [self.subPlan]
+
+  # Prepares the operator for execution, compiling its stages once into a function
+  # processing a page of its input.
+  def prepare(self, database):
+    super().prepare(database)
+    self.processPage = self.compilePipeline()
+
+  # Generates and compiles the pipeline's page processing function. The function
+  # passes every output tuple of the pipeline to the given emit function.
+  def compilePipeline(self):
+    schema = self.subPlan.schema()
+    env    = dict(globals(), _unpack0=schema.binrepr.unpack, _formatValue=Types.formatValue)
+    body   = ["_values0 = _unpack0(_tuple)"]
+
+    # The attributes bound since the last projection, and the packed current tuple.
+    (values, bound, output) = ("_values0", set(), "_tuple")
+
+    for (i, stage) in enumerate(self.stages, 1):
+      if isinstance(stage, Select):
+        attributes = ExpressionInfo(stage.selectExpr).getAttributes() - bound
+        body      += ExpressionInfo.attributeBindings(values, schema, attributes)
+        body      += ["if not (", stage.selectExpr, "):", "  continue"]
+        bound     |= attributes
+
+      else:
+        attributes = set()
+        packExprs  = []
+        for (field, typeDesc) in stage.schema().schema():
+          expr        = "(" + stage.projectExprs[field][0] + ")"
+          attributes |= ExpressionInfo(expr).getAttributes()
+          packExprs.append("_formatValue(" + expr + ", " + repr(typeDesc) + ")" \
+                             if typeDesc.startswith(("char", "text")) else expr)
+
+        body += ExpressionInfo.attributeBindings(values, schema, attributes - bound)
+
+        # Intermediate projections round trip through their output representation,
+        # thus later stages see the same values as over a materialized projection.
+        schema = stage.schema()
+        (values, bound, output) = ("_values" + str(i), set(), "_packed" + str(i))
+        env["_pack" + str(i)]   = schema.binrepr.pack
+        env["_unpack" + str(i)] = schema.binrepr.unpack
+        body.append(output + " = _pack" + str(i) + "(" + ", ".join(packExprs) + ")")
+        if i < len(self.stages):
+          body.append(values + " = _unpack" + str(i) + "(" + output + ")")
+
+    body.append("_emit(" + output + ")")
+
+    source    = "def _processPage(_page, _emit):\n" \
+                  + "  for _tuple in _page:\n" \
+                  + "".join("    " + line + "\n" for line in body)
+    namespace = dict(env)
+    exec(compile(source, "<pipeline>", "exec"), namespace)
+    return namespace["_processPage"]
+
+  # Returns the conjunction of the selection predicates directly above the input.
+  def inputPredicate(self):
+    predicates = []
+    for stage in self.stages:
+      if not isinstance(stage, Select):
+        break
+      predicates.append("(" + stage.selectExpr + ")")
+    return " and ".join(predicates) or None
+
+
+  # Iterator abstraction for pipeline operator.
+
+  def __iter__(self):
+    self.initializeOutput()
+    self.inputIterator = self.subPlan
+    self.inputFinished = False
+
+    # Scans directly below the pipeline skip pages using the relation's zone map.
+    predicate = self.inputPredicate()
+    if predicate and isinstance(self.subPlan, TableScan):
+      self.subPlan.restrictPages(predicate)
+
+    if self.pipelined:
+      self.inputIterator = iter(self.subPlan)
+    else:
+      self.outputIterator = self.processAllPages()
+
+    return self
+
+  def __next__(self):
+    if self.pipelined:
+      while not(self.inputFinished or self.isOutputPageReady()):
+        try:
+          pageId, page = next(self.inputIterator)
+          self.processInputPage(pageId, page)
+        except StopIteration:
+          self.inputFinished = True
+
+      return self.outputPage()
+
+    else:
+      return next(self.outputIterator)
+
+
+  # Page processing and control methods
+
+  # Page-at-a-time operator processing
+  def processInputPage(self, pageId, page):
+    self.processPage(page, self.emitOutputTuple)
+
+  # Set-at-a-time operator processing
+  def processAllPages(self):
+    if self.inputIterator is None:
+      self.inputIterator = self.subPlan
+
+    # Process all pages from the child operator.
+    try:
+      for (pageId, page) in self.inputIterator:
+        self.processInputPage(pageId, page)
+
+    # To support pipelined operation, processInputPage may raise a
+    # StopIteration exception during its work. We catch this and ignore in batch mode.
+    except StopIteration:
+      pass
+
+    # Return an iterator to the output relation
+    return self.outputRelationPages()
+
+
+  # Plan and statistics information
+
+  # Returns a single line description of the operator, listing its stages.
+  def explain(self):
+    stages = [stage.operatorType() + stage.explain()[len(Operator.explain(stage)):] for stage in self.stages]
+    return super().explain() + "(" + ", ".join(stages) + ")"
@@ -1,5 +1,7 @@
-from Catalog.Schema import DBSchema
-from Query.Operator import Operator
+from Catalog.Schema        import DBSchema, Types
+from Query.Batch           import Batch
+from Query.Operator        import Operator
+from Utils.ExpressionInfo  import ExpressionInfo
 
 class Project(Operator):
   """
@@ -36,6 +38,26 @@ class Project(Operator):
   def inputs(self):
     return [self.subPlan]
 
+  # Prepares the operator for execution, compiling its projection expressions into
+  # a single function from the unpacked tuples of its input to packed output tuples.
+  def prepare(self, database):
+    super().prepare(database)
+    outputSchema = self.schema()
+    packExprs    = []
+    for (field, typeDesc) in outputSchema.schema():
+      expr = "(" + self.projectExprs[field][0] + ")"
+      packExprs.append("_formatValue(" + expr + ", " + repr(typeDesc) + ")" \
+                         if typeDesc.startswith(("char", "text")) else expr)
+
+    env = dict(globals(), _pack=outputSchema.binrepr.pack, _formatValue=Types.formatValue)
+    self.projection = ExpressionInfo("_pack(" + ", ".join(packExprs) + ")") \
+                        .compileFunction([self.subPlan.schema()], env)
+
+    # Batch projections compute one output column per projection expression.
+    self.batchProjections = [ExpressionInfo(self.projectExprs[field][0]) \
+                               .compileBatchFunction(self.subPlan.schema(), globals()) \
+                               for field in outputSchema.fields]
+
   # Iterator abstraction for projection operator.
 
   def __iter__(self):
@@ -43,7 +65,9 @@ class Project(Operator):
     self.inputIterator = self.subPlan
     self.inputFinished = False
 
-    if not self.pipelined:
+    if self.pipelined:
+      self.inputIterator = iter(self.subPlan)
+    else:
       self.outputIterator = self.processAllPages()
 
     return self
@@ -69,12 +93,11 @@ class Project(Operator):
     outputSchema = self.schema()
 
     if set(locals().keys()).isdisjoint(set(inputSchema.fields)):
+      unpack     = inputSchema.binrepr.unpack
+      projection = self.projection
       for inputTuple in page:
-        # Execute the projection expressions.
-        projectExprEnv = self.loadSchema(inputSchema, inputTuple)
-        vals = {k : eval(v[0], globals(), projectExprEnv) for (k,v) in self.projectExprs.items()}
-        outputTuple = outputSchema.pack([vals[i] for i in outputSchema.fields])
-        self.emitOutputTuple(outputTuple)
+        # Execute the projection expressions on the tuple's unpacked fields.
+        self.emitOutputTuple(projection(unpack(inputTuple)))
 
     else:
       raise ValueError("Overlapping variables detected with operator schema")
@@ -89,17 +112,20 @@ class Project(Operator):
       for (pageId, page) in self.inputIterator:
         self.processInputPage(pageId, page)
 
-        # No need to track anything but the last output page when in batch mode.
-        if self.outputPages:
-          self.outputPages = [self.outputPages[-1]]
-
     # To support pipelined operation, processInputPage may raise a
     # StopIteration exception during its work. We catch this and ignore in batch mode.
     except StopIteration:
       pass
 
     # Return an iterator to the output relation
-    return self.storage.pages(self.relationId())
+    return self.outputRelationPages()
+
+  # Batch-at-a-time operator processing, computing the output columns of each input batch.
+  def batches(self):
+    for batch in self.subPlan.batches():
+      selection = batch.selected()
+      columns   = [projection(batch, selection) for projection in self.batchProjections]
+      yield self.emitOutputBatch(Batch(self.outputSchema, columns=columns))
 
 
   # Plan and statistics information
@@ -1,4 +1,6 @@
-from Query.Operator import Operator
+from Query.Operator            import Operator
+from Query.Operators.TableScan import TableScan
+from Utils.ExpressionInfo      import ExpressionInfo
 
 class Select(Operator):
   def __init__(self, subPlan, selectExpr, **kwargs):
@@ -22,6 +24,13 @@ class Select(Operator):
   def inputs(self):
     return [self.subPlan]
 
+  # Prepares the operator for execution, compiling its predicate once
+  # over the unpacked tuples of its input.
+  def prepare(self, database):
+    super().prepare(database)
+    self.predicate = ExpressionInfo(self.selectExpr).compileFunction([self.subPlan.schema()], globals())
+    self.batchPredicate = ExpressionInfo(self.selectExpr).compileBatchFunction(self.subPlan.schema(), globals(), filter=True)
+
 
   # Iterator abstraction for selection operator.
 
@@ -30,7 +39,13 @@ class Select(Operator):
     self.inputIterator = self.subPlan
     self.inputFinished = False
 
-    if not self.pipelined:
+    # Scans directly below the selection skip pages using the relation's zone map.
+    if isinstance(self.subPlan, TableScan):
+      self.subPlan.restrictPages(self.selectExpr)
+
+    if self.pipelined:
+      self.inputIterator = iter(self.subPlan)
+    else:
       self.outputIterator = self.processAllPages()
 
     return self
@@ -56,12 +71,11 @@ class Select(Operator):
   def processInputPage(self, pageId, page):
     schema = self.subPlan.schema()
     if set(locals().keys()).isdisjoint(set(schema.fields)):
+      unpack    = schema.binrepr.unpack
+      predicate = self.predicate
       for inputTuple in page:
-        # Load tuple fields into the select expression context
-        selectExprEnv = self.loadSchema(schema, inputTuple)
-
-        # Execute the predicate.
-        if eval(self.selectExpr, globals(), selectExprEnv):
+        # Execute the predicate on the tuple's unpacked fields.
+        if predicate(unpack(inputTuple)):
           self.emitOutputTuple(inputTuple)
     else:
       raise ValueError("Overlapping variables detected with operator schema")
@@ -76,17 +90,23 @@ class Select(Operator):
       for (pageId, page) in self.inputIterator:
         self.processInputPage(pageId, page)
 
-        # No need to track anything but the last output page when in batch mode.
-        if self.outputPages:
-          self.outputPages = [self.outputPages[-1]]
-
     # To support pipelined operation, processInputPage may raise a
     # StopIteration exception during its work. We catch this and ignore in batch mode.
     except StopIteration:
       pass
 
     # Return an iterator to the output relation
-    return self.storage.pages(self.relationId())
+    return self.outputRelationPages()
+
+  # Batch-at-a-time operator processing, narrowing the selection vector of each input batch.
+  def batches(self):
+    if isinstance(self.subPlan, TableScan):
+      self.subPlan.restrictPages(self.selectExpr)
+
+    for batch in self.subPlan.batches():
+      selection = self.batchPredicate(batch, batch.selected())
+      if selection:
+        yield self.emitOutputBatch(batch.select(selection))
 
 
   # Plan and statistics information
@@ -1,5 +1,7 @@
 import random
-from Query.Operator import Operator
+from Query.Batch          import Batch
+from Query.Operator       import Operator
+from Utils.ExpressionInfo import ExpressionInfo
 
 class TableScan(Operator):
 
@@ -8,6 +10,11 @@ class TableScan(Operator):
       super().__init__(**kwargs)
       self.relId      = relId
       self.relSchema  = schema
+      self.pageRanges = None
+
+      # Page counters for the most recent scan, with pages skipped by the zone map.
+      self.pagesRead    = 0
+      self.pagesSkipped = 0
     else:
       raise ValueError("Invalid relation name or schema for a table scan")
 
@@ -34,7 +41,9 @@ class TableScan(Operator):
 
   # Volcano-style iterator abstraction
   def __iter__(self):
-    self.pageIterator = self.storage.pages(self.relId)
+    self.pagesRead, self.pagesSkipped = (0, 0)
+    pageFilter = self.pageMayMatch if self.pageRanges else None
+    self.pageIterator = self.storage.pages(self.relId, pageFilter)
     self.nextPageId, self.nextPage = None, None
     self.pageSize, self.numPages, _ = self.storage.relationStats(self.relId)
 
@@ -57,6 +66,7 @@ class TableScan(Operator):
     while not(self.isOutputPageReady()):
       # Table scans in the storage engine return a pair of pageId and page
       pageId, page = next(self.pageIterator)
+      self.pagesRead += 1
       self.processInputPage(pageId, page)
     return self.outputPage()
 
@@ -95,6 +105,36 @@ class TableScan(Operator):
     self.nextPageId = pageId
     self.nextPage   = page
 
+  # Restricts the scan to the pages whose zone map allows the given predicate to hold,
+  # based on the ranges of the relation's numeric attributes in the predicate's conjuncts.
+  # This is used by selections directly above the scan.
+  def restrictPages(self, predicate):
+    zoneMap = self.storage.zoneMap(self.relId)
+    if zoneMap is not None:
+      exprInfo = ExpressionInfo(predicate)
+      ranges   = [(field, exprInfo.attributeRange(field)) for field in zoneMap.fields]
+      self.pageRanges = dict([(field, r) for (field, r) in ranges if r is not None]) or None
+
+  # Page filter for zone map skipping, counting the pages skipped.
+  def pageMayMatch(self, pageIndex):
+    if self.storage.zoneMap(self.relId).pageMayMatch(pageIndex, self.pageRanges):
+      return True
+    self.pagesSkipped += 1
+    return False
+
+  # Returns the scan's pages as columnar batches, one per page, without copying the
+  # pages through the scan's page iterator. Sampled scans adapt their sampled pages.
+  def batches(self):
+    if self.sampled:
+      yield from super().batches()
+      return
+
+    self.pagesRead, self.pagesSkipped = (0, 0)
+    pageFilter = self.pageMayMatch if self.pageRanges else None
+    for (pageId, page) in self.storage.pages(self.relId, pageFilter):
+      self.pagesRead += 1
+      yield Batch.fromPage(self.relSchema, page)
+
   # Table scans do not need this method since they do not produce any new output.
   def emitOutputTuple(self, tupleData):
     raise ValueError("Invalid use of emitOutputTuple in a table scan")
@@ -103,7 +143,8 @@ class TableScan(Operator):
 
   # Returns a single line description of the operator.
   def explain(self):
-    return super().explain() + "(" + self.relId + ")"
+    ranges = ", zones=" + ",".join(sorted(self.pageRanges.keys())) if self.pageRanges else ""
+    return super().explain() + "(" + self.relId + ranges + ")"
 
   # Returns the table's cardinality by using the storage engine.
   def cardinality(self, estimated):
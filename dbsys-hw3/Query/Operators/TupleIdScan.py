@@ -0,0 +1,115 @@
+import itertools
+from Query.Operator import Operator
+
+class TupleIdScan(Operator):
+  """
+  A base class for scans that fetch a relation's tuples by their tuple ids.
+
+  Subclasses produce the ids of the matching tuples, sorted by page and tuple
+  index, through matchingTupleIds. The scan groups these ids by page, so that
+  each heap page is read once, and produces tuples in heap order.
+
+  Subclasses may cache their matching tuple ids for cardinality estimation prior
+  to execution, and clear that cache in clearMatches, which is called whenever
+  the scan is restarted.
+
+  A scan's cost charges each heap page it fetches as a full page read, in the
+  per-tuple units of a table scan, on top of the tuples it retrieves. Thus a scan
+  fetching most of a relation's pages costs more than a table scan.
+  """
+
+  def __init__(self, relId, schema, **kwargs):
+    super().__init__(**kwargs)
+    self.relId     = relId
+    self.relSchema = schema
+
+  # Returns the output schema of this operator
+  def schema(self):
+    return self.relSchema
+
+  # Returns any input schemas for the operator if present
+  def inputSchemas(self):
+    return None
+
+  # Returns child operators if present
+  def inputs(self):
+    return []
+
+  # Returns the ids of the tuples to fetch, sorted by page and tuple index.
+  def matchingTupleIds(self):
+    raise NotImplementedError
+
+  # Drops any cached matches, so that a restarted scan sees the relation's current tuples.
+  def clearMatches(self):
+    pass
+
+
+  # Iterator abstraction for tuple id scans.
+
+  def __iter__(self):
+    self.initializeOutput()
+    self.clearMatches()
+    self.inputIterator = itertools.groupby(self.matchingTupleIds(), key=lambda t: t.pageId)
+    self.inputFinished = False
+
+    if not self.pipelined:
+      self.outputIterator = self.processAllPages()
+
+    return self
+
+  def __next__(self):
+    if self.pipelined:
+      while not(self.inputFinished or self.isOutputPageReady()):
+        try:
+          pageId, tupleIds = next(self.inputIterator)
+          self.processInputPage(pageId, self.storage.bufferPool.getPage(pageId), tupleIds)
+        except StopIteration:
+          self.inputFinished = True
+
+      return self.outputPage()
+
+    else:
+      return next(self.outputIterator)
+
+
+  # Page processing and control methods
+
+  # Emits the tuples with the given ids from a heap page.
+  def processInputPage(self, pageId, page, tupleIds):
+    for tupleId in tupleIds:
+      tupleData = page.getTuple(tupleId)
+      if tupleData:
+        self.emitOutputTuple(bytes(tupleData))
+
+  # Set-at-a-time operator processing
+  def processAllPages(self):
+    for (pageId, tupleIds) in self.inputIterator:
+      self.processInputPage(pageId, self.storage.bufferPool.getPage(pageId), tupleIds)
+
+    # Return an iterator to the output relation
+    return self.outputRelationPages()
+
+
+  # Plan and statistics information
+
+  # Returns the number of matching tuples.
+  def cardinality(self, estimated):
+    return len(self.matchingTupleIds())
+
+  # Returns the number of heap pages holding the matching tuples, assuming these are
+  # spread uniformly over the relation's pages (i.e., Cardenas' formula).
+  def pagesFetched(self, estimated):
+    _, numPages, _ = self.storage.relationStats(self.relId)
+    return numPages * (1 - (1 - 1 / numPages) ** self.cardinality(estimated)) if numPages else 0
+
+  # Returns the scan's cost as the per-tuple cost of the tuples retrieved and
+  # of the full heap pages fetched to retrieve them.
+  def cost(self, estimated):
+    _, numPages, numTuples = self.storage.relationStats(self.relId)
+    tuplesPerPage = numTuples / numPages if numPages else 0
+    return (self.cardinality(estimated) + self.pagesFetched(estimated) * tuplesPerPage) * self.tupleCost
+
+  # Returns the fraction of the relation's tuples matched by the scan.
+  def selectivity(self, estimated):
+    _, _, r = self.storage.relationStats(self.relId)
+    return self.cardinality(estimated) / r if r else 1.0
@@ -1,4 +1,5 @@
 from Catalog.Schema import DBSchema
+from Query.Batch    import Batch
 from Query.Operator import Operator
 
 class Union(Operator):
@@ -38,7 +39,9 @@ class Union(Operator):
     self.currentInputIterator = self.inputIterators[0][0]
     self.currentSchema        = self.inputIterators[0][1]
 
-    if not self.pipelined:
+    if self.pipelined:
+      self.currentInputIterator = iter(self.currentInputIterator)
+    else:
       self.outputIterator = self.processAllPages()
 
     return self
@@ -53,7 +56,7 @@ class Union(Operator):
         except StopIteration:
           self.inputIterators.pop(0)
           if self.inputIterators:
-            self.currentInputIterator = self.inputIterators[0][0]
+            self.currentInputIterator = iter(self.inputIterators[0][0])
             self.currentSchema        = self.inputIterators[0][1]
           else:
             self.inputFinished = True
@@ -82,14 +85,16 @@ class Union(Operator):
         for (pageId, page) in currentInputIterator:
           self.processInputPage(pageId, page)
 
-          # No need to track anything but the last output page when in batch mode.
-          if self.outputPages:
-            self.outputPages = [self.outputPages[-1]]
-
       # To support pipelined operation, processInputPage may raise a
       # StopIteration exception during its work. We catch this and ignore in batch mode.
       except StopIteration:
         pass
 
     # Return an iterator to the output relation
-    return self.storage.pages(self.relationId())
+    return self.outputRelationPages()
+
+  # Batch-at-a-time operator processing, passing along the batches of each input.
+  def batches(self):
+    for inputOp in self.inputs():
+      for batch in inputOp.batches():
+        yield self.emitOutputBatch(Batch(self.schema(), rows=batch.rows, columns=batch.columns, selection=batch.selection))
@@ -5,6 +5,9 @@ from Query.Operators.Join import Join
 from Query.Operators.Project import Project
 from Query.Operators.Select import Select
 from Query.Operators.TableScan import TableScan
+from Query.Operators.IndexOnlyScan import IndexOnlyScan
+from Query.Operators.IndexScan import IndexScan
+from Query.Operators.BitmapScan import BitmapScan
 from Utils.ExpressionInfo import ExpressionInfo
 from Catalog.Schema import DBSchema
 import experiments
@@ -83,7 +86,7 @@ newQuery = db.optimizer.pushdownOperators(query5)
 
     if operator.operatorType() == 'Select':
       selectOperator = operator
-      selectOperator.subplan = self.singlePushDown(selectOperator.subPlan)
+      selectOperator.subPlan = self.singlePushDown(selectOperator.subPlan)
 
       subPlan = selectOperator.subPlan
       subplanType = subPlan.operatorType()
@@ -122,7 +125,7 @@ newQuery = db.optimizer.pushdownOperators(query5)
           selectOperator.subPlan.rhsPlan = self.singlePushDown(Select(selectOperator.subPlan.rhsPlan, sendToRight))
         if len(kept) > 0:
           kept = kept[:-5]
-          return Select(selectOperator.subplan, kept)
+          return Select(selectOperator.subPlan, kept)
 
       elif subplanType == 'UnionAll':
         subPlan.lhsPlan = self.singlePushDown(Select(subPlan.lhsPlan, selectOperator.selectExpr))
@@ -142,15 +145,18 @@ newQuery = db.optimizer.pushdownOperators(query5)
       subPlan = projectOperator.subPlan
       subplanType = subPlan.operatorType()
 
+      # Projections move beneath a selection whose attributes they pass through unchanged.
       if subplanType == 'Select':
         selectCriteria = ExpressionInfo(subPlan.selectExpr).getAttributes()
 
         for selection in selectCriteria:
-          if selection not in operator.projectExprs:
+          if selection not in operator.projectExprs or operator.projectExprs[selection][0] != selection:
             return operator
 
-        operator.subPlan = operator.subPlan.subPlan
-        operator.subPlan.subPlan = self.singlePushDown(operator)
+        selectOperator          = subPlan
+        projectOperator.subPlan = selectOperator.subPlan
+        selectOperator.subPlan  = self.singlePushDown(projectOperator)
+        return selectOperator
 
       elif subplanType.endswith('Join'):
         lhsPlan = subPlan.lhsPlan
@@ -401,13 +407,117 @@ newQuery = db.optimizer.pushdownOperators(query5)
     return joins, tableIDs, optimalSubPlans, fields, nubPlan
 
 
-          # Optimize the given query plan, returning the resulting improved plan.
-  # This should perform operation pushdown, followed by join order selection.
+  # Returns a plan where table scans are replaced by index-only scans over a covering
+  # index, whenever the operators above a scan reference only attributes held by the
+  # key and included attributes of one of the relation's indexes.
+  def pickIndexOnlyScans(self, plan):
+    plan.root = self.indexOnlyRewrite(plan.root, None)
+    plan.prepare(self.db)
+    return plan
+
+  # Rewrites the given operator's subtree, where 'required' is the set of attributes
+  # referenced by the operator's ancestors, or None if the full output is required.
+  # Index-only scans output the index's key attributes followed by its included
+  # attributes, rather than the relation's schema. Thus scans are only rewritten
+  # beneath a projection, which references its input attributes by name, and never
+  # where the full output is required, e.g., at the plan root or beneath a join.
+  def indexOnlyRewrite(self, operator, required):
+    if isinstance(operator, TableScan):
+      if required is None:
+        return operator
+
+      indexManager = self.db.storageEngine().fileMgr.indexManager
+      indexId      = indexManager.coveringIndex(operator.relId, required)
+      if indexId is None:
+        return operator
+
+      keySchema = indexManager.indexKeySchema(operator.relId, indexId)
+      return IndexOnlyScan(operator.relId, operator.schema(), indexId, keySchema, indexManager.includedSchema(indexId))
+
+    elif isinstance(operator, Project):
+      attributes = set()
+      for (expr, _) in operator.projectExprs.values():
+        attributes |= ExpressionInfo(expr).getAttributes()
+      operator.subPlan = self.indexOnlyRewrite(operator.subPlan, attributes)
+
+    elif isinstance(operator, Select):
+      attributes = None if required is None else required | ExpressionInfo(operator.selectExpr).getAttributes()
+      operator.subPlan = self.indexOnlyRewrite(operator.subPlan, attributes)
+
+    elif hasattr(operator, 'lhsPlan'):
+      operator.lhsPlan = self.indexOnlyRewrite(operator.lhsPlan, None)
+      operator.rhsPlan = self.indexOnlyRewrite(operator.rhsPlan, None)
+
+    elif hasattr(operator, 'subPlan'):
+      operator.subPlan = self.indexOnlyRewrite(operator.subPlan, None)
+
+    return operator
+
+  # Returns a plan where table scans beneath selections are replaced by index scans,
+  # whenever the selection predicate restricts the leading attribute of an index key
+  # to a range, and the index scan retrieves fewer tuples than the table scan.
+  # Equality predicates over attributes with bitmap indexes may instead be answered
+  # by a bitmap scan, combining the bitmaps of conjunctions and disjunctions.
+  # The selection is kept above the index scan to check the remaining predicates.
+  def pickIndexScans(self, plan):
+    for (_, operator) in plan.flatten():
+      if isinstance(operator, Select) and isinstance(operator.subPlan, TableScan):
+        operator.subPlan = self.indexScanFor(operator.subPlan, operator.selectExpr)
+    plan.prepare(self.db)
+    return plan
+
+  # Returns the cheapest index scan over the given table scan's relation for a
+  # selection predicate, or the table scan itself if no index scan is cheaper.
+  # Scans are compared by their cost together with that of the selection above
+  # them, which checks the predicate on every tuple the scan retrieves.
+  def indexScanFor(self, tableScan, selectExpr):
+    indexManager = self.db.storageEngine().fileMgr.indexManager
+    exprInfo     = ExpressionInfo(selectExpr)
+    selectCost   = lambda scan: scan.cost(True) + scan.cardinality(True) * scan.tupleCost
+    best         = tableScan
+    bestCost     = selectCost(tableScan)
+
+    for (keySchema, _, indexId) in indexManager.indexes(tableScan.relId):
+      keyRange = exprInfo.attributeRange(keySchema.fields[0])
+      if keyRange is not None:
+        (low, lowInclusive, high, highInclusive) = keyRange
+
+        # Unordered (hash) indexes only help with equality predicates on their full key.
+        if not indexManager.seekableRange(tableScan.relId, indexId, low, high, lowInclusive, highInclusive):
+          continue
+
+        indexScan = IndexScan(tableScan.relId, tableScan.schema(), indexId, keySchema, \
+                              low, high, lowInclusive, highInclusive)
+        indexScan.prepare(self.db)
+        indexCost = selectCost(indexScan)
+        if indexCost < bestCost:
+          best, bestCost = indexScan, indexCost
+
+    # Bitmap scans are skipped if a term's value cannot be encoded for its attribute.
+    bitmapIndexes = indexManager.bitmapIndexes(tableScan.relId)
+    terms         = exprInfo.equalityTerms(set(bitmapIndexes)) if bitmapIndexes else None
+    terms         = indexManager.bitmapTerms(tableScan.relId, terms) if terms is not None else None
+    if terms is not None:
+      bitmapScan = BitmapScan(tableScan.relId, tableScan.schema(), terms)
+      bitmapScan.prepare(self.db)
+      bitmapCost = selectCost(bitmapScan)
+      if bitmapCost < bestCost:
+        best, bestCost = bitmapScan, bitmapCost
+
+    return best
+
+  # Optimize the given query plan, returning the resulting improved plan.
+  # This should perform operation pushdown, followed by join order selection,
+  # and the use of indexes for index-only scans and index range scans. Finally, the
+  # remaining chains of selections and projections are fused into pipelines, and the
+  # plan is pipelined, passing transient pages between its operators.
   def optimizeQuery(self, plan):
     pushedDown_plan = self.pushdownOperators(plan)
     joinPicked_plan = self.pickJoinOrder(pushedDown_plan)
+    coverPicked_plan = self.pickIndexOnlyScans(joinPicked_plan)
+    indexPicked_plan = self.pickIndexScans(coverPicked_plan)
 
-    return joinPicked_plan
+    return indexPicked_plan.fusePipelines().usePipelining().prepare(self.db)
 #
 
 # if __name__ == "__main__":
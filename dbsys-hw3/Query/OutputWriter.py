@@ -0,0 +1,75 @@
+class OutputWriter:
+  """
+  A page writer for the output tuples of an operator.
+
+  The writer fills one page at a time, writing each tuple at a cursor into the page's
+  data area rather than searching the page header for a free tuple. The header marks
+  the written tuples as used once the page is sealed, that is when the page is full,
+  or when a partially filled page is read as the operator's output.
+
+  Full pages are handed off without checking their header again. For materialized
+  output, each page is written to the operator's temporary relation when the next page
+  is allocated, and its buffer pool frame is recycled for that next page. The page
+  being filled is pinned, so that the pool does not evict it while it is written.
+  Pipelined operators instead fill transient pages, appended to their output pages.
+  """
+
+  def __init__(self, operator):
+    self.operator  = operator
+    self.pipelined = operator.pipelined
+    self.storage   = operator.storage
+    self.tempFile  = None if self.pipelined else operator.tempFile
+
+    self.pageId, self.page, self.buffer = (None, None, None)
+    (self.cursor, self.sealed, self.capacity) = (0, 0, 0)
+    (self.offset, self.tupleSize) = (0, operator.schema().size)
+
+  # Writes a tuple to the current output page, allocating a new page as necessary.
+  def write(self, tupleData):
+    if self.cursor == self.capacity:
+      self.nextPage()
+
+    end = self.offset + self.tupleSize
+    self.buffer[self.offset:end] = tupleData
+    self.offset  = end
+    self.cursor += 1
+
+    # Seal full pages immediately, thus they appear full to the operator's iterator.
+    if self.cursor == self.capacity:
+      self.sealPage()
+
+  # Marks the tuples written to the current page since it was last sealed as used.
+  def sealPage(self):
+    if self.sealed < self.cursor:
+      self.page.header.useTupleRange(self.sealed, self.cursor)
+      self.sealed = self.cursor
+
+  # Hands off the current page, and starts filling a new page.
+  def nextPage(self):
+    self.sealPage()
+    if self.buffer is not None:
+      self.buffer.release()
+
+    if self.pipelined:
+      page = self.operator.transientPage()
+      self.operator.outputPages.append((page.pageId, page))
+
+    else:
+      bufPool = self.storage.bufferPool
+      if self.pageId is not None:
+        bufPool.unpinPage(self.pageId)
+      page = bufPool.installNewPage(self.tempFile.allocatePage(), self.pageId, pinned=True)
+
+    page.setDirty(True)
+    self.pageId, self.page, self.buffer = (page.pageId, page, page.getbuffer())
+    (self.cursor, self.sealed, self.capacity) = (0, 0, page.header.maxTuples())
+    self.offset = page.header.dataOffset()
+
+  # Completes the output, sealing and unpinning the last page.
+  def close(self):
+    self.sealPage()
+    if not self.pipelined and self.pageId is not None:
+      self.storage.bufferPool.unpinPage(self.pageId)
+      self.buffer.release()
+      self.pageId, self.page, self.buffer = (None, None, None)
+      (self.cursor, self.sealed, self.capacity) = (0, 0, 0)
@@ -4,11 +4,15 @@ from collections import deque
 from Catalog.Schema  import DBSchema
 
 from Query.Operators.TableScan import TableScan
+from Query.Operators.IndexOnlyScan import IndexOnlyScan
+from Query.Operators.IndexScan import IndexScan
+from Query.Operators.BitmapScan import BitmapScan
 from Query.Operators.Select    import Select
 from Query.Operators.Project   import Project
 from Query.Operators.Union     import Union
 from Query.Operators.Join      import Join
 from Query.Operators.GroupBy   import GroupBy
+from Query.Operators.Pipeline  import Pipeline
 
 class Plan:
   """
@@ -56,7 +60,7 @@ class Plan:
 
   # Returns the relations used by the query.
   def relations(self):
-    return [op.relationId() for (_,op) in self.flatten() if isinstance(op, TableScan)]
+    return [op.relId for (_,op) in self.flatten() if isinstance(op, (TableScan, IndexScan, IndexOnlyScan, BitmapScan))]
 
   # Pre-order depth-first flattening of the query tree.
   def flatten(self):
@@ -91,6 +95,11 @@ class Plan:
   def __iter__(self):
     return iter(self.root)
 
+  # Iterator over the query results as columnar batches (see Query.Batch),
+  # using the batch protocol of the plan's operators.
+  def batches(self):
+    return self.root.batches()
+
   # Plan and statistics information.
 
   # Returns a description for the entire query plan, based on the
@@ -132,10 +141,61 @@ class Plan:
     self.root.useSampling(False, scaleFactor)
     return self.sampleCardinality * scaleFactor
 
+  # Configures all operators in the plan to pass their output pages directly to their
+  # parent as transient pages, rather than writing a temporary relation per operator
+  # through the buffer pool. Pipeline breakers (i.e., hash joins and group-bys) still
+  # materialize their partitions, and pass on their output once partitioning is done.
+  def usePipelining(self, pipelined=True):
+    if self.root:
+      self.root.usePipelining(pipelined)
+      return self
+    else:
+      raise ValueError("Invalid query plan")
+
   def pushdownOperators(self):
     self.root = self.root.pushdownOperators()
     return self
 
+  # Fuses chains of selections and projections into pipeline operators, evaluating
+  # each chain in a single pass over its input without intermediate relations.
+  def fusePipelines(self):
+    if self.root:
+      self.root = self.fuseOperator(self.root)
+      return self
+    else:
+      raise ValueError("Invalid query plan")
+
+  # Returns the given operator's subtree, with its selection and projection chains fused.
+  # The operators on the path from the root are tracked to reject cyclic plans.
+  def fuseOperator(self, operator, ancestors=None):
+    ancestors = set() if ancestors is None else ancestors
+    stages    = []
+    while isinstance(operator, (Select, Project)):
+      if id(operator) in ancestors:
+        raise ValueError("Invalid query plan, operators form a cycle")
+      ancestors.add(id(operator))
+      stages.insert(0, operator)
+      operator = operator.subPlan
+
+    if id(operator) in ancestors:
+      raise ValueError("Invalid query plan, operators form a cycle")
+    ancestors.add(id(operator))
+
+    if hasattr(operator, 'lhsPlan'):
+      operator.lhsPlan = self.fuseOperator(operator.lhsPlan, set(ancestors))
+      operator.rhsPlan = self.fuseOperator(operator.rhsPlan, set(ancestors))
+
+    elif hasattr(operator, 'subPlan'):
+      operator.subPlan = self.fuseOperator(operator.subPlan, ancestors)
+
+    if stages:
+      stages[0].subPlan = operator
+
+    if len(stages) < 2:
+      return stages[0] if stages else operator
+
+    return Pipeline(operator, stages, pipeline=stages[-1].pipelined)
+
 class PlanBuilder:
   """
   A query plan builder class that can be used for LINQ-like construction of queries.
@@ -233,6 +293,22 @@ class PlanBuilder:
   >>> sorted([(tup.id, tup.id2) for tup in q5results]) # doctest:+ELLIPSIS
   [(0, 0), (1, 1), (2, 2), ..., (18, 18), (19, 19)]
 
+  ### Hash join with Bloom filters over the LHS partitions, skipping non-matching RHS tuples.
+  >>> query5b = db.query().fromTable('employee').where('id < 5').join( \
+          db.query().fromTable('employee'), \
+          rhsSchema=e2schema, \
+          method='hash', bloomFilters=True, \
+          lhsHashFn='hash(id) % 4',  lhsKeySchema=keySchema, \
+          rhsHashFn='hash(id2) % 4', rhsKeySchema=keySchema2, \
+        ).finalize()
+
+  >>> q5bresults = [query5b.schema().unpack(tup) for page in db.processQuery(query5b) for tup in page[1]]
+  >>> sorted([(tup.id, tup.id2) for tup in q5bresults])
+  [(0, 0), (1, 1), (2, 2), (3, 3), (4, 4)]
+
+  >>> query5b.root.bloomSkipped >= 10
+  True
+
   ### Group by aggregate query
   ### SELECT id, max(age) FROM Employee GROUP BY id
   >>> aggMinMaxSchema = DBSchema('minmax', [('minAge', 'int'), ('maxAge','int')])
@@ -253,6 +329,75 @@ class PlanBuilder:
   >>> sorted([(tup.id, tup.minAge, tup.maxAge) for tup in q6results]) # doctest:+ELLIPSIS
   [(0, 20, 20), (1, 22, 22), ..., (18, 56, 56), (19, 58, 58)]
 
+  ### Index-only scan over a covering index, including the age attribute in the index.
+  ### SELECT age FROM Employee WHERE id < 5
+  >>> ageSchema = DBSchema('employeeAge', [('age', 'int')])
+  >>> indexId   = db.storageEngine().createIndex('employee', schema, keySchema, False, build=True, include=ageSchema)
+  >>> query7 = db.query().fromIndex('employee', indexId).where("id < 5").select({'age': ('age', 'int')}).finalize()
+
+  >>> print(query7.explain()) # doctest: +ELLIPSIS
+  Project[...,cost=...](projections={'age': ('age', 'int')})
+    Select[...,cost=...](predicate='id < 5')
+      IndexOnlyScan[...,cost=...](employee, index=employeeKey[(id,int)], include=employeeAge[(age,int)])
+
+  >>> query7.relations()
+  ['employee']
+
+  >>> [query7.schema().unpack(tup).age for page in db.processQuery(query7) for tup in page[1]]
+  [20, 22, 24, 26, 28]
+
+  ### Index range scan beneath a selection.
+  ### SELECT * FROM Employee WHERE id >= 12 and id < 15 and age > 45
+  >>> predicate = "id >= 12 and id < 15 and age > 45"
+  >>> query9 = Plan(root=Select(IndexScan('employee', schema, indexId, keySchema, 12, 15, True, False), predicate)).prepare(db)
+
+  >>> print(query9.explain()) # doctest: +ELLIPSIS
+  Select[...,cost=...](predicate='id >= 12 and id < 15 and age > 45')
+    IndexScan[...,cost=...](employee, index=employeeKey[(id,int)], range=[12, 15))
+
+  >>> query9.root.subPlan.cardinality(True)
+  3
+
+  >>> [tuple(schema.unpack(tup)) for page in db.processQuery(query9) for tup in page[1]]
+  [(13, 46), (14, 48)]
+
+  ### Index nested loops join, probing the index once per LHS page with the page's keys.
+  ### SELECT * FROM Employee E2 JOIN Employee E1 ON E2.id2 = E1.id WHERE E2.id2 < 5
+  >>> query12 = db.query().fromTable('employee').where('id < 5').join( \
+          db.query().fromTable('employee'), \
+          lhsSchema=e2schema, \
+          method='indexed', indexId=indexId, lhsKeySchema=keySchema2 \
+        ).finalize()
+
+  >>> print(query12.explain()) # doctest: +ELLIPSIS
+  IndexJoin[...,cost=...](indexKeySchema=employeeKey2[(id2,int)])
+    TableScan[...,cost=...](employee)
+    Select[...,cost=...](predicate='id < 5')
+      TableScan[...,cost=...](employee)
+
+  >>> [tuple(query12.schema().unpack(tup)) for page in db.processQuery(query12) for tup in page[1]]
+  [(0, 20, 0, 20), (1, 22, 1, 22), (2, 24, 2, 24), (3, 26, 3, 26), (4, 28, 4, 28)]
+
+  ### Bitmap scan, combining the bitmaps of equality predicates on low-cardinality attributes.
+  ### SELECT * FROM Employee WHERE (age == 20 or age == 58) and id < 5
+  >>> ageBitmapId = db.storageEngine().createIndex('employee', schema, ageSchema, False, build=True, indexType='bitmap')
+  >>> from Utils.ExpressionInfo import ExpressionInfo
+  >>> predicate   = "(age == 20 or age == 58) and id < 5"
+  >>> terms       = ExpressionInfo(predicate).equalityTerms({'age'})
+  >>> query11 = Plan(root=Select(BitmapScan('employee', schema, terms), predicate)).prepare(db)
+
+  >>> print(query11.explain()) # doctest: +ELLIPSIS
+  Select[...,cost=...](predicate='(age == 20 or age == 58) and id < 5')
+    BitmapScan[...,cost=...](employee, terms='(age == 20 or age == 58)')
+
+  >>> query11.root.subPlan.cardinality(True)
+  2
+
+  >>> [tuple(schema.unpack(tup)) for page in db.processQuery(query11) for tup in page[1]]
+  [(0, 20)]
+
+  >>> db.storageEngine().removeIndex('employee', ageBitmapId)
+
   # Populate employees relation with another 10000 tuples
   >>> for tup in [schema.pack(schema.instantiate(i, math.ceil(random.gauss(45, 25)))) for i in range(10000)]:
   ...    _ = db.insertTuple(schema.name, tup)
@@ -264,6 +409,110 @@ class PlanBuilder:
   >>> estimatedSize > 0
   True
 
+  ### Zone maps let scans skip the pages whose id range lies outside of the predicate.
+  ### SELECT * FROM Employee WHERE id >= 5000 and id < 5010
+  >>> query10 = db.query().fromTable('employee').where("id >= 5000 and id < 5010").finalize()
+  >>> len([tup for page in db.processQuery(query10) for tup in page[1]])
+  10
+
+  >>> print(query10.explain()) # doctest: +ELLIPSIS
+  Select[...,cost=...](predicate='id >= 5000 and id < 5010')
+    TableScan[...,cost=...](employee, zones=id)
+
+  >>> scan = query10.root.subPlan
+  >>> (scan.pagesRead <= 2, scan.pagesRead + scan.pagesSkipped == db.storageEngine().relationStats('employee')[1])
+  (True, True)
+
+  ### Expressions are compiled once per operator, decoding character attributes for
+  ### predicates and encoding character results of projections.
+  ### SELECT upper(name), did * 2 FROM Dept WHERE name != 'sales' and did > 0
+  >>> db.createRelation('dept', [('did', 'int'), ('name', 'char(10)')])
+  >>> deptSchema = db.relationSchema('dept')
+  >>> _ = db.insertTuples('dept', [deptSchema.pack(deptSchema.instantiate(i, n)) for (i, n) in enumerate(['sales', 'ops', 'eng'])])
+  >>> query12 = db.query().fromTable('dept').where("name != 'sales' and did > 0") \
+                .select({'title': ('name.upper()', 'char(10)'), 'did2': ('did * 2', 'int')}).finalize()
+  >>> [tuple(query12.schema().unpack(tup)) for page in db.processQuery(query12) for tup in page[1]]
+  [('OPS', 2), ('ENG', 4)]
+
+  ### Chains of selections and projections are fused into a single pipeline operator,
+  ### evaluated in one pass over the scanned pages.
+  >>> query13 = db.query().fromTable('dept').where("did > 0").where("name != 'sales'") \
+                .select({'title': ('name.upper()', 'char(10)'), 'did2': ('did * 2', 'int')}).finalize()
+  >>> print(query13.fusePipelines().prepare(db).explain()) # doctest: +ELLIPSIS
+  Pipeline[...,cost=...](Select(predicate='did > 0'), Select(predicate='name != 'sales''), Project(projections=...))
+    TableScan[...,cost=...](dept)
+  >>> [tuple(query13.schema().unpack(tup)) for page in db.processQuery(query13) for tup in page[1]]
+  [('OPS', 2), ('ENG', 4)]
+
+  ### Projections are pushed beneath selections on the attributes they keep, and still fuse.
+  >>> query15 = db.query().fromTable('dept').where("name == 'ops'").select({'name': ('name', 'char(10)')}).finalize()
+  >>> query15 = db.optimizer.pushdownOperators(query15).fusePipelines()
+  >>> print(query15.prepare(db).explain()) # doctest: +ELLIPSIS
+  Pipeline[...,cost=...](Project(projections=...), Select(predicate='name == 'ops''))
+    TableScan[...,cost=...](dept)
+  >>> [tuple(query15.schema().unpack(tup)) for page in db.processQuery(query15) for tup in page[1]]
+  [('ops',)]
+
+  ### Pipelined plans pass transient output pages from operator to operator, without
+  ### creating temporary relations outside of pipeline breakers.
+  >>> tmpRelations = set(r for r in db.storageEngine().relations() if r.startswith('tmp_'))
+  >>> query14 = db.query().fromTable('dept').where("did > 1").union( \
+                db.query().fromTable('dept').where("name == 'sales'")) \
+                .select({'did': ('did', 'int')}).finalize().usePipelining()
+  >>> [tuple(query14.schema().unpack(tup)) for page in db.processQuery(query14) for tup in page[1]]
+  [(2,), (0,)]
+  >>> set(r for r in db.storageEngine().relations() if r.startswith('tmp_')) == tmpRelations
+  True
+
+  ### Pipelined nested-loops joins also stream their output, one LHS page at a time.
+  >>> d2schema = db.relationSchema('dept').rename('dept2', {'did':'did2', 'name':'name2'})
+  >>> query16 = db.query().fromTable('dept').join( \
+                db.query().fromTable('dept'), rhsSchema=d2schema, \
+                method='nested-loops', expr='did == did2') \
+                .select({'did': ('did', 'int')}).finalize().usePipelining()
+  >>> sorted(tuple(query16.schema().unpack(tup)) for page in db.processQuery(query16) for tup in page[1])
+  [(0,), (1,), (2,)]
+  >>> set(r for r in db.storageEngine().relations() if r.startswith('tmp_')) == tmpRelations
+  True
+
+  ### Plans also process columnar batches, with each operator consuming its inputs' batches.
+  ### SELECT M.mid, upper(D.name) FROM Mgr M, Dept D WHERE M.dept == D.did and M.mid > 10
+  >>> db.createRelation('mgr', [('mid', 'int'), ('dept', 'int')])
+  >>> mgrSchema = db.relationSchema('mgr')
+  >>> _ = db.insertTuples('mgr', [mgrSchema.pack(mgrSchema.instantiate(m, d)) for (m, d) in [(10, 0), (11, 2), (12, 2), (13, 5)]])
+  >>> query15 = db.query().fromTable('mgr').where("mid > 10").join( \
+                db.query().fromTable('dept'), method='hash', \
+                lhsHashFn='dept % 4', lhsKeySchema=DBSchema('mKey', [('dept', 'int')]), \
+                rhsHashFn='did % 4', rhsKeySchema=DBSchema('dKey', [('did', 'int')])) \
+                .select({'mid': ('mid', 'int'), 'name': ('name.upper()', 'char(10)')}).finalize()
+  >>> sorted(values for batch in query15.prepare(db).batches() for values in batch.values())
+  [(11, 'ENG'), (12, 'ENG')]
+  >>> sorted(tuple(query15.schema().unpack(tup)) for page in db.processQuery(query15) for tup in page[1])
+  [(11, 'ENG'), (12, 'ENG')]
+
+  ### Batch joins and group-bys keep within the work memory budget, joining RHS blocks
+  ### of a page each here, and falling back to partitions once the groups outgrow it.
+  >>> db.createRelation('nums', [('n', 'int'), ('m', 'int')])
+  >>> numsSchema = db.relationSchema('nums')
+  >>> _ = db.insertTuples('nums', [numsSchema.pack(numsSchema.instantiate(i, i % 7)) for i in range(2000)])
+  >>> n2Schema = numsSchema.rename('nums2', {'n':'n2', 'm':'m2'})
+  >>> query17 = db.query().fromTable('nums').join( \
+                db.query().fromTable('nums'), rhsSchema=n2Schema, method='hash', \
+                lhsHashFn='n % 4', lhsKeySchema=DBSchema('nKey', [('n', 'int')]), \
+                rhsHashFn='n2 % 4', rhsKeySchema=DBSchema('n2Key', [('n2', 'int')])) \
+                .groupBy(groupSchema=DBSchema('nKey', [('n', 'int')]), \
+                         aggSchema=DBSchema('nAgg', [('total', 'int')]), \
+                         groupExpr=(lambda e: e.n), \
+                         aggExprs=[(0, lambda acc, e: acc + e.m2, lambda x: x)], \
+                         groupHashFn=(lambda gbVal: gbVal[0] % 4)).finalize().prepare(db)
+  >>> db.storageEngine().workMemory = db.storageEngine().bufferPool.pageSize
+  >>> join = query17.root.subPlan
+  >>> len(list(join.rhsBlocks(join.workMemoryTuples(join.rhsSchema))))
+  2
+  >>> sorted(values for batch in query17.batches() for values in batch.values()) == [(i, i % 7) for i in range(2000)]
+  True
+  >>> db.storageEngine().workMemory = None
+
   """
 
   def __init__(self, **kwargs):
@@ -289,6 +538,18 @@ class PlanBuilder:
       schema = self.database.relationSchema(relId)
       return PlanBuilder(operator=TableScan(relId, schema), db=self.database)
 
+  # Scans a covering index of a relation, without accessing the relation's pages.
+  def fromIndex(self, relId, indexId):
+    if self.database:
+      schema       = self.database.relationSchema(relId)
+      indexManager = self.database.storageEngine().fileMgr.indexManager
+      keySchema    = indexManager.indexKeySchema(relId, indexId)
+      if keySchema is None:
+        raise ValueError("Invalid index for an index-only scan on " + relId)
+
+      scan = IndexOnlyScan(relId, schema, indexId, keySchema, indexManager.includedSchema(indexId))
+      return PlanBuilder(operator=scan, db=self.database)
+
   def where(self, conditionExpr):
     if self.operator:
       return PlanBuilder(operator=Select(self.operator, conditionExpr), db=self.database)
@@ -0,0 +1,113 @@
+import hashlib, math
+from struct import Struct
+
+class BloomFilter:
+  """
+  A Bloom filter over binary keys, for skipping lookups and joins on absent keys.
+
+  The filter is a bit array of 'numBits' bits, where each key sets 'numHashes' bits.
+  Bit positions are derived by double hashing from a single 128-bit digest of the key.
+  A filter never reports a key it holds as missing, while a key that was not added
+  is reported as present with a probability close to the false positive rate the
+  filter was sized for, as long as it holds no more keys than its capacity.
+
+  Keys cannot be removed from a filter, thus deleted keys remain as false positives
+  until the filter is rebuilt.
+
+  >>> bf = BloomFilter(capacity=1000, falsePositiveRate=0.01)
+  >>> (bf.numBits, bf.numHashes)
+  (9586, 7)
+
+  >>> keys = [str(i).encode() for i in range(1000)]
+  >>> for key in keys:
+  ...   bf.add(key)
+
+  >>> all(key in bf for key in keys)
+  True
+
+  >>> falsePositives = sum(1 for i in range(1000, 11000) if str(i).encode() in bf)
+  >>> falsePositives < 200
+  True
+
+  # Test filter serialization.
+  >>> bf2 = BloomFilter.unpack(bf.pack())
+  >>> (bf2.numBits, bf2.numHashes, bf2.count, bf2.bits == bf.bits)
+  (9586, 7, 1000, True)
+  """
+
+  defaultFalsePositiveRate = 0.01
+
+  # Filters maintained under insertions are sized for this many times their current
+  # number of keys, leaving headroom for insertions before they become overloaded.
+  growthFactor = 2
+
+  # The smallest number of keys a filter is sized for, e.g., for an empty relation.
+  minCapacity = 64
+
+  # Binary representation of a filter's header: its number of bits, number of hashes,
+  # number of keys added, capacity and false positive rate, followed by its bits.
+  binrepr = Struct("QHQQd")
+
+  def __init__(self, **kwargs):
+    other = kwargs.get("other", None)
+    if other:
+      self.fromOther(other)
+
+    else:
+      self.capacity          = max(kwargs.get("capacity", 0), BloomFilter.minCapacity)
+      self.falsePositiveRate = kwargs.get("falsePositiveRate", BloomFilter.defaultFalsePositiveRate)
+
+      if not 0.0 < self.falsePositiveRate < 1.0:
+        raise ValueError("Invalid false positive rate for a Bloom filter")
+
+      # Optimal sizing: m = -n ln(p) / ln(2)^2 bits, and k = (m / n) ln(2) hashes.
+      defaultBits    = math.ceil(-self.capacity * math.log(self.falsePositiveRate) / (math.log(2) ** 2))
+      self.numBits   = kwargs.get("numBits", defaultBits)
+      self.numHashes = kwargs.get("numHashes", max(1, round(self.numBits / self.capacity * math.log(2))))
+      self.count     = kwargs.get("count", 0)
+      self.bits      = bytearray(kwargs.get("bits", bytes(math.ceil(self.numBits / 8))))
+
+  def fromOther(self, other):
+    self.capacity          = other.capacity
+    self.falsePositiveRate = other.falsePositiveRate
+    self.numBits           = other.numBits
+    self.numHashes         = other.numHashes
+    self.count             = other.count
+    self.bits              = bytearray(other.bits)
+
+  # Returns the bit positions of a key.
+  def positions(self, key):
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    h1     = int.from_bytes(digest[:8], 'little')
+    h2     = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % self.numBits for i in range(self.numHashes)]
+
+  def add(self, key):
+    for p in self.positions(key):
+      self.bits[p >> 3] |= 1 << (p & 7)
+    self.count += 1
+
+  def __contains__(self, key):
+    return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+
+  # Returns whether the filter holds more keys than it was sized for, beyond which
+  # its false positive rate exceeds the rate it was created with.
+  def overloaded(self):
+    return self.count > self.capacity
+
+
+  # Bloom filter serialization
+  def pack(self):
+    return BloomFilter.binrepr.pack(self.numBits, self.numHashes, self.count, \
+                                    self.capacity, self.falsePositiveRate) + bytes(self.bits)
+
+  @classmethod
+  def unpack(cls, buffer):
+    (numBits, numHashes, count, capacity, falsePositiveRate) = cls.binrepr.unpack_from(buffer)
+    return cls(numBits=numBits, numHashes=numHashes, count=count, capacity=capacity, \
+               falsePositiveRate=falsePositiveRate, bits=buffer[cls.binrepr.size:])
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
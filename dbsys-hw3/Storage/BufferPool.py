@@ -1,6 +1,7 @@
-import io, math, struct
+import asyncio, bisect, io, math, mmap, struct
 
-from collections import OrderedDict
+from collections        import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from struct      import Struct
 
 from Catalog.Identifiers import PageId, FileId, TupleId
@@ -14,18 +15,104 @@ class BufferPool:
 
   Since the buffer pool is a cache, we do not provide any serialization methods.
 
+  The pool's memory is an anonymous memory map, which is page-aligned and only
+  backed by physical memory once used. Frames are thus aligned for direct I/O
+  whenever the pool's page size is a multiple of the OS page size.
+
+  The memory map may be larger than the pool itself (see the 'maxPoolSize' keyword
+  argument), allowing the pool to be resized at runtime. The pool counts its hits
+  and misses, which may be used to decide on such resizing (see StorageEngine).
+
   >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
   >>> bp = BufferPool()
   >>> fm = Storage.FileManager.FileManager(bufferPool=bp)
   >>> bp.setFileManager(fm)
 
   # Check initial buffer pool size
-  >>> len(bp.pool.getbuffer()) == bp.poolSize
+  >>> len(bp.poolBuffer) == bp.poolSize
+  True
+
+  The buffer pool also provides an asyncio interface for page access, where
+  page reads are issued to a thread pool performing positional reads. Concurrent
+  requests for the same page share a single read.
+
+  >>> import asyncio
+  >>> fm.createRelation(schema.name, schema)
+  >>> (fId, f) = fm.relationFile(schema.name)
+  >>> pIds = [f.allocatePage().pageId for _ in range(4)]
+  >>> bp.discardPage(pIds[0])
+
+  >>> async def fetchAll():
+  ...   return await asyncio.gather(*[bp.getPageAsync(pId) for pId in pIds + pIds])
+  >>> [p.pageId.pageIndex for p in asyncio.run(fetchAll())]
+  [0, 1, 2, 3, 0, 1, 2, 3]
+
+  >>> all(map(bp.hasPage, pIds))
   True
 
+  >>> bp.shutdownIO()
+
+  The buffer pool is divided into frames of its page size. Relations may use
+  larger pages, which occupy multiple contiguous frames in the pool.
+
+  >>> fm.createRelation('wide', schema, pageSize=4 * bp.pageSize)
+  >>> (wfId, wf) = fm.relationFile('wide')
+  >>> wIds = [wf.allocatePage().pageId for _ in range(2)]
+  >>> freeBefore = bp.numFreePages()
+  >>> [len(bp.getPage(pId).getbuffer()) == wf.pageSize() for pId in wIds]
+  [True, True]
+
+  >>> freeBefore - bp.numFreePages()
+  8
+
+  >>> bp.flushPage(wIds[0])
+  >>> freeBefore - bp.numFreePages()
+  4
+
+  # Large pages evict smaller pages when no contiguous frames are free.
+  >>> small = BufferPool(poolSize=8 * bp.pageSize)
+  >>> small.setFileManager(fm)
+  >>> _ = [small.getPage(pId) for pId in pIds]
+  >>> _ = [small.getPage(pId) for pId in wIds]
+  >>> (all(map(small.hasPage, wIds)), any(map(small.hasPage, pIds)))
+  (True, False)
+
+  # Only the pages held in the run of frames chosen for a large page are evicted.
+  >>> capped = BufferPool(poolSize=6 * bp.pageSize)
+  >>> capped.setFileManager(fm)
+  >>> _ = [capped.getPage(pId) for pId in pIds]
+  >>> _ = capped.getPage(wIds[0])
+  >>> [capped.hasPage(pId) for pId in pIds]
+  [True, True, False, False]
+
+  # Shrinking the pool evicts the pages held beyond its new size, and growing it
+  # makes frames available again, up to the size of its memory map.
+  >>> elastic = BufferPool(poolSize=8 * bp.pageSize, maxPoolSize=16 * bp.pageSize)
+  >>> elastic.setFileManager(fm)
+  >>> _ = [elastic.getPage(pId) for pId in pIds + pIds]
+  >>> (elastic.hits, elastic.misses)
+  (4, 4)
+
+  >>> elastic.resize(2 * bp.pageSize)
+  >>> (elastic.numPages(), elastic.numFreePages(), len(elastic.pageMap))
+  (2, 0, 2)
+
+  >>> elastic.resize(16 * bp.pageSize)
+  >>> (elastic.numPages(), elastic.numFreePages())
+  (16, 14)
+
+  >>> elastic.resize(32 * bp.pageSize)
+  Traceback (most recent call last):
+  ...
+  ValueError: Buffer pool size exceeds its memory map
+
+  ## Clean up the doctest
+  >>> import shutil
+  >>> shutil.rmtree(Storage.FileManager.FileManager.defaultDataDir)
   """
 
-  defaultPoolSize = 128 * (1 << 20)
+  defaultPoolSize  = 128 * (1 << 20)
+  defaultIOThreads = 8
 
   def __init__(self, **kwargs):
     other = kwargs.get("other", None)
@@ -35,22 +122,40 @@ class BufferPool:
     else:
       self.pageSize     = kwargs.get("pageSize", io.DEFAULT_BUFFER_SIZE)
       self.poolSize     = kwargs.get("poolSize", BufferPool.defaultPoolSize)
+      self.maxPoolSize  = max(self.poolSize, kwargs.get("maxPoolSize", self.poolSize))
 
-      self.pool         = io.BytesIO(b'\x00' * self.poolSize)
+      self.pool         = mmap.mmap(-1, self.maxPoolSize)
+      self.poolBuffer   = memoryview(self.pool)
       self.pageMap      = OrderedDict()
       self.freeList     = list(range(0, self.poolSize, self.pageSize))
       self.freeListLen  = len(self.freeList)
+      self.frameRuns    = {}
 
       self.fileMgr      = None
 
+      self.ioThreads    = kwargs.get("ioThreads", BufferPool.defaultIOThreads)
+      self.ioPool       = None
+      self.pendingReads = {}
+
+      self.hits         = 0
+      self.misses       = 0
+
   def fromOther(self, other):
-    self.pageSize    = other.pageSize
-    self.poolSize    = other.poolSize
-    self.pool        = other.pool
-    self.pageMap     = other.pageMap
-    self.freeList    = other.freeList
-    self.freeListLen = other.freeListLen
-    self.fileMgr     = other.fileMgr
+    self.pageSize     = other.pageSize
+    self.poolSize     = other.poolSize
+    self.maxPoolSize  = other.maxPoolSize
+    self.pool         = other.pool
+    self.poolBuffer   = other.poolBuffer
+    self.pageMap      = other.pageMap
+    self.freeList     = other.freeList
+    self.freeListLen  = other.freeListLen
+    self.frameRuns    = other.frameRuns
+    self.fileMgr      = other.fileMgr
+    self.ioThreads    = other.ioThreads
+    self.ioPool       = other.ioPool
+    self.pendingReads = other.pendingReads
+    self.hits         = other.hits
+    self.misses       = other.misses
 
   def setFileManager(self, fileMgr):
     self.fileMgr = fileMgr
@@ -73,6 +178,11 @@ class BufferPool:
   def usedSpace(self):
     return self.size() - self.freeSpace()
 
+  # Returns the fraction of page requests served from the pool.
+  def hitRate(self):
+    requests = self.hits + self.misses
+    return self.hits / requests if requests else 0.0
+
 
   # Buffer pool operations
 
@@ -85,22 +195,17 @@ class BufferPool:
   def getPageWithHit(self, pageId, pinned=False):
     if self.fileMgr:
       if self.hasPage(pageId):
+        self.hits += 1
         return (self.getCachedPage(pageId, pinned)[1], True)
 
       else:
         # Fetch the page from the file system, adding it to the buffer pool
-        if not self.freeList:
-          self.evictPage()
-
-        self.freeListLen -= 1
-        offset     = self.freeList.pop(0)
-        pageBuffer = self.pool.getbuffer()[offset:offset+self.pageSize]
-        page       = self.fileMgr.readPage(pageId, pageBuffer)
-        
-        self.pageMap[pageId] = (offset, page, 1 if pinned else 0)
-        self.pageMap.move_to_end(pageId)
+        self.misses += 1
+        (offset, pageBuffer) = self.allocateFrame(self.fileMgr.filePageSize(pageId.fileId))
+        page = self.fileMgr.readPage(pageId, pageBuffer)
+        self.installPage(pageId, offset, page, pinned)
         return (page, False)
-    
+
     else:
       raise ValueError("Uninitalized buffer pool, no file manager found")
 
@@ -108,6 +213,179 @@ class BufferPool:
   def getPage(self, pageId, pinned=False):
     return self.getPageWithHit(pageId, pinned)[0]
 
+  # Asynchronous variant of getPageWithHit.
+  # The page read is performed on the buffer pool's I/O thread pool, allowing
+  # the event loop to overlap many outstanding reads. A page that is already
+  # being read is not fetched twice; later requests wait on the pending read.
+  async def getPageWithHitAsync(self, pageId, pinned=False):
+    if self.fileMgr:
+      while True:
+        if self.hasPage(pageId):
+          self.hits += 1
+          return (self.getCachedPage(pageId, pinned)[1], True)
+
+        elif pageId in self.pendingReads:
+          # Wait for the pending read, and retry since the page may have
+          # been evicted again before this task resumed.
+          await asyncio.shield(self.pendingReads[pageId])
+
+        else:
+          break
+
+      self.misses += 1
+      (offset, pageBuffer) = self.allocateFrame(self.fileMgr.filePageSize(pageId.fileId))
+      pending = asyncio.get_running_loop().create_future()
+      self.pendingReads[pageId] = pending
+
+      # The read runs as a separate task, shielded from the cancellation of this
+      # request, since its I/O thread may still write into the frame.
+      read      = asyncio.ensure_future(self.fileMgr.readPageAsync(pageId, pageBuffer, self.ioExecutor()))
+      installed = False
+      try:
+        page = await asyncio.shield(read)
+        self.installPage(pageId, offset, page, pinned)
+        installed = True
+        pending.set_result(page)
+        return (page, False)
+
+      # On failure or cancellation, the frame is released once the read completes.
+      # Waiters see the read's error, or retry the request if it was cancelled.
+      finally:
+        del self.pendingReads[pageId]
+        if not installed:
+          self.releaseFrameAfterRead(read, offset)
+          if read.done() and not read.cancelled() and read.exception() is not None:
+            pending.set_exception(read.exception())
+          else:
+            pending.set_result(None)
+
+    else:
+      raise ValueError("Uninitalized buffer pool, no file manager found")
+
+  # Releases the frame of a page read that was not installed, once the read is done.
+  def releaseFrameAfterRead(self, read, offset):
+    def release(read):
+      if not read.cancelled():
+        read.exception()
+      self.releaseFrame(offset)
+    read.add_done_callback(release)
+
+  # Asynchronous wrapper for getPageWithHitAsync, returning only the page.
+  async def getPageAsync(self, pageId, pinned=False):
+    return (await self.getPageWithHitAsync(pageId, pinned))[0]
+
+  # Returns the thread pool used for asynchronous page reads, creating it on first use.
+  def ioExecutor(self):
+    if self.ioPool is None:
+      self.ioPool = ThreadPoolExecutor(max_workers=self.ioThreads)
+    return self.ioPool
+
+  # Stops the I/O thread pool, waiting for any outstanding reads.
+  def shutdownIO(self):
+    if self.ioPool is not None:
+      self.ioPool.shutdown(wait=True)
+      self.ioPool = None
+
+  # Returns the number of contiguous frames needed to hold a page of the given size.
+  def framesForPage(self, pageSize):
+    return max(1, math.ceil(pageSize / self.pageSize))
+
+  # Reserves free frames in the pool for a page of the given size, evicting pages
+  # if necessary. Pages larger than the pool's page size are held in a run of
+  # contiguous frames, and only the pages occupying the run chosen for them are
+  # evicted. Returns the first frame's offset and a buffer for the page.
+  def allocateFrame(self, pageSize=None):
+    pageSize  = pageSize if pageSize else self.pageSize
+    numFrames = self.framesForPage(pageSize)
+    if numFrames > self.numPages():
+      raise ValueError("Page size exceeds the buffer pool size")
+
+    offset = self.takeFreeFrames(numFrames)
+    if offset is None and numFrames > 1:
+      evicted = self.pagesToEvict(numFrames)
+      if evicted is None:
+        raise ValueError("Could not find free frames in the buffer pool")
+
+      for pageId in evicted:
+        self.flushPage(pageId)
+      offset = self.takeFreeFrames(numFrames)
+
+    while offset is None:
+      if not self.pageMap:
+        raise ValueError("Could not find free frames in the buffer pool")
+      self.evictPage()
+      offset = self.takeFreeFrames(numFrames)
+
+    if numFrames > 1:
+      self.frameRuns[offset] = numFrames
+    return (offset, self.poolBuffer[offset:offset+pageSize])
+
+  # Removes a run of contiguous frames from the free list, returning the offset
+  # of the first frame or None if no such run exists. The free list is kept in
+  # offset order, so a run is a slice of the list spanning exactly its frames.
+  def takeFreeFrames(self, numFrames):
+    if numFrames == 1:
+      offset = self.freeList.pop(0) if self.freeList else None
+
+    else:
+      offset = None
+      for i in range(len(self.freeList) - numFrames + 1):
+        if self.freeList[i+numFrames-1] - self.freeList[i] == (numFrames-1) * self.pageSize:
+          offset = self.freeList[i]
+          del self.freeList[i:i+numFrames]
+          break
+
+    if offset is not None:
+      self.freeListLen -= numFrames
+    return offset
+
+  # Returns reserved frames that are no longer used to the free list, in offset order.
+  def releaseFrame(self, offset):
+    numFrames = self.frameRuns.pop(offset, 1)
+    i = bisect.bisect_left(self.freeList, offset)
+    self.freeList[i:i] = range(offset, offset + numFrames * self.pageSize, self.pageSize)
+    self.freeListLen += numFrames
+
+  # Returns the pages to evict to free a run of the given number of contiguous frames.
+  # This follows the LRU policy by picking the run whose most recently used page is
+  # the oldest, and among those the run holding the fewest pages. Returns None if
+  # every run holds a pinned page.
+  def pagesToEvict(self, numFrames):
+    occupants = [None] * self.numPages()
+    recency   = {}
+    for (rank, (pageId, (offset, _, pinCount))) in enumerate(self.pageMap.items()):
+      recency[pageId] = rank
+      first = offset // self.pageSize
+      for frame in range(first, min(first + self.frameRuns.get(offset, 1), len(occupants))):
+        occupants[frame] = (pageId, pinCount > 0)
+
+    best   = None
+    counts = {}
+    pinned = 0
+    for (frame, occupant) in enumerate(occupants):
+      if occupant:
+        counts[occupant[0]] = counts.get(occupant[0], 0) + 1
+        pinned += occupant[1]
+
+      if frame >= numFrames and occupants[frame - numFrames]:
+        (pageId, isPinned) = occupants[frame - numFrames]
+        counts[pageId] -= 1
+        pinned -= isPinned
+        if counts[pageId] == 0:
+          del counts[pageId]
+
+      if frame >= numFrames - 1 and pinned == 0:
+        key = (max(map(recency.get, counts), default=-1), len(counts))
+        if best is None or key < best[0]:
+          best = (key, list(counts))
+
+    return best[1] if best else None
+
+  # Adds a page held in the given frame to the page map.
+  def installPage(self, pageId, offset, page, pinned=False):
+    self.pageMap[pageId] = (offset, page, 1 if pinned else 0)
+    self.pageMap.move_to_end(pageId)
+
   # Returns a triple of offset, page object, and pin count
   # for pages present in the buffer pool.
   def getCachedPage(self, pageId, pinned=False):
@@ -144,8 +422,7 @@ class BufferPool:
     if self.hasPage(pageId):
       (offset, _, pinCount) = self.pageMap[pageId]
       if pinCount == 0:
-        self.freeList.append(offset)
-        self.freeListLen += 1
+        self.releaseFrame(offset)
         del self.pageMap[pageId]
 
   # Removes a page from the page map, returning it to the free 
@@ -155,8 +432,7 @@ class BufferPool:
       (offset, page, pinCount) = self.getCachedPage(pageId)
       if all(map(lambda x: x is not None, [offset, page, pinCount])):
         if pinCount == 0:
-          self.freeList.append(offset)
-          self.freeListLen += 1
+          self.releaseFrame(offset)
           del self.pageMap[pageId]
 
         if page.isDirty():
@@ -164,6 +440,49 @@ class BufferPool:
     else:
       raise ValueError("Uninitalized buffer pool, no file manager found")
 
+  # Adds a page that is not yet on disk (e.g., a freshly allocated page) to the pool,
+  # without reading it from its file. If given a page that is no longer used, this
+  # recycles its frame for the new page, writing it back beforehand, rather than
+  # returning the frame to the free list and allocating one for the new page.
+  def installNewPage(self, page, recycledPageId=None, pinned=False):
+    if self.fileMgr:
+      (offset, recycled, pinCount) = self.getCachedPage(recycledPageId) \
+                                       if recycledPageId is not None else (None, None, None)
+      pageSize = self.fileMgr.filePageSize(page.pageId.fileId)
+
+      if recycled is not None and pinCount == 0 and self.framesForPage(pageSize) == self.frameRuns.get(offset, 1):
+        if recycled.isDirty():
+          self.fileMgr.writePage(recycled)
+        del self.pageMap[recycledPageId]
+
+      else:
+        if recycled is not None:
+          self.flushPage(recycledPageId)
+        (offset, _) = self.allocateFrame(pageSize)
+
+      self.installPage(page.pageId, offset, page, pinned)
+      return page
+
+    else:
+      raise ValueError("Uninitalized buffer pool, no file manager found")
+
+  # Flushes and removes all pages belonging to the given file from the buffer pool.
+  # This is used when a file is reorganized on disk (e.g., during vacuuming),
+  # and requires that none of the file's pages are pinned.
+  def flushFilePages(self, fileId):
+    filePages = [pageId for pageId in self.pageMap if pageId.fileId == fileId]
+    if any(map(lambda pageId: self.pagePinCount(pageId) > 0, filePages)):
+      raise ValueError("Cannot flush file pages from the buffer pool, a page is pinned")
+
+    for pageId in filePages:
+      self.flushPage(pageId)
+
+  # Discards all unpinned pages of the given file without flushing them,
+  # for example when the file is being removed.
+  def discardFilePages(self, fileId):
+    for pageId in [pageId for pageId in self.pageMap if pageId.fileId == fileId]:
+      self.discardPage(pageId)
+
   # Evict using LRU policy, considering only unpinned pages.
   # We implement LRU through the use of an OrderedDict, and by moving pages
   # to the end of the ordering every time it is accessed through getPage()
@@ -182,8 +501,45 @@ class BufferPool:
       else:
         raise ValueError("Could not find a page to evict in the buffer pool")
 
+  # Changes the size of the pool within its memory map, in whole frames.
+  # Shrinking the pool flushes the pages held in frames beyond its new size, which
+  # must not be pinned, and returns their memory to the OS.
+  def resize(self, poolSize):
+    poolSize = (poolSize // self.pageSize) * self.pageSize
+    if poolSize < self.pageSize:
+      raise ValueError("Buffer pool size is smaller than its page size")
+    if poolSize > self.maxPoolSize:
+      raise ValueError("Buffer pool size exceeds its memory map")
+
+    if poolSize < self.poolSize:
+      frameEnd = lambda offset: offset + self.frameRuns.get(offset, 1) * self.pageSize
+      evicted  = [pageId for (pageId, (offset, _, _)) in self.pageMap.items() if frameEnd(offset) > poolSize]
+      if any(map(lambda pageId: self.pagePinCount(pageId) > 0, evicted)):
+        raise ValueError("Cannot shrink the buffer pool, a page beyond its new size is pinned")
+
+      for pageId in evicted:
+        self.flushPage(pageId)
+
+      self.freeList    = [offset for offset in self.freeList if offset < poolSize]
+      self.freeListLen = len(self.freeList)
+
+      release = math.ceil(poolSize / mmap.PAGESIZE) * mmap.PAGESIZE
+      if release < self.poolSize and hasattr(mmap, "MADV_DONTNEED"):
+        self.pool.madvise(mmap.MADV_DONTNEED, release, self.poolSize - release)
+
+    else:
+      added = range(math.ceil(self.poolSize / self.pageSize) * self.pageSize, poolSize, self.pageSize)
+      self.freeList.extend(added)
+      self.freeListLen += len(added)
+
+    self.poolSize = poolSize
+
+  # Returns the dirty pages held in the buffer pool.
+  def dirtyPages(self):
+    return [page for (_, page, _) in self.pageMap.values() if page.isDirty()]
+
   def clear(self):
-    for (pageId, (offset, page, _)) in self.pageMap.items():
+    for (pageId, (offset, page, _)) in list(self.pageMap.items()):
       if page.isDirty():
         self.flushPage(pageId)
 
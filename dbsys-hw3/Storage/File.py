@@ -1,10 +1,11 @@
-import io, math, os, os.path, pickle, struct
+import asyncio, ctypes, io, math, mmap, os, os.path, pickle, struct
 from struct import Struct
 
 from Catalog.Identifiers import PageId, FileId, TupleId
 from Catalog.Schema      import DBSchema
 from Storage.Page        import PageHeader, Page
 from Storage.SlottedPage import SlottedPageHeader, SlottedPage
+from Storage.ZoneMap     import ZoneMap
 
 class FileHeader:
   """
@@ -13,10 +14,14 @@ class FileHeader:
 
   Our file header object also keeps its own binary representation per instance
   rather than at the class level, since each file may have a variable length schema.
-  The binary representation is a struct, with three components in its format string:
+  The binary representation is a struct, with four components in its format string:
   i.   header length
   ii.  page size
-  iii. a JSON-serialized schema (from DBSchema.packSchema)
+  iii. segment size, as the number of pages stored in each segment of the file
+  iv.  a JSON-serialized schema (from DBSchema.packSchema)
+
+  The header may be padded to a given alignment, so that the pages following
+  it in the file are suitably aligned for direct I/O.
 
   >>> schema = DBSchema('employee', [('id', 'int'), ('dob', 'char(10)'), ('salary', 'int')])
   >>> fh = FileHeader(pageSize=io.DEFAULT_BUFFER_SIZE, pageClass=SlottedPage, schema=schema)
@@ -25,6 +30,16 @@ class FileHeader:
   >>> fh.pageSize == fh2.pageSize
   True
 
+  >>> fh.segmentPages == fh2.segmentPages == FileHeader.defaultSegmentSize // io.DEFAULT_BUFFER_SIZE
+  True
+
+  >>> FileHeader.unpack(FileHeader(pageSize=1 << 20, pageClass=SlottedPage, schema=schema).pack()).pageSize
+  1048576
+
+  >>> fh4 = FileHeader(pageSize=io.DEFAULT_BUFFER_SIZE, pageClass=SlottedPage, schema=schema, alignment=4096)
+  >>> (fh4.size, len(fh4.pack()), FileHeader.unpack(fh4.pack()).size)
+  (4096, 4096, 4096)
+
   >>> fh.schema.schema() == fh2.schema.schema()
   True
 
@@ -43,37 +58,45 @@ class FileHeader:
   >>> os.remove('test.header')
   """
 
+  # The default size of a file segment in bytes.
+  defaultSegmentSize = 1 << 30
+
   def __init__(self, **kwargs):
     other = kwargs.get("other", None)
     if other:
       self.fromOther(other)
 
     else:
-      numTuples   = kwargs.get("numTuples", 0)
-      pageSize    = kwargs.get("pageSize", None)
-      pageClass   = kwargs.get("pageClass", None)
-      schema      = kwargs.get("schema", None)
+      numTuples    = kwargs.get("numTuples", 0)
+      pageSize     = kwargs.get("pageSize", None)
+      segmentPages = kwargs.get("segmentPages", None)
+      pageClass    = kwargs.get("pageClass", None)
+      schema       = kwargs.get("schema", None)
+      alignment    = kwargs.get("alignment", 1)
+      headerSize   = kwargs.get("headerSize", None)
 
       if pageSize and pageClass and schema:
-        pageClassLen   = len(pickle.dumps(pageClass))
-        schemaDescLen  = len(schema.packSchema())
-        self.binrepr   = Struct("HQHHH"+str(pageClassLen)+"s"+str(schemaDescLen)+"s")
-        self.size      = self.binrepr.size
-        self.pageSize  = pageSize
-        self.pageClass = pageClass
-        self.schema    = schema
-        self.numTuples = numTuples
+        pageClassLen      = len(pickle.dumps(pageClass))
+        schemaDescLen     = len(schema.packSchema())
+        self.binrepr      = Struct("HQIIHH"+str(pageClassLen)+"s"+str(schemaDescLen)+"s")
+        self.size         = headerSize if headerSize else alignment * math.ceil(self.binrepr.size / alignment)
+        self.pageSize     = pageSize
+        self.segmentPages = segmentPages if segmentPages else max(1, FileHeader.defaultSegmentSize // pageSize)
+        self.pageClass    = pageClass
+        self.schema       = schema
+        self.numTuples    = numTuples
 
       else:
         raise ValueError("Invalid file header constructor arguments")
 
   def fromOther(self, other):
-    self.binrepr   = other.binrepr
-    self.size      = other.size
-    self.pageSize  = other.pageSize
-    self.pageClass = other.pageClass
-    self.schema    = other.schema
-    self.numTuples = other.numTuples
+    self.binrepr      = other.binrepr
+    self.size         = other.size
+    self.pageSize     = other.pageSize
+    self.segmentPages = other.segmentPages
+    self.pageClass    = other.pageClass
+    self.schema       = other.schema
+    self.numTuples    = other.numTuples
 
   # File cardinality maintenance
   def insertTuple(self):
@@ -87,25 +110,26 @@ class FileHeader:
     if self.binrepr and self.pageSize and self.schema:
       packedPageClass = pickle.dumps(self.pageClass)
       packedSchema    = self.schema.packSchema()
-      return self.binrepr.pack(self.size, self.numTuples, self.pageSize, \
+      return self.binrepr.pack(self.size, self.numTuples, self.pageSize, self.segmentPages, \
               len(packedPageClass), len(packedSchema), \
-              packedPageClass, packedSchema)
+              packedPageClass, packedSchema) + bytes(self.size - self.binrepr.size)
 
   @classmethod
   def unpack(cls, buffer):
     brepr  = cls.binrepr(buffer)
     values = brepr.unpack_from(buffer)
-    if len(values) == 7:
-      pageClass = pickle.loads(values[5])
-      schema    = DBSchema.unpackSchema(values[6])
-      return FileHeader(numTuples=values[1], pageSize=values[2], pageClass=pageClass, schema=schema)
+    if len(values) == 8:
+      pageClass = pickle.loads(values[6])
+      schema    = DBSchema.unpackSchema(values[7])
+      return FileHeader(numTuples=values[1], pageSize=values[2], segmentPages=values[3], \
+                        pageClass=pageClass, schema=schema, headerSize=values[0])
 
   @classmethod
   def binrepr(cls, buffer):
-    lenStruct = Struct("HQHHH")
-    (headerLen, _, _, pageClassLen, schemaDescLen) = lenStruct.unpack_from(buffer)
+    lenStruct = Struct("HQIIHH")
+    (headerLen, _, _, _, pageClassLen, schemaDescLen) = lenStruct.unpack_from(buffer)
     if headerLen > 0 and pageClassLen > 0 and schemaDescLen > 0:
-      return Struct("HQHHH"+str(pageClassLen)+"s"+str(schemaDescLen)+"s")
+      return Struct("HQIIHH"+str(pageClassLen)+"s"+str(schemaDescLen)+"s")
     else:
       raise ValueError("Invalid header length read from storage file header")
 
@@ -143,6 +167,19 @@ class StorageFile:
   underlying file system (i.e. simply write the desired page, and the file system
   will grow the backing file by the desired amount).
 
+  A storage file is split into segments on disk, each holding a fixed number of
+  pages as given in the file header. The first segment is stored at the file's path
+  and also contains the file header, while subsequent segments are stored at the
+  path suffixed by the segment number (e.g., '0.rel.1'). Page ids are global to the
+  storage file, and the pageLocation() method maps them to a segment index and an offset.
+
+  Storage files may optionally perform page I/O with O_DIRECT, bypassing the OS
+  page cache since pages are already cached by the buffer pool. Direct I/O requires
+  page-aligned offsets and buffers: newly created files pad their header to the
+  alignment, and reads target the buffer pool's aligned frames. Where direct I/O is
+  unavailable (e.g., tmpfs, or platforms without O_DIRECT), the file falls back to
+  buffered I/O, as indicated by its 'directIO' attribute.
+
   Storage files may also serialize their metadata using the pack() and unpack(),
   allowing their metadata to be written to disk when persisting the database catalog.
 
@@ -225,16 +262,95 @@ class StorageFile:
   >>> [schema.unpack(tup).id for tup in f.tuples()] == list(range(20))
   True
 
+  # Test asynchronous page reads and page iterator
+  >>> import asyncio
+  >>> pIn1 = asyncio.run(f.readPageAsync(pId1, pageBuffer))
+  >>> pIn1.pageId == pId1
+  True
+
+  >>> async def asyncPageIndexes():
+  ...   return [p[1].pageId.pageIndex async for p in f.pagesAsync()]
+  >>> asyncio.run(asyncPageIndexes())
+  [0, 1]
+
+  # Stopping an iteration early unpins its prefetched pages, when closing the iterator.
+  >>> async def firstPage():
+  ...   async with f.pagesAsync() as pages:
+  ...     async for (_, page) in pages:
+  ...       break
+  ...   return page.pageId.pageIndex
+  >>> (asyncio.run(firstPage()), [bp.pagePinCount(pId) for pId in [pId, pId1]])
+  (0, [0, 0])
+  >>> bp.shutdownIO()
+
   # Check buffer pool utilization
   >>> (bp.numPages() - bp.numFreePages()) == 2
   True
 
+  # Test a segmented file, with two pages per segment.
+  >>> fm.createRelation('segmented', schema, segmentPages=2)
+  >>> (sfId, sf) = fm.relationFile('segmented')
+  >>> for tup in [schema.pack(schema.instantiate(i, i)) for i in range(5000)]:
+  ...    _ = sf.insertTuple(tup)
+
+  >>> (sf.numPages(), sf.numSegments())
+  (5, 3)
+
+  >>> [os.path.basename(path) for path in sf.segmentPaths()]
+  ['1.rel', '1.rel.1', '1.rel.2']
+
+  >>> (sf.pageLocation(sf.pageId(3)) == (1, sf.pageSize()), sf.pageLocation(sf.pageId(4)) == (2, 0))
+  (True, True)
+
+  # Segments can be scanned independently, and cover the whole file.
+  >>> [[pId.pageIndex for (pId, _) in sf.segment(i)] for i in range(sf.numSegments())]
+  [[0, 1], [2, 3], [4]]
+
+  >>> bp.clear()
+  >>> sorted(schema.unpack(tup).id for tup in sf.tuples()) == list(range(5000))
+  True
+
+  >>> sf.truncate(3)
+  >>> (sf.numPages(), sf.numSegments())
+  (3, 2)
+
+  >>> fm.removeRelation('segmented')
+  >>> [path for path in os.listdir(fm.dataDir) if path.startswith('1.rel')]
+  []
+
+  # Test a file using direct I/O, if supported by the file system.
+  >>> dfm = Storage.FileManager.FileManager(bufferPool=bp, dataDir='direct/', directIO=True)
+  >>> bp.setFileManager(dfm)
+  >>> dfm.createRelation('direct', schema)
+  >>> (dfId, df) = dfm.relationFile('direct')
+  >>> df.directIO == StorageFile.directIOSupported('direct/')
+  True
+
+  >>> df.headerSize() % StorageFile.directAlignment == 0
+  True
+
+  >>> for tup in [schema.pack(schema.instantiate(i, i)) for i in range(3000)]:
+  ...    _ = df.insertTuple(tup)
+  >>> bp.clear()
+  >>> sorted(schema.unpack(tup).id for tup in df.tuples()) == list(range(3000))
+  True
+
+  >>> [pId.pageIndex for (pId, _) in df.directPages()]
+  [0, 1, 2]
+
+  >>> dfm.close()
+  >>> bp.setFileManager(fm)
+  >>> shutil.rmtree('direct/')
+
   ## Clean up the doctest
   >>> shutil.rmtree(Storage.FileManager.FileManager.defaultDataDir)
   """
 
   defaultPageClass = SlottedPage
 
+  # Offset and buffer alignment required for direct I/O.
+  directAlignment  = 4096
+
   def __init__(self, **kwargs):
     other = kwargs.get("other", None)
     if other:
@@ -259,8 +375,11 @@ class StorageFile:
           pageSize  = kwargs.get("pageSize", io.DEFAULT_BUFFER_SIZE)
           pageClass = kwargs.get("pageClass", StorageFile.defaultPageClass)
           schema    = kwargs.get("schema", None)
+          segPages  = kwargs.get("segmentPages", None)
+          alignment = StorageFile.directAlignment if kwargs.get("directIO", False) else 1
           if pageSize and pageClass and schema:
-            self.header   = FileHeader(pageSize=pageSize, pageClass=pageClass, schema=schema)
+            self.header   = FileHeader(pageSize=pageSize, segmentPages=segPages, pageClass=pageClass, \
+                                       schema=schema, alignment=alignment)
             initHeader    = True
             initFreePages = False
           else:
@@ -281,11 +400,21 @@ class StorageFile:
           self.fileId      = fileId
           self.path        = filePath
           self.file        = io.BufferedRandom(io.FileIO(self.path, ioMode), buffer_size=pageSize)
+          self.segments    = [self.file]
           self.binrepr     = Struct("H"+str(FileId.binrepr.size)+"s"+str(len(self.path))+"s")
           self.freePages   = set()
 
+          self.openSegments(ioMode)
+
+          self.directIO     = False
+          self.directFds    = []
+          self.directBuffer = None
+          if kwargs.get("directIO", False):
+            self.enableDirectIO()
+
           page = self.pageClass()(pageId=self.pageId(0), buffer=bytes(self.pageSize()), schema=self.schema())
           self.pageHdrSize = page.header.headerSize()
+          self.pageTuples  = page.header.maxTuples()
 
           if initFreePages:
             self.initializeFreePages()
@@ -293,6 +422,11 @@ class StorageFile:
           if initHeader:
             self.refreshFileHeader()
 
+          self.zoneMap   = None
+          self.zoneDirty = False
+          if kwargs.get("zoneMaps", False):
+            self.enableZoneMap()
+
         else:
           raise ValueError("No valid header available for storage file")
       else:
@@ -304,9 +438,16 @@ class StorageFile:
     self.path        = other.path
     self.header      = other.header
     self.file        = other.file
+    self.segments    = other.segments
+    self.directIO     = other.directIO
+    self.directFds    = other.directFds
+    self.directBuffer = other.directBuffer
     self.binrepr     = other.binrepr
     self.freePages   = other.freePages
     self.pageHdrSize = other.pageHdrSize
+    self.pageTuples  = other.pageTuples
+    self.zoneMap     = other.zoneMap
+    self.zoneDirty   = other.zoneDirty
 
   # Refreshes the file header on disk.
   def refreshFileHeader(self):
@@ -322,14 +463,112 @@ class StorageFile:
       if hdr.hasFreeTuple():
         self.freePages.add(pId)
 
+  # Rebuilds the file header's tuple count, the free page directory and any zone map
+  # from the pages on disk, e.g., after recovering from a crash. Thus any pages of the
+  # file in the buffer pool must be flushed beforehand.
+  def refreshFromPages(self):
+    self.header.numTuples = 0
+    self.freePages        = set()
+    for (pId, hdr) in self.headers():
+      self.header.numTuples += hdr.numTuples()
+      if hdr.hasFreeTuple():
+        self.freePages.add(pId)
+
+    self.refreshFileHeader()
+    if self.zoneMap is not None:
+      self.rebuildZoneMap()
+
+  # Opens any existing segments beyond the first, discarding them when truncating the file.
+  def openSegments(self, ioMode):
+    segmentIndex = 1
+    while os.path.exists(self.segmentPath(segmentIndex)):
+      if ioMode == "r+b":
+        self.segments.append(self.openSegment(segmentIndex, ioMode))
+      else:
+        os.remove(self.segmentPath(segmentIndex))
+      segmentIndex += 1
+
+  def openSegment(self, segmentIndex, ioMode):
+    return io.BufferedRandom(io.FileIO(self.segmentPath(segmentIndex), ioMode), buffer_size=self.pageSize())
+
+  # Direct I/O.
+
+  # Returns whether direct I/O is supported by the file system holding the given directory.
+  @staticmethod
+  def directIOSupported(directory):
+    if not hasattr(os, "O_DIRECT"):
+      return False
+
+    probePath = os.path.join(directory, ".directio")
+    try:
+      fd = os.open(probePath, os.O_RDWR | os.O_CREAT | os.O_DIRECT)
+      os.close(fd)
+      return True
+    except OSError:
+      return False
+    finally:
+      if os.path.exists(probePath):
+        os.remove(probePath)
+
+  # Switches page I/O to direct I/O, leaving the file in buffered mode if this is not possible.
+  # The file header and page size must preserve page alignment. Direct I/O uses a second
+  # file descriptor per segment, while the file header continues to use buffered I/O.
+  def enableDirectIO(self):
+    aligned = self.headerSize() % StorageFile.directAlignment == 0 \
+                and self.pageSize() % StorageFile.directAlignment == 0
+
+    if aligned and hasattr(os, "O_DIRECT"):
+      try:
+        self.flush()
+        self.directFds    = [self.openDirectSegment(i) for i in range(self.numSegments())]
+        self.directBuffer = mmap.mmap(-1, self.pageSize())
+        self.directIO     = True
+      except OSError:
+        self.disableDirectIO()
+
+  def disableDirectIO(self):
+    for fd in self.directFds:
+      os.close(fd)
+    self.directIO     = False
+    self.directFds    = []
+    self.directBuffer = None
+
+  def openDirectSegment(self, segmentIndex):
+    return os.open(self.segmentPath(segmentIndex), os.O_RDWR | os.O_DIRECT)
+
+  # Returns whether a buffer's address is aligned for direct I/O.
+  def alignedBuffer(self, buffer):
+    address = ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+    return address % StorageFile.directAlignment == 0
+
   # File control
   def flush(self):
-    self.file.flush()
+    for segment in self.segments:
+      segment.flush()
+
+  # Flushes the file, and forces its segments and header to stable storage.
+  def sync(self):
+    self.refreshFileHeader()
+    self.flush()
+    for segment in self.segments:
+      os.fsync(segment.fileno())
 
   def close(self):
     if not self.file.closed:
       self.refreshFileHeader()
-      self.file.close()
+      self.saveZoneMap()
+      self.disableDirectIO()
+      for segment in self.segments:
+        segment.close()
+
+  # Closes the file and deletes all of its segments from the file system.
+  def remove(self):
+    self.close()
+    for path in self.segmentPaths():
+      os.remove(path)
+
+    if os.path.exists(self.zoneMapPath()):
+      os.remove(self.zoneMapPath())
 
   # Storage file helpers
   def pageId(self, pageIndex):
@@ -338,8 +577,9 @@ class StorageFile:
   def schema(self):
     return self.header.schema
 
+  # Returns the total size of the file in bytes, across all segments.
   def size(self):
-    return os.path.getsize(self.path)
+    return sum(map(os.path.getsize, self.segmentPaths()))
 
   def headerSize(self):
     return self.header.size
@@ -353,14 +593,58 @@ class StorageFile:
   def pageClass(self):
     return self.header.pageClass
 
+  # Returns the maximum number of tuples held by a page in this file.
+  def pageCapacity(self):
+    return self.pageTuples
+
   def numPages(self):
     return math.floor((self.size() - self.headerSize()) / self.pageSize())
 
+  # Segment helpers.
+  def pagesPerSegment(self):
+    return self.header.segmentPages
+
+  def numSegments(self):
+    return len(self.segments)
+
+  def segmentPath(self, segmentIndex):
+    return self.path if segmentIndex == 0 else self.path + "." + str(segmentIndex)
+
+  def segmentPaths(self):
+    return [self.segmentPath(i) for i in range(self.numSegments())]
+
+  # Returns the segment file for the given segment index, creating segments as needed.
+  def segmentFile(self, segmentIndex):
+    while segmentIndex >= len(self.segments):
+      self.segments.append(self.openSegment(len(self.segments), "w+b"))
+      if self.directIO:
+        try:
+          self.directFds.append(self.openDirectSegment(len(self.segments) - 1))
+        except OSError:
+          self.disableDirectIO()
+    return self.segments[segmentIndex]
+
+  # Flushes any buffered writes to the segment holding the given page.
+  def flushSegment(self, pageId):
+    self.segmentFile(self.pageLocation(pageId)[0]).flush()
+
+  # Returns the range of page indexes stored in the given segment.
+  def segmentPageRange(self, segmentIndex):
+    start = segmentIndex * self.pagesPerSegment()
+    return (start, min(start + self.pagesPerSegment(), self.numPages()))
+
+  # Returns the segment index and the byte offset within that segment holding the given page.
+  def pageLocation(self, pageId):
+    (segmentIndex, segmentPage) = divmod(pageId.pageIndex, self.pagesPerSegment())
+    segmentStart = self.headerSize() if segmentIndex == 0 else 0
+    return (segmentIndex, segmentStart + self.pageSize() * segmentPage)
+
   def numTuples(self):
     return self.header.numTuples
 
+  # Returns the byte offset of a page within its segment.
   def pageOffset(self, pageId):
-    return self.headerSize() + self.pageSize() * pageId.pageIndex
+    return self.pageLocation(pageId)[1]
 
   def pageRange(self, pageId):
     start = self.pageOffset(pageId)
@@ -376,11 +660,21 @@ class StorageFile:
   # Page header operations
 
   # Reads a page header from disk.
+  # With direct I/O, we read the full page to avoid stale data in the buffered file object.
   def readPageHeader(self, pageId):
-    if self.validPageId(pageId):
-      self.file.seek(self.pageOffset(pageId))
+    if self.validPageId(pageId) and self.directIO:
+      pageBuffer = mmap.mmap(-1, self.pageSize())
+      if self.preadPage(pageId, pageBuffer) == self.pageSize():
+        return self.pageClass().headerClass.unpack(bytearray(pageBuffer[:self.pageHeaderSize()]))
+      else:
+        raise ValueError("Read a partial page header")
+
+    elif self.validPageId(pageId):
+      (segmentIndex, offset) = self.pageLocation(pageId)
+      segment = self.segmentFile(segmentIndex)
+      segment.seek(offset)
       packedHdr = bytearray(self.pageHeaderSize())
-      bytesRead = self.file.readinto(packedHdr)
+      bytesRead = segment.readinto(packedHdr)
       if bytesRead == self.pageHeaderSize():
         return self.pageClass().headerClass.unpack(packedHdr)
       else:
@@ -391,9 +685,13 @@ class StorageFile:
   # Writes a page header to disk.
   # The page must already exist, that is we cannot extend the file with only a page header.
   def writePageHeader(self, page):
-    if isinstance(page, self.pageClass()) and self.validPageId(pageId):
-      self.file.seek(self.pageOffset(page.pageId))
-      self.file.write(page.header.pack())
+    if isinstance(page, self.pageClass()) and self.validPageId(page.pageId):
+      (segmentIndex, offset) = self.pageLocation(page.pageId)
+      segment = self.segmentFile(segmentIndex)
+      segment.seek(offset)
+      segment.write(page.header.pack())
+      if self.directIO:
+        segment.flush()
     else:
       raise ValueError("Invalid page type or page id while writing a header")
 
@@ -402,36 +700,83 @@ class StorageFile:
 
   def readPage(self, pageId, bufferForPage):
     if self.validPageId(pageId) and self.validBuffer(bufferForPage):
-      self.file.seek(self.pageOffset(pageId))
-      bytesRead = self.file.readinto(bufferForPage)
-      if bytesRead == self.pageSize():
-        page = self.pageClass().unpack(pageId, bufferForPage)
-        # Refresh the free page list based on the on-disk header contents.
-        if page.header.hasFreeTuple() and pageId not in self.freePages:
-          self.freePages.add(pageId)
-        return page
-      else:
-        raise ValueError("Read a partial page")
+      self.flushSegment(pageId)
+      bytesRead = self.preadPage(pageId, bufferForPage)
+      return self.unpackPage(pageId, bufferForPage, bytesRead)
+    else:
+      raise ValueError("Invalid page id or page buffer")
+
+  # Asynchronous variant of readPage, performing the read on the given executor.
+  # Any buffered writes are flushed before the read is issued, so that the I/O thread
+  # observes the latest page contents.
+  async def readPageAsync(self, pageId, bufferForPage, executor=None):
+    if self.validPageId(pageId) and self.validBuffer(bufferForPage):
+      self.flushSegment(pageId)
+      loop      = asyncio.get_running_loop()
+      bytesRead = await loop.run_in_executor(executor, self.preadPage, pageId, bufferForPage)
+      return self.unpackPage(pageId, bufferForPage, bytesRead)
     else:
       raise ValueError("Invalid page id or page buffer")
 
+  # Reads a page's bytes into the given buffer with a positional read.
+  # This does not use the file object's position, and is safe to call from I/O threads.
+  # Any buffered writes to the page's segment must be flushed prior to calling this method.
+  # With direct I/O, reads into unaligned buffers are staged through an aligned buffer.
+  def preadPage(self, pageId, bufferForPage):
+    (segmentIndex, offset) = self.pageLocation(pageId)
+    if self.directIO and self.alignedBuffer(bufferForPage):
+      return os.preadv(self.directFds[segmentIndex], [bufferForPage], offset)
+
+    elif self.directIO:
+      stagingBuffer = mmap.mmap(-1, self.pageSize())
+      bytesRead = os.preadv(self.directFds[segmentIndex], [stagingBuffer], offset)
+      bufferForPage[0:bytesRead] = stagingBuffer[0:bytesRead]
+      return bytesRead
+
+    else:
+      return os.preadv(self.segmentFile(segmentIndex).fileno(), [bufferForPage], offset)
+
+  # Constructs a page object over a buffer filled by a page read.
+  def unpackPage(self, pageId, bufferForPage, bytesRead):
+    if bytesRead == self.pageSize():
+      page = self.pageClass().unpack(pageId, bufferForPage)
+      # Refresh the free page list based on the on-disk header contents.
+      if page.header.hasFreeTuple() and pageId not in self.freePages:
+        self.freePages.add(pageId)
+      return page
+    else:
+      raise ValueError("Read a partial page")
+
   def writePage(self, page):
     if isinstance(page, self.pageClass()):
-      self.file.seek(self.pageOffset(page.pageId))
-      self.file.write(page.pack())
-      # Refresh the free page list based on the in-memory header contents.
-      # This is needed if the page has been directly modified while resident in the buffer pool.
-      if not page.header.hasFreeTuple():
-        self.freePages.discard(page.pageId)
+      self.writePageData(page.pageId, page.pack())
+      self.refreshFreePage(page)
     else:
       raise ValueError("Incompatible page type during writePage")
 
+  # Writes a packed page image at the page's location in the file.
+  def writePageData(self, pageId, pageData):
+    (segmentIndex, offset) = self.pageLocation(pageId)
+    segment = self.segmentFile(segmentIndex)
+    if self.directIO:
+      self.directBuffer[:] = pageData
+      os.pwritev(self.directFds[segmentIndex], [self.directBuffer], offset)
+    else:
+      segment.seek(offset)
+      segment.write(pageData)
+
+  # Refresh the free page list based on the in-memory header contents.
+  # This is needed if the page has been directly modified while resident in the buffer pool.
+  def refreshFreePage(self, page):
+    if not page.header.hasFreeTuple():
+      self.freePages.discard(page.pageId)
+
   # Adds a new page to the file by writing past its end.
   def allocatePage(self):
     pId = self.pageId(self.numPages())
     page = self.pageClass()(pageId=pId, buffer=bytes(self.pageSize()), schema=self.schema())
     self.writePage(page)
-    self.file.flush()
+    self.flushSegment(pId)
     return page
 
   # Returns the page id of the first page with available space.
@@ -444,14 +789,17 @@ class StorageFile:
 
   # Tuple operations
 
-  # Inserts the given tuple to the first available page.
-  def insertTuple(self, tupleData):
+  # Inserts the given tuple to the first available page, or to the
+  # given page if it has space (e.g., to keep a relation clustered).
+  def insertTuple(self, tupleData, nearPageId=None):
     self.header.insertTuple()
-    pId  = self.availablePage()
+    pId  = nearPageId if nearPageId in self.freePages else self.availablePage()
     page = self.bufferPool.getPage(pId)
     tupleId = page.insertTuple(tupleData)
     if not page.header.hasFreeTuple():
       self.freePages.discard(pId)
+    if self.zoneMap:
+      self.updateZoneMap(pId.pageIndex, tupleData)
     return tupleId
 
   # Removes the tuple by its id, tracking if the page is now free
@@ -460,7 +808,7 @@ class StorageFile:
     self.header.deleteTuple()
     pId       = tupleId.pageId
     page      = self.bufferPool.getPage(pId)
-    tupleData = page.getTuple(tupleId)
+    tupleData = bytes(page.getTuple(tupleId))
     page.deleteTuple(tupleId)
     if page.header.hasFreeTuple() and pId not in self.freePages:
       self.freePages.add(pId)
@@ -471,11 +819,194 @@ class StorageFile:
   def updateTuple(self, tupleId, tupleData):
     pId     = tupleId.pageId
     page    = self.bufferPool.getPage(pId)
-    oldData = page.getTuple(tupleId)
+    oldData = bytes(page.getTuple(tupleId))
     page.putTuple(tupleId, tupleData)
+    if self.zoneMap:
+      self.updateZoneMap(pId.pageIndex, tupleData)
     return oldData
 
 
+  # File reorganization
+
+  # Compacts the live tuples in this file into as few pages as possible,
+  # and truncates the file to its new length.
+  #
+  # Tuples are moved in file order into a sequence of densely packed pages,
+  # thus a tuple is never moved to a later position than its current one.
+  # This allows us to stream through the file, writing each compacted page
+  # only after every tuple it replaces has been read.
+  #
+  # Returns a list of (old tuple id, new tuple id, tuple data) triples
+  # for all tuples that were moved, for use in index maintenance.
+  def compact(self):
+    self.bufferPool.flushFilePages(self.fileId)
+
+    moves      = []
+    numPages   = self.numPages()
+    srcBuffer  = bytearray(self.pageSize())
+    dstIndex   = 0
+    dstPage    = self.emptyPage(dstIndex)
+
+    if self.zoneMap:
+      self.markZoneMapDirty()
+      self.zoneMap.clear()
+
+    for pageIndex in range(numPages):
+      srcPage   = self.readPage(self.pageId(pageIndex), srcBuffer)
+      srcTuples = [(tId, bytes(srcPage.getTuple(tId))) for tId in srcPage.tupleIds()]
+
+      for (tId, tupleData) in srcTuples:
+        if not dstPage.header.hasFreeTuple():
+          self.writePage(dstPage)
+          dstIndex += 1
+          dstPage = self.emptyPage(dstIndex)
+
+        newTupleId = dstPage.insertTuple(tupleData)
+        if newTupleId != tId:
+          moves.append((tId, newTupleId, tupleData))
+        if self.zoneMap:
+          self.zoneMap.addTuple(dstIndex, tupleData)
+
+    # Write out the final page if it holds any tuples, and truncate the file.
+    if dstPage.header.numTuples() > 0:
+      self.writePage(dstPage)
+      dstIndex += 1
+
+    self.truncate(dstIndex)
+    return moves
+
+  # Rewrites the file with its tuples in the given order, for example in key order
+  # to cluster a relation. All live tuples in the file must be given.
+  #
+  # Tuples are first appended in order to new pages beyond the current end of the file,
+  # which are then moved to the start of the file before truncating it. New pages are
+  # filled up to the given fill factor, leaving space for subsequent insertions near
+  # the tuples with neighbouring keys.
+  #
+  # Returns a list of (old tuple id, new tuple id, tuple data) triples
+  # for all tuples that were moved, for use in index maintenance.
+  def reorder(self, tupleIds, fillFactor=1.0):
+    self.bufferPool.flushFilePages(self.fileId)
+
+    placed     = []
+    numPages   = self.numPages()
+    pageTuples = max(1, math.floor(self.pageCapacity() * fillFactor))
+    srcBuffer  = bytearray(self.pageSize())
+    srcPage    = None
+    dstIndex   = numPages
+    dstPage    = self.emptyPage(dstIndex)
+
+    for tId in tupleIds:
+      if srcPage is None or srcPage.pageId != tId.pageId:
+        srcPage = self.readPage(tId.pageId, srcBuffer)
+
+      if dstPage.header.numTuples() == pageTuples:
+        self.writePage(dstPage)
+        dstIndex += 1
+        dstPage = self.emptyPage(dstIndex)
+
+      tupleData  = bytes(srcPage.getTuple(tId))
+      newTupleId = dstPage.insertTuple(tupleData)
+      placed.append((tId, TupleId(self.pageId(dstIndex - numPages), newTupleId.tupleIndex), tupleData))
+
+    if dstPage.header.numTuples() > 0:
+      self.writePage(dstPage)
+      dstIndex += 1
+
+    # Rebuild the zone map from the final locations of the tuples.
+    if self.zoneMap:
+      self.markZoneMapDirty()
+      self.zoneMap.clear()
+      for (_, newId, tupleData) in placed:
+        self.zoneMap.addTuple(newId.pageId.pageIndex, tupleData)
+
+    # Move the reordered pages to the start of the file.
+    for pageIndex in range(numPages, dstIndex):
+      page = self.readPage(self.pageId(pageIndex), srcBuffer)
+      page.pageId = self.pageId(pageIndex - numPages)
+      self.writePage(page)
+
+    self.truncate(dstIndex - numPages)
+    return [(oldId, newId, tupleData) for (oldId, newId, tupleData) in placed if oldId != newId]
+
+  # Constructs an empty page for the given page index, outside of the buffer pool.
+  def emptyPage(self, pageIndex):
+    return self.pageClass()(pageId=self.pageId(pageIndex), buffer=bytes(self.pageSize()), schema=self.schema())
+
+  # Shrinks the file to the given number of pages, refreshing the free page list.
+  # Any segments beyond the new end of the file are removed.
+  def truncate(self, numPages):
+    self.flush()
+    numSegments = max(1, math.ceil(numPages / self.pagesPerSegment()))
+    while len(self.segments) > numSegments:
+      self.segments.pop().close()
+      if self.directIO:
+        os.close(self.directFds.pop())
+      os.remove(self.segmentPath(len(self.segments)))
+
+    lastPages = numPages - (numSegments - 1) * self.pagesPerSegment()
+    lastStart = self.headerSize() if numSegments == 1 else 0
+    self.segments[-1].truncate(lastStart + self.pageSize() * lastPages)
+    self.freePages = set()
+    self.initializeFreePages()
+
+    if self.zoneMap:
+      self.markZoneMapDirty()
+      self.zoneMap.truncate(numPages)
+
+
+  # Zone maps
+  # A file may keep a zone map of its pages, saved in a file next to its first segment.
+  # The saved zone map is deleted on its first modification, and written again when
+  # the file is closed, so that a saved zone map is never stale.
+
+  def zoneMapPath(self):
+    return self.path + ".zone"
+
+  # Enables the file's zone map, loading a saved zone map if present, and otherwise
+  # building it by reading the file's pages.
+  def enableZoneMap(self):
+    if self.zoneMap is None:
+      if os.path.exists(self.zoneMapPath()):
+        with open(self.zoneMapPath(), 'rb') as f:
+          self.zoneMap = ZoneMap.unpack(self.schema(), f.read())
+      else:
+        self.rebuildZoneMap()
+
+  # Rebuilds the zone map by reading the file's pages directly.
+  # Thus any pages of the file in the buffer pool must be flushed beforehand.
+  def rebuildZoneMap(self):
+    self.zoneMap = ZoneMap(self.schema())
+    for (pageId, page) in self.directPages():
+      for tupleData in page:
+        self.zoneMap.addTuple(pageId.pageIndex, tupleData)
+    self.markZoneMapDirty()
+
+  def updateZoneMap(self, pageIndex, tupleData):
+    self.markZoneMapDirty()
+    self.zoneMap.addTuple(pageIndex, tupleData)
+
+  def markZoneMapDirty(self):
+    if not self.zoneDirty:
+      if os.path.exists(self.zoneMapPath()):
+        os.remove(self.zoneMapPath())
+      self.zoneDirty = True
+
+  def saveZoneMap(self):
+    if self.zoneMap and self.zoneDirty:
+      with open(self.zoneMapPath(), 'wb') as f:
+        f.write(self.zoneMap.pack())
+      self.zoneDirty = False
+
+  # Returns a density report for the file as a triple of the number of pages,
+  # the number of tuples, and the fraction of tuple capacity in use.
+  def density(self):
+    numPages  = self.numPages()
+    numTuples = self.numTuples()
+    capacity  = numPages * self.pageCapacity()
+    return (numPages, numTuples, numTuples / capacity if capacity else 1.0)
+
+
   # Iterators
   # Page header iterator
   def headers(self):
@@ -483,8 +1014,9 @@ class StorageFile:
 
   # Page iterator, using the buffer pool.
   # This can optionally pin the pages in the buffer pool while accessing them.
-  def pages(self, pinned=False):
-    return self.FilePageIterator(self, pinned)
+  # Pages may be skipped without being read by a filter on page indexes (e.g., from a zone map).
+  def pages(self, pinned=False, pageFilter=None):
+    return self.FilePageIterator(self, pinned, pageFilter=pageFilter)
 
   # Unbuffered page iterator.
   # Use with care, direct pages are not authoritative if the
@@ -492,11 +1024,30 @@ class StorageFile:
   def directPages(self):
     return self.FileDirectPageIterator(self)
 
+  # Page iterator over a single segment of the file, using the buffer pool.
+  # Segments may be scanned independently, for example by parallel workers.
+  def segment(self, segmentIndex, pinned=False):
+    (start, end) = self.segmentPageRange(segmentIndex)
+    return self.FilePageIterator(self, pinned, start, end)
+
+  # Asynchronous page iterator, using the buffer pool.
+  # This keeps up to 'prefetch' page reads outstanding to overlap I/O with processing.
+  def pagesAsync(self, pinned=False, prefetch=8):
+    return self.FileAsyncPageIterator(self, pinned, prefetch)
+
   # Tuple iterator
   # This can optionally pin its accessed pages in the buffer pool.
   def tuples(self, pinned=False):
     return self.FileTupleIterator(self)
 
+  # Tuple scan returning (tuple id, tuple data) pairs, for example when building indexes.
+  # Each page's tuples are copied before being returned, since the caller may access
+  # other pages through the buffer pool while scanning.
+  def tuplesWithIds(self):
+    for (_, page) in self.pages():
+      for entry in [(tupleId, bytes(page.getTuple(tupleId))) for tupleId in page.tupleIds()]:
+        yield entry
+
 
   def pack(self):
     if self.fileId and self.path:
@@ -543,21 +1094,80 @@ class StorageFile:
         raise StopIteration
 
   class FilePageIterator:
-    def __init__(self, storageFile, pinned=False):
-      self.currentPageIdx = 0
+    def __init__(self, storageFile, pinned=False, start=0, end=None, pageFilter=None):
+      self.currentPageIdx = start
+      self.endPageIdx     = end
       self.storageFile    = storageFile
       self.pinned         = pinned
+      self.pageFilter     = pageFilter
 
     def __iter__(self):
       return self
 
     def __next__(self):
-      pId = self.storageFile.pageId(self.currentPageIdx)
-      if self.storageFile.validPageId(pId):
+      while True:
+        pId = self.storageFile.pageId(self.currentPageIdx)
+        inRange = self.endPageIdx is None or self.currentPageIdx < self.endPageIdx
+        if inRange and self.storageFile.validPageId(pId):
+          self.currentPageIdx += 1
+          if self.pageFilter is None or self.pageFilter(pId.pageIndex):
+            return (pId, self.storageFile.bufferPool.getPage(pId, self.pinned))
+        else:
+          raise StopIteration
+
+  class FileAsyncPageIterator:
+    def __init__(self, storageFile, pinned=False, prefetch=8):
+      self.currentPageIdx = 0
+      self.storageFile    = storageFile
+      self.pinned         = pinned
+      self.prefetch       = max(1, prefetch)
+      self.pending        = []
+
+    def __aiter__(self):
+      return self
+
+    # Issues page reads up to the prefetch depth.
+    # Prefetched pages are pinned until they are returned, to prevent their eviction.
+    def issueReads(self):
+      bufPool = self.storageFile.bufferPool
+      while len(self.pending) < self.prefetch:
+        pId = self.storageFile.pageId(self.currentPageIdx)
+        if not self.storageFile.validPageId(pId):
+          break
         self.currentPageIdx += 1
-        return (pId, self.storageFile.bufferPool.getPage(pId, self.pinned))
+        self.pending.append((pId, asyncio.ensure_future(bufPool.getPageAsync(pId, pinned=True))))
+
+    async def __anext__(self):
+      self.issueReads()
+      if self.pending:
+        (pId, pendingPage) = self.pending.pop(0)
+        page = await pendingPage
+        if not self.pinned:
+          self.storageFile.bufferPool.unpinPage(pId)
+        return (pId, page)
       else:
-        raise StopIteration
+        raise StopAsyncIteration
+
+    # The iterator is an asynchronous context manager, closing it on exit, thus
+    # 'async with f.pagesAsync() as pages' releases prefetched pages on an early break.
+    async def __aenter__(self):
+      return self
+
+    async def __aexit__(self, excType, excValue, traceback):
+      await self.aclose()
+
+    # Stops the iteration, cancelling outstanding prefetches and unpinning the pages
+    # prefetched but not returned. Consumers stopping before the end call this method,
+    # or use the iterator as a context manager.
+    async def aclose(self):
+      (pending, self.pending) = (self.pending, [])
+      for (_, pendingPage) in pending:
+        pendingPage.cancel()
+
+      results = await asyncio.gather(*[pendingPage for (_, pendingPage) in pending], return_exceptions=True)
+      for ((pId, _), result) in zip(pending, results):
+        if not isinstance(result, BaseException):
+          self.storageFile.bufferPool.unpinPage(pId)
 
   class FileDirectPageIterator:
     def __init__(self, storageFile):
@@ -1,8 +1,11 @@
 import json, io, os, os.path, pickle
 
 from Catalog.Schema             import DBSchema
-from Catalog.Identifiers        import FileId
+from Catalog.Identifiers        import FileId, PageId, TupleId
+from Storage.BloomFilter        import BloomFilter
 from Storage.File               import StorageFile
+from Storage.Journal            import PageJournal
+from Storage.Index.BitmapIndex  import BitmapIndex
 from Storage.Index.IndexManager import IndexManager
 
 class FileManager:
@@ -13,6 +16,27 @@ class FileManager:
   relation name to a file identifier, and the second mapping a file
   identifier to the storage file object.
 
+  Relations may be clustered on their primary index, either on creation with the
+  'clustered' keyword argument, or by reorganizing the relation in key order with
+  clusterRelation. New tuples in a clustered relation are inserted in key order, on the
+  page of their successor in key order whenever that page has space, and otherwise next
+  to the previous tuple of their batch. Tuples placed elsewhere when neither page has
+  space are put back in key order by the next clusterRelation.
+
+  Relations may also hold Bloom filters over the keys of their lookups and joins, created
+  with createBloomFilter. Index lookups whose key schema matches a filter skip the index
+  for keys absent from the filter. Filters are sized from the relation's tuple count,
+  maintained on insertions and updates, and rebuilt on vacuuming or when they outgrow
+  their capacity. They are saved alongside the relation's file, and rebuilt on first
+  use if the saved copy is missing or stale.
+
+  With the 'transactional' keyword argument, the file manager commits tuple operations
+  in groups of 'groupCommitSize' operations, along with their index changes, and recovers
+  the last committed group when reopened after a crash (see commit and recover).
+
+  The 'indexCacheSize' and 'maxIndexCacheSize' keyword arguments size the BerkeleyDB
+  cache of the file manager's indexes (see IndexManager).
+
   >>> import Storage.BufferPool
   >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
   >>> bp = Storage.BufferPool.BufferPool()
@@ -34,11 +58,109 @@ class FileManager:
   >>> list(fm.relations())
   ['employee']
 
+  # Test Bloom filters on lookup keys.
+  >>> keySchema = DBSchema('employeeKey', [('id', 'int')])
+  >>> _ = fm.insertTuples(schema.name, [schema.pack(schema.instantiate(i, 20+i)) for i in range(100)])
+  >>> indexId = fm.createIndex(schema.name, schema, keySchema, True, build=True)
+  >>> fm.createBloomFilter(schema.name, keySchema)
+  >>> key = lambda i: keySchema.pack(keySchema.instantiate(i))
+  >>> all(fm.mayContainKey(schema.name, keySchema, key(i)) for i in range(100))
+  True
+
+  >>> sum(1 for i in range(100, 1100) if fm.mayContainKey(schema.name, keySchema, key(i))) < 50
+  True
+
+  >>> (fm.lookupByKey(schema.name, key(7)) is not None, fm.lookupByKey(schema.name, key(1007)))
+  (True, None)
+
+  >>> _ = fm.insertTuple(schema.name, schema.pack(schema.instantiate(1007, 0)))
+  >>> fm.lookupByKey(schema.name, key(1007)) is not None
+  True
+
+  # Filters are rebuilt on vacuuming, dropping deleted keys.
+  >>> fm.deleteByKey(schema.name, key(1007))
+  >>> fm.mayContainKey(schema.name, keySchema, key(1007))
+  True
+
+  >>> _ = fm.vacuum(schema.name)
+  >>> (fm.bloomFilter(schema.name, keySchema).count, fm.bloomFilter(schema.name, keySchema).capacity)
+  (100, 200)
+
   # Test FileManager construction on existing directory
+  >>> fm.close()
   >>> fm = FileManager(bufferPool=bp)
   >>> bp.setFileManager(fm)
   >>> list(fm.relations())
   ['employee']
+
+  >>> (fm.bloomFilter(schema.name, keySchema).count, fm.mayContainKey(schema.name, keySchema, key(42)))
+  (100, True)
+
+  >>> fm.removeRelation(schema.name)
+
+  # Test zone maps, maintained on insertion and restored with the file manager.
+  >>> fm.createRelation(schema.name, schema, zoneMaps=True)
+  >>> _ = fm.insertTuples(schema.name, [schema.pack(schema.instantiate(i, 20+i)) for i in range(5000)])
+  >>> zones = lambda: [fm.zoneMap(schema.name).zone(i) for i in range(fm.relationFile(schema.name)[1].numPages())]
+  >>> zoneList = zones()
+  >>> (len(zoneList) > 1, zoneList[0][0], zoneList[-1][1])
+  (True, [0, 20], [4999, 5019])
+
+  >>> fm.close()
+  >>> fm = FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+  >>> zones() == zoneList
+  True
+
+  >>> fm.removeRelation(schema.name)
+  >>> fm.close()
+
+  # Test transactional mode, committing every 10 insertions.
+  >>> import shutil
+  >>> tbp = Storage.BufferPool.BufferPool()
+  >>> tfm = FileManager(bufferPool=tbp, dataDir='txn/', transactional=True, groupCommitSize=10)
+  >>> tbp.setFileManager(tfm)
+  >>> tfm.createRelation(schema.name, schema)
+  >>> indexId = tfm.createIndex(schema.name, schema, keySchema, True)
+  >>> _ = [tfm.insertTuple(schema.name, schema.pack(schema.instantiate(i, 20+i))) for i in range(25)]
+  >>> tfm.commitSeq
+  2
+
+  # Simulate a crash by abandoning the file manager and buffer pool without closing them.
+  # Recovery rolls back the last 5 insertions, which were not committed.
+  >>> tbp = Storage.BufferPool.BufferPool()
+  >>> tfm = FileManager(bufferPool=tbp, dataDir='txn/', transactional=True, groupCommitSize=10)
+  >>> tbp.setFileManager(tfm)
+  >>> sorted(schema.unpack(tup).id for tup in tfm.tuples(schema.name)) == list(range(20))
+  True
+
+  >>> (tfm.lookupByKey(schema.name, key(19)) is not None, tfm.lookupByKey(schema.name, key(20)))
+  (True, None)
+
+  >>> tfm.relationFile(schema.name)[1].numTuples()
+  20
+
+  # A crash after the commit point, while writing pages in place, is completed from the journal.
+  >>> _ = tfm.insertTuples(schema.name, [schema.pack(schema.instantiate(i, 20+i)) for i in range(20, 30)])
+  >>> def crash(pages):
+  ...   raise IOError("Simulated crash")
+  >>> tfm.writePages = crash
+  >>> tfm.commit()
+  Traceback (most recent call last):
+  ...
+  OSError: Simulated crash
+
+  >>> tbp = Storage.BufferPool.BufferPool()
+  >>> tfm = FileManager(bufferPool=tbp, dataDir='txn/', transactional=True)
+  >>> tbp.setFileManager(tfm)
+  >>> sorted(schema.unpack(tup).id for tup in tfm.tuples(schema.name)) == list(range(30))
+  True
+
+  >>> (tfm.commitSeq, tfm.lookupByKey(schema.name, key(29)) is not None)
+  (3, True)
+
+  >>> tfm.close()
+  >>> shutil.rmtree('txn/')
   """
 
   defaultDataDir     = "data/"
@@ -47,6 +169,12 @@ class FileManager:
   checkpointEncoding = "latin1"
   checkpointFile     = "db.fm"
 
+  # Transactional mode: the default number of tuple operations per group commit, the
+  # page journal, and a file present while the file manager is open.
+  defaultGroupCommitSize = 64
+  journalFile            = "db.journal"
+  activeFile             = "db.active"
+
   def __init__(self, **kwargs):
     other = kwargs.get("other", None)
     if other:
@@ -57,6 +185,16 @@ class FileManager:
       self.dataDir         = kwargs.get("dataDir", FileManager.defaultDataDir)
       self.indexDir        = kwargs.get("indexDir", os.path.join(self.dataDir, "index"))
       self.defaultPageSize = kwargs.get("pageSize", io.DEFAULT_BUFFER_SIZE)
+      self.directIO        = kwargs.get("directIO", False)
+      self.indexType       = kwargs.get("indexType", IndexManager.defaultIndexType)
+      self.transactional   = kwargs.get("transactional", False)
+      self.groupCommitSize = kwargs.get("groupCommitSize", FileManager.defaultGroupCommitSize)
+      self.indexCacheSize  = kwargs.get("indexCacheSize", None)
+      self.maxIndexCacheSize = kwargs.get("maxIndexCacheSize", self.indexCacheSize)
+      self.journal         = PageJournal(path=os.path.join(self.dataDir, FileManager.journalFile))
+      self.pendingPages    = {}    # page id -> image of a page written back since the last commit
+      self.pendingOps      = 0
+      self.commitSeq       = 0
 
       if self.bufferPool is None:
         raise ValueError("No buffer pool found when initializing a file manager")
@@ -72,7 +210,14 @@ class FileManager:
         self.fileCounter   = kwargs.get("fileCounter", 0)
         self.relationFiles = kwargs.get("relationFiles", {})
         self.fileMap       = kwargs.get("fileMap", {})
-        self.indexManager  = kwargs.get("indexManager", IndexManager(indexDir=self.indexDir))
+        self.clustered     = set(kwargs.get("clustered", []))
+        self.zoneMapped    = set(kwargs.get("zoneMapped", []))
+        self.bloomFilters  = {}
+        self.bloomDirty    = set()
+        self.indexManager  = kwargs.get("indexManager", IndexManager(indexDir=self.indexDir, indexType=self.indexType, \
+                                                                      transactional=self.transactional, \
+                                                                      cacheSize=self.indexCacheSize, \
+                                                                      maxCacheSize=self.maxIndexCacheSize))
 
         if restoring:
           self.relationFiles = dict([(i[0], FileId(i[1])) for i in kwargs["restore"][0]])
@@ -80,25 +225,53 @@ class FileManager:
             fId   = FileId(i[0])
             fPath = i[1]
             self.fileMap[fId] = \
-              self.fileClass(bufferPool=self.bufferPool, fileId=fId, filePath=fPath, mode="update")
+              self.fileClass(bufferPool=self.bufferPool, fileId=fId, filePath=fPath, mode="update", \
+                             directIO=self.directIO)
+
+          for relId in self.zoneMapped:
+            if relId in self.relationFiles:
+              self.fileMap[self.relationFiles[relId]].enableZoneMap()
+
+          self.restoreBloomFilters(kwargs.get("bloomFilters", []))
 
       else:
         self.restore()
 
+      if self.indexManager:
+        self.indexManager.setFileManager(self)
+
+      if self.transactional and not restoring:
+        self.recover()
+
   def fromOther(self, other):
     self.bufferPool      = other.bufferPool
     self.dataDir         = other.dataDir
     self.defaultPageSize = other.defaultPageSize
+    self.directIO        = other.directIO
+    self.indexType       = other.indexType
+    self.transactional   = other.transactional
+    self.groupCommitSize = other.groupCommitSize
+    self.indexCacheSize  = other.indexCacheSize
+    self.maxIndexCacheSize = other.maxIndexCacheSize
+    self.journal         = other.journal
+    self.pendingPages    = other.pendingPages
+    self.pendingOps      = other.pendingOps
+    self.commitSeq       = other.commitSeq
     self.fileClass       = other.fileClass
     self.fileCounter     = other.fileCounter
     self.relationFiles   = other.relationFiles
     self.fileMap         = other.fileMap
+    self.clustered       = other.clustered
+    self.zoneMapped      = other.zoneMapped
+    self.bloomFilters    = other.bloomFilters
+    self.bloomDirty      = other.bloomDirty
     self.indexDir        = other.indexDir
     self.indexManager    = other.indexManager
 
   # Closes and flushes all storage files in the file manager.
   # This includes flushing all pages held in the buffer pool.
   def close(self):
+    self.commit()
     if self.bufferPool:
       self.bufferPool.clear()
 
@@ -109,8 +282,15 @@ class FileManager:
     if self.indexManager:
       self.indexManager.close()
 
+    for relId in list(self.bloomDirty):
+      self.saveBloomFilters(relId)
+
     self.checkpoint()
 
+    activePath = os.path.join(self.dataDir, FileManager.activeFile)
+    if os.path.exists(activePath):
+      os.remove(activePath)
+
   # Save the file manager internals to the data directory.
   # The index manager is responsible for checkpointing itself.
   def checkpoint(self):
@@ -122,7 +302,9 @@ class FileManager:
   def restore(self):
     fmPath = os.path.join(self.dataDir, FileManager.checkpointFile)
     with open(fmPath, 'r', encoding=FileManager.checkpointEncoding) as f:
-      other = FileManager.unpack(self.bufferPool, f.read())
+      other = FileManager.unpack(self.bufferPool, f.read(), directIO=self.directIO, indexType=self.indexType, \
+                                 transactional=self.transactional, groupCommitSize=self.groupCommitSize, \
+                                 indexCacheSize=self.indexCacheSize, maxIndexCacheSize=self.maxIndexCacheSize)
       self.fromOther(other)
 
   # Return the relation ids present in the file manager.
@@ -132,7 +314,11 @@ class FileManager:
   def hasRelation(self, relId):
     return relId in self.relationFiles
 
-  def createRelation(self, relId, schema):
+  # Creates a storage file for a new relation.
+  # The relation's page size and the number of pages per file segment may be given
+  # with the 'pageSize' and 'segmentPages' keyword arguments. With 'zoneMaps' set, the
+  # relation's file keeps per-page minimum and maximum values of its numeric attributes.
+  def createRelation(self, relId, schema, **kwargs):
     if relId not in self.relationFiles:
       fId = FileId(self.fileCounter)
       path = os.path.join(self.dataDir, str(self.fileCounter)+'.rel')
@@ -141,7 +327,15 @@ class FileManager:
       self.fileMap[fId] = \
         self.fileClass(bufferPool=self.bufferPool, \
                        fileId=fId, filePath=path, mode="create", \
-                       pageSize=self.defaultPageSize, schema=schema)
+                       pageSize=kwargs.get("pageSize", self.defaultPageSize), schema=schema, \
+                       segmentPages=kwargs.get("segmentPages", None), directIO=self.directIO, \
+                       zoneMaps=kwargs.get("zoneMaps", False))
+
+      if kwargs.get("clustered", False):
+        self.clustered.add(relId)
+
+      if kwargs.get("zoneMaps", False):
+        self.zoneMapped.add(relId)
 
       self.checkpoint()
 
@@ -150,21 +344,26 @@ class FileManager:
       self.fileCounter          = max(self.fileCounter, fileId.fileIndex+1)
       self.relationFiles[relId] = fileId
       self.fileMap[fileId]      = storageFile
+      if storageFile.zoneMap is not None:
+        self.zoneMapped.add(relId)
       self.checkpoint()
 
   # Removes or detaches a relation from the file manager.
   # When detaching, we do not delete the backing heap file from the file system.
   # This method also removes or detaches any indexes associated with the delation.
   def removeRelation(self, relId, detach=False):
+    self.commit()
     fId   = self.relationFiles.pop(relId, None)
     rFile = self.fileMap.pop(fId, None) if fId else None
+    self.clustered.discard(relId)
+    self.zoneMapped.discard(relId)
+    self.removeBloomFilters(relId, fId, detach)
     if rFile and self.indexManager:
       for (_, _, indexId) in self.indexManager.indexes(relId):
         self.indexManager.removeIndex(relId, indexId, detach)
 
       if not detach:
-        rFile.close()
-        os.remove(rFile.path)
+        rFile.remove()
 
       self.checkpoint()
 
@@ -173,26 +372,192 @@ class FileManager:
     return (fId, self.fileMap.get(fId, None)) if fId else (None, None)
 
 
+  # Index file operations.
+  # Index files are storage files held in the index directory, for indexes whose
+  # pages are managed by our buffer pool (e.g., B+-trees). These files are tracked
+  # in the file map alongside relation files, but are not relations themselves.
+
+  # Creates an index file with the given page class, returning its file id and storage file.
+  def createIndexFile(self, fileName, schema, pageClass):
+    fId  = FileId(self.fileCounter)
+    path = os.path.join(self.indexDir, fileName+'.idx')
+    self.fileCounter += 1
+    self.fileMap[fId] = \
+      self.fileClass(bufferPool=self.bufferPool, \
+                     fileId=fId, filePath=path, mode="create", \
+                     pageSize=self.defaultPageSize, pageClass=pageClass, schema=schema, \
+                     directIO=self.directIO)
+
+    self.checkpoint()
+    return (fId, self.fileMap[fId])
+
+  def indexFile(self, fileId):
+    return self.fileMap.get(fileId, None) if fileId not in self.relationFiles.values() else None
+
+  # Removes an index file, discarding any of its pages in the buffer pool.
+  def removeIndexFile(self, fileId):
+    iFile = self.fileMap.pop(fileId, None) if fileId not in self.relationFiles.values() else None
+    if iFile:
+      self.bufferPool.discardFilePages(fileId)
+      iFile.remove()
+      self.checkpoint()
+
+
   # Page operations
+
+  # Returns the page size of the given file.
+  def filePageSize(self, fileId):
+    rFile = self.fileMap.get(fileId, None) if fileId else None
+    return rFile.pageSize() if rFile else self.defaultPageSize
+
+  # Pages written back since the last commit in transactional mode are read from their
+  # pending images, rather than from their files.
   def readPage(self, pageId, pageBuffer):
     rFile = self.fileMap.get(pageId.fileId, None) if pageId else None
-    if rFile:
+    if rFile and pageId in self.pendingPages:
+      return self.readPendingPage(rFile, pageId, pageBuffer)
+    elif rFile:
       return rFile.readPage(pageId, pageBuffer)
 
+  async def readPageAsync(self, pageId, pageBuffer, executor=None):
+    rFile = self.fileMap.get(pageId.fileId, None) if pageId else None
+    if rFile and pageId in self.pendingPages:
+      return self.readPendingPage(rFile, pageId, pageBuffer)
+    elif rFile:
+      return await rFile.readPageAsync(pageId, pageBuffer, executor)
+
+  def readPendingPage(self, rFile, pageId, pageBuffer):
+    image = self.pendingPages[pageId]
+    pageBuffer[0:len(image)] = image
+    return rFile.unpackPage(pageId, pageBuffer, len(image))
+
+  # In transactional mode, pages are not written in place before they are committed.
+  # Pages written back by the buffer pool (e.g., on eviction) are instead held as
+  # pending images until the next commit.
   def writePage(self, page):
     rFile = self.fileMap.get(page.pageId.fileId, None) if page.pageId else None
-    if rFile:
+    if rFile and self.transactional:
+      page.setDirty(False)
+      self.pendingPages[page.pageId] = page.pack()
+      rFile.refreshFreePage(page)
+    elif rFile:
       return rFile.writePage(page)
 
+  # Writes page images in place, and forces the files written to stable storage.
+  def writePages(self, pages):
+    written = {}
+    for (pageId, image) in sorted(pages.items(), key=lambda e: (e[0].fileId.fileIndex, e[0].pageIndex)):
+      rFile = self.fileMap.get(pageId.fileId, None)
+      if rFile:
+        rFile.writePageData(pageId, image)
+        written[pageId.fileId] = rFile
+
+    for rFile in written.values():
+      rFile.sync()
+
+
+  # Transactions.
+  # In transactional mode, tuple operations are committed in groups: the heap and index
+  # pages modified by a group of operations are written in place, along with the index
+  # manager's transaction, once the group holds 'groupCommitSize' operations or on an
+  # explicit commit. A crash thus loses at most the operations of the uncommitted group.
+  # Index creation and removal, relation removal, vacuuming and clustering commit any
+  # pending operations beforehand and their own changes afterwards, but are not
+  # themselves atomic.
+
+  # Counts a tuple operation towards the current group, committing the group once it
+  # holds 'groupCommitSize' operations, or once the pages held for it outgrow the buffer pool.
+  def endOperation(self):
+    if self.transactional:
+      self.pendingOps += 1
+      if self.pendingOps >= self.groupCommitSize or len(self.pendingPages) >= self.bufferPool.numPages():
+        self.commit()
+
+  # Commits the operations since the last commit. The images of all pages modified since
+  # the last commit are written to the journal, before the index manager's transaction
+  # commits with the group's sequence number. This is the group's commit point, after
+  # which the pages are written in place and the journal is cleared.
+  def commit(self):
+    if self.transactional:
+      pages = dict(self.pendingPages)
+      dirty = [page for page in self.bufferPool.dirtyPages() if page.pageId.fileId in self.fileMap]
+      for page in dirty:
+        page.setDirty(False)
+        pages[page.pageId] = page.pack()
+
+      if pages or self.indexManager.txn is not None:
+        sequence = self.commitSeq + 1
+        if pages:
+          self.journal.write(sequence, [(pageId.fileId.fileIndex, pageId.pageIndex, image) \
+                                          for (pageId, image) in pages.items()])
+        self.indexManager.commit(sequence)
+        self.writePages(pages)
+        self.journal.clear()
+        self.pendingPages = {}
+        self.commitSeq    = sequence
+
+      self.pendingOps = 0
+
+  # Recovers from a crash on opening in transactional mode, if the file manager was not
+  # closed. The index manager's environment is recovered to its last committed sequence
+  # number when opened, and the journal completes the in-place writes of that sequence
+  # number if they were interrupted. Uncommitted pages were never written in place.
+  # State saved on close (file headers, free pages, zone maps, bitmap indexes and Bloom
+  # filters) is then rebuilt from the recovered pages.
+  def recover(self):
+    activePath     = os.path.join(self.dataDir, FileManager.activeFile)
+    self.commitSeq = self.indexManager.commitSequence()
+    if os.path.exists(activePath):
+      journaled = self.journal.read()
+      if journaled and journaled[0] <= self.commitSeq:
+        self.writePages(dict((PageId(FileId(fileIndex), pageIndex), image) \
+                               for (fileIndex, pageIndex, image) in journaled[1]))
+      self.journal.clear()
+
+      # Rebuilding bitmap indexes scans relations through the buffer pool, which
+      # may not be bound to this file manager yet.
+      if self.bufferPool.fileMgr is None:
+        self.bufferPool.setFileManager(self)
+
+      for fId in self.fileMap:
+        self.bufferPool.discardFilePages(fId)
+
+      for relId in self.relations():
+        self.relationFile(relId)[1].refreshFromPages()
+        for (_, _, indexId) in self.indexManager.indexes(relId):
+          indexDb = self.indexManager.getIndex(indexId)
+          if isinstance(indexDb, BitmapIndex):
+            indexDb.remove()
+            self.indexManager.buildIndex(relId, indexId, self.tuplesWithIds(relId))
+
+      for filters in self.bloomFilters.values():
+        for (fields, (keySchema, falsePositiveRate, _)) in list(filters.items()):
+          filters[fields] = (keySchema, falsePositiveRate, None)
+
+      self.indexManager.commit()
+
+    open(activePath, 'w').close()
+
 
   # Index management wrappers.
   def hasIndex(self, relId, keySchema):
     if relId in self.relationFiles and self.indexManager:
       return self.indexManager.hasIndex(relId, keySchema)
 
-  def createIndex(self, relId, relSchema, keySchema, primary):
+  # Index options (e.g., 'indexType') may be passed as keyword arguments.
+  # With 'build' set, the index is populated from the relation's existing tuples in a
+  # single scan, sorting entries in runs of the optional 'runSize' keyword argument and
+  # reporting to the optional progress callback (see IndexManager.buildIndex).
+  def createIndex(self, relId, relSchema, keySchema, primary, build=False, progress=None, **kwargs):
     if relId in self.relationFiles and self.indexManager:
-      return self.indexManager.createIndex(relId, relSchema, keySchema, primary)
+      runSize = kwargs.pop("runSize", None)
+      self.commit()
+      indexId = self.indexManager.createIndex(relId, relSchema, keySchema, primary, **kwargs)
+      if build:
+        self.commit()
+        self.indexManager.buildIndex(relId, indexId, self.tuplesWithIds(relId), progress, runSize)
+      self.commit()
+      return indexId
 
   def addIndex(self, relId, relSchema, keySchema, primary, indexId, indexDb):
     if relId in self.relationFiles and self.indexManager:
@@ -200,6 +565,7 @@ class FileManager:
 
   def removeIndex(self, relId, indexId):
     if relId in self.relationFiles and self.indexManager:
+      self.commit()
       self.indexManager.removeIndex(relId, indexId)
 
   def getIndex(self, indexId):
@@ -212,52 +578,99 @@ class FileManager:
   def insertTuple(self, relId, tupleData):
     (_, rFile) = self.relationFile(relId)
     if rFile and self.indexManager:
-      tupleId = rFile.insertTuple(tupleData)
+      tupleId = self.placeTuples(relId, rFile, [tupleData])[0]
       self.indexManager.insertTuple(relId, tupleData, tupleId)
+      self.addBloomKeys(relId, [tupleData])
+      self.endOperation()
       return tupleId
 
   def deleteTuple(self, relId, tupleId):
-    rFile = self.fileMap.get(tupleId.pageId.fileIndex, None)
+    rFile = self.fileMap.get(tupleId.pageId.fileId, None)
     if rFile and self.indexManager:
       tupleData = rFile.deleteTuple(tupleId)
       self.indexManager.deleteTuple(relId, tupleData, tupleId)
+      self.endOperation()
 
   def updateTuple(self, relId, tupleId, tupleData):
-    rFile = self.fileMap.get(tupleId.pageId.fileIndex, None)
+    rFile = self.fileMap.get(tupleId.pageId.fileId, None)
     if rFile and self.indexManager:
       oldData = rFile.updateTuple(tupleId, tupleData)
       self.indexManager.updateTuple(relId, oldData, tupleData, tupleId)
+      self.addBloomKeys(relId, [tupleData])
+      self.endOperation()
+
+  # Batched tuple operations.
+  # These modify a list of tuples in the relation's file, and then maintain
+  # all indexes on the relation in a single batch.
+
+  # Returns the tuple ids for the newly inserted data, in input order.
+  def insertTuples(self, relId, tupleDataList):
+    (_, rFile) = self.relationFile(relId)
+    if rFile and self.indexManager:
+      tupleDataList = list(tupleDataList)
+      tupleIds      = self.placeTuples(relId, rFile, tupleDataList)
+      self.indexManager.insertTuples(relId, list(zip(tupleDataList, tupleIds)))
+      self.addBloomKeys(relId, tupleDataList)
+      self.endOperation()
+      return tupleIds
+
+  # Tuples are deleted in descending tuple id order, since deletions
+  # from contiguous pages shift the subsequent tuples in the page.
+  def deleteTuples(self, relId, tupleIds):
+    (_, rFile) = self.relationFile(relId)
+    if rFile and self.indexManager:
+      tupleIds = sorted(tupleIds, key=lambda t: (t.pageId.pageIndex, t.tupleIndex), reverse=True)
+      deleted  = [(rFile.deleteTuple(tupleId), tupleId) for tupleId in tupleIds]
+      self.indexManager.deleteTuples(relId, deleted)
+      self.endOperation()
+
+  # Updates are given as a list of (tuple id, tuple data) pairs.
+  def updateTuples(self, relId, updates):
+    (_, rFile) = self.relationFile(relId)
+    if rFile and self.indexManager:
+      changes = [(rFile.updateTuple(tupleId, tupleData), tupleData, tupleId) for (tupleId, tupleData) in updates]
+      self.indexManager.updateTuples(relId, changes)
+      self.addBloomKeys(relId, [tupleData for (_, tupleData) in updates])
+      self.endOperation()
 
 
   # Index-based tuple operations.
 
   # Perform an index lookup for the given key.
-  # This returns an iterator over tuple ids.
+  # This returns an iterator over tuple ids, and skips the index for keys
+  # absent from a Bloom filter on the index key.
   def lookupByIndex(self, relId, indexId, keyData):
     if relId in self.relationFiles and self.indexManager:
+      keySchema = self.indexManager.indexKeySchema(relId, indexId)
+      if keySchema is not None and not self.mayContainKey(relId, keySchema, keyData):
+        return iter([])
       return self.indexManager.lookupByIndex(indexId, keyData)
 
+  # Perform index lookups for a batch of keys, as (key, tuple id list) pairs for the keys found.
+  # Keys rejected by the relation's Bloom filter on the index key are not probed.
+  def lookupMany(self, relId, indexId, keys):
+    if relId in self.relationFiles and self.indexManager:
+      keySchema = self.indexManager.indexKeySchema(relId, indexId)
+      if keySchema is not None:
+        keys = [keyData for keyData in keys if self.mayContainKey(relId, keySchema, keyData)]
+      return self.indexManager.lookupMany(indexId, keys)
+
   # Removes tuple(s) by key using the given index.
-  # This should maintain all other indexes by retrieving the full tuple and tuple id,
-  # and then using the deleteTuple method.
+  # This maintains all indexes with a batched deletion of the matching tuples.
   def deleteByIndex(self, relId, indexId, keyData):
     if relId in self.relationFiles and self.indexManager:
       tupleIds = self.indexManager.lookupByIndex(indexId, keyData)
-      for tupleId in tupleIds:
-        tupleData = self.deleteTuple(relId, tupleId)
-        if tupleData:
-          self.indexManager.deleteTuple(relId, tupleData, tupleId)
+      if tupleIds is not None:
+        self.deleteTuples(relId, list(tupleIds))
 
   # Refreshes tuple(s) by key using the given index.
-  # This should support the key value itself changing, and also maintain all other indexes
-  # by retrieving the full tuple and tuple id, and then using the updateTuple method.
+  # This supports the key value itself changing, and maintains all indexes
+  # with a batched update of the matching tuples.
   def updateByIndex(self, relId, indexId, keyData, tupleData):
     if relId in self.relationFiles and self.indexManager:
       tupleIds = self.indexManager.lookupByIndex(indexId, keyData)
-      for tupleId in tupleIds:
-        oldData = self.updateTuple(relId, tupleId)
-        if oldData:
-          self.indexManager.updateTuple(relId, oldData, tupleData, tupleId)
+      if tupleIds is not None:
+        self.updateTuples(relId, [(tupleId, tupleData) for tupleId in tupleIds])
 
   # Retrieve a tuple based on its key.
   # This method returns None if the relation does not have a primary index,
@@ -265,24 +678,210 @@ class FileManager:
   # Otherwise it returns a single tuple identifier.
   def lookupByKey(self, relId, keyData):
     if relId in self.relationFiles and self.indexManager:
-      self.lookupByKey(relId, keyData)
+      primary = self.indexManager.relationIndexes[relId][1] if self.indexManager.hasPrimaryIndex(relId) else None
+      if primary is not None and not self.mayContainKey(relId, primary[0], keyData):
+        return None
+      return self.indexManager.lookupByKey(relId, keyData)
 
   # Removes a tuple based on its primary key value.
   def deleteByKey(self, relId, keyData):
     if relId in self.relationFiles and self.indexManager:
-      tupleId   = self.indexManager.lookupByKey(relId, keyData)
-      tupleData = self.deleteTuple(relId, tupleId)
-      if tupleData:
-        self.indexManager.deleteTuple(relId, tupleData, tupleId)
+      tupleId = self.indexManager.lookupByKey(relId, keyData)
+      if tupleId is not None:
+        self.deleteTuple(relId, tupleId)
 
   # Updates a tuple based on its primary key value.
   # This should support a change in the key.
   def updateByKey(self, relId, keyData, tupleData):
     if relId in self.relationFiles and self.indexManager:
       tupleId = self.indexManager.lookupByKey(relId, keyData)
-      oldData = self.updateTuple(relId, tupleId, tupleData)
-      if oldData:
-        self.indexManager.updateTuple(relId, oldData, tupleData, tupleId)
+      if tupleId is not None:
+        self.updateTuple(relId, tupleId, tupleData)
+
+
+  # Relation maintenance.
+
+  def isClustered(self, relId):
+    return relId in self.clustered
+
+  # Returns the positions of the given tuples in the order to insert them, each paired
+  # with the page of its successor in primary key order for a clustered relation.
+  # Tuples of other relations keep their input order, and are not given a page.
+  def clusterPages(self, relId, tupleDataList):
+    neighbours = self.indexManager.primaryNeighbours(relId, tupleDataList) if relId in self.clustered else None
+    if neighbours is None:
+      return [(i, None) for i in range(len(tupleDataList))]
+    return [(i, tupleId.pageId if tupleId else None) for (i, tupleId) in neighbours]
+
+  # Inserts tuples into a relation's file, returning their tuple ids in input order.
+  # A tuple of a clustered relation goes to its successor's page if that page has space,
+  # and otherwise to the page of the previous tuple in key order from the same batch.
+  # If neither has space, the file picks any page with space.
+  def placeTuples(self, relId, rFile, tupleDataList):
+    tupleIds = [None] * len(tupleDataList)
+    previous = None
+    for (i, pageId) in self.clusterPages(relId, tupleDataList):
+      tupleIds[i] = rFile.insertTuple(tupleDataList[i], pageId if pageId in rFile.freePages else previous)
+      previous    = tupleIds[i].pageId if relId in self.clustered else None
+    return tupleIds
+
+  # Reorganizes a relation's file in primary key order, updating all indexes with the
+  # new tuple locations, and marks the relation as clustered. Pages are filled up to
+  # the given fill factor, leaving space for insertions in key order. Tuples are ordered
+  # by their decoded key values rather than by the index's binary key representation.
+  # Returns the relation's density report after clustering.
+  def clusterRelation(self, relId, fillFactor=1.0):
+    (_, rFile) = self.relationFile(relId)
+    if rFile and self.indexManager:
+      if not self.indexManager.hasPrimaryIndex(relId):
+        raise ValueError("Cannot cluster relation "+relId+" without a primary index")
+
+      if not self.indexManager.orderedIndex(self.indexManager.getPrimaryIndex(relId)):
+        raise ValueError("Cannot cluster relation "+relId+" on an unordered primary index")
+
+      self.commit()
+      keySchema = self.indexManager.relationIndexes[relId][1][0]
+      entries   = sorted(self.indexManager.scanByKey(relId), key=lambda entry: keySchema.unpack(entry[0]))
+      tupleIds  = [TupleId.unpack(tupleId) for (_, tupleId) in entries]
+      moves     = rFile.reorder(tupleIds, fillFactor)
+      self.indexManager.relocateTuples(relId, moves)
+      self.clustered.add(relId)
+      self.commit()
+      self.checkpoint()
+      return rFile.density()
+
+  # Vacuums a relation, compacting its live tuples into fewer pages and
+  # truncating its file. All indexes on the relation are updated in bulk
+  # with the new locations of any moved tuples.
+  # Returns the relation's density report after vacuuming.
+  def vacuum(self, relId):
+    (_, rFile) = self.relationFile(relId)
+    if rFile:
+      self.commit()
+      moves = rFile.compact()
+      if self.indexManager:
+        self.indexManager.relocateTuples(relId, moves)
+      self.commit()
+      self.rebuildBloomFilters(relId)
+      return rFile.density()
+
+  # Returns a dictionary of density reports for the given relations, or all relations.
+  def densityReport(self, relIds=None):
+    relIds = self.relations() if relIds is None else relIds
+    return dict([(relId, self.relationFile(relId)[1].density()) for relId in relIds if self.hasRelation(relId)])
+
+
+
+  # Bloom filters.
+  # Each relation holds its filters as a dictionary keyed by the key's field names,
+  # whose values are (key schema, false positive rate, filter) triples. A filter of
+  # None is built from the relation on its next use.
+
+  # Creates a Bloom filter over the given key of a relation, sized from the relation's
+  # current number of tuples and populated with the keys of its existing tuples.
+  # Filters on temporary relations, e.g., hash join partitions, need not be recorded
+  # in the file manager's checkpoint, and are created with persist=False.
+  def createBloomFilter(self, relId, keySchema, falsePositiveRate=BloomFilter.defaultFalsePositiveRate, persist=True):
+    if relId in self.relationFiles:
+      self.bloomFilters.setdefault(relId, {})[tuple(keySchema.fields)] = (keySchema, falsePositiveRate, None)
+      self.rebuildBloomFilters(relId)
+      if persist:
+        self.checkpoint()
+
+  # Returns the Bloom filter over the given key of a relation, or None if there is none.
+  def bloomFilter(self, relId, keySchema):
+    filters = self.bloomFilters.get(relId, {})
+    fields  = tuple(keySchema.fields)
+    if fields in filters and filters[fields][2] is None:
+      self.rebuildBloomFilters(relId)
+    return filters[fields][2] if fields in filters else None
+
+  # Returns False if the key is certainly absent from the relation, based on a
+  # Bloom filter over the key, and True otherwise.
+  def mayContainKey(self, relId, keySchema, keyData):
+    bloomFilter = self.bloomFilter(relId, keySchema) if relId in self.bloomFilters else None
+    return bloomFilter is None or keyData in bloomFilter
+
+  # Rebuilds all Bloom filters of a relation from a scan of its tuples, sizing them
+  # with headroom over the number of tuples in the relation's file header, so that
+  # later insertions do not immediately overload them. Rebuilt filters are saved
+  # when the file manager is closed.
+  def rebuildBloomFilters(self, relId):
+    (_, rFile) = self.relationFile(relId)
+    filters    = self.bloomFilters.get(relId, None)
+    if rFile and filters:
+      schema   = rFile.schema()
+      capacity = BloomFilter.growthFactor * rFile.numTuples()
+      for (fields, (keySchema, falsePositiveRate, _)) in list(filters.items()):
+        filters[fields] = (keySchema, falsePositiveRate, \
+                           BloomFilter(capacity=capacity, falsePositiveRate=falsePositiveRate))
+
+      for tupleData in rFile.tuples():
+        for (keySchema, _, bloomFilter) in filters.values():
+          bloomFilter.add(schema.projectBinary(tupleData, keySchema))
+
+      self.markBloomDirty(relId)
+
+  # Adds the keys of inserted or updated tuples to a relation's Bloom filters,
+  # rebuilding the filters once any of them is overloaded.
+  def addBloomKeys(self, relId, tupleDataList):
+    filters = self.bloomFilters.get(relId, None)
+    if filters:
+      schema = self.relationFile(relId)[1].schema()
+      self.markBloomDirty(relId)
+      for (keySchema, _, bloomFilter) in filters.values():
+        if bloomFilter is not None:
+          for tupleData in tupleDataList:
+            bloomFilter.add(schema.projectBinary(tupleData, keySchema))
+
+      if any(bloomFilter.overloaded() for (_, _, bloomFilter) in filters.values() if bloomFilter):
+        self.rebuildBloomFilters(relId)
+
+  # Bloom filters are saved in a file next to the relation's file. This file is deleted
+  # on the first modification of a saved filter, and written again when the file manager
+  # is closed, so that a saved filter is never stale.
+  def bloomFilterPath(self, fileId):
+    return os.path.join(self.dataDir, str(fileId.fileIndex)+'.bloom')
+
+  def markBloomDirty(self, relId):
+    if relId not in self.bloomDirty:
+      path = self.bloomFilterPath(self.relationFiles[relId])
+      if os.path.exists(path):
+        os.remove(path)
+      self.bloomDirty.add(relId)
+
+  def saveBloomFilters(self, relId):
+    filters = self.bloomFilters.get(relId, {})
+    with open(self.bloomFilterPath(self.relationFiles[relId]), 'wb') as f:
+      pickle.dump(dict([(fields, bloomFilter.pack()) for (fields, (_, _, bloomFilter)) in filters.items() \
+                          if bloomFilter is not None]), f)
+    self.bloomDirty.discard(relId)
+
+  # Restores Bloom filters from a list of (relation, [(key schema, false positive rate)])
+  # pairs, loading saved filters where available.
+  def restoreBloomFilters(self, specs):
+    for (relId, relSpecs) in specs:
+      if relId in self.relationFiles:
+        path  = self.bloomFilterPath(self.relationFiles[relId])
+        saved = {}
+        if os.path.exists(path):
+          with open(path, 'rb') as f:
+            saved = pickle.load(f)
+
+        filters = self.bloomFilters.setdefault(relId, {})
+        for (packedKeySchema, falsePositiveRate) in relSpecs:
+          keySchema   = DBSchema.unpackSchema(packedKeySchema.encode())
+          fields      = tuple(keySchema.fields)
+          bloomFilter = BloomFilter.unpack(saved[fields]) if fields in saved else None
+          filters[fields] = (keySchema, falsePositiveRate, bloomFilter)
+
+  # Removes a relation's Bloom filters, along with their saved copy unless detaching.
+  def removeBloomFilters(self, relId, fileId, detach=False):
+    self.bloomDirty.discard(relId)
+    if self.bloomFilters.pop(relId, None) is not None and fileId and not detach:
+      path = self.bloomFilterPath(fileId)
+      if os.path.exists(path):
+        os.remove(path)
 
 
   # Tuple-based table scan
@@ -291,11 +890,35 @@ class FileManager:
     if rFile:
       return rFile.tuples()
 
-  # Page-based table scan
-  def pages(self, relId):
+  # Tuple-based table scan, returning (tuple id, tuple data) pairs.
+  def tuplesWithIds(self, relId):
+    (_, rFile) = self.relationFile(relId)
+    if rFile:
+      return rFile.tuplesWithIds()
+
+  # Page-based table scan, optionally skipping pages rejected by a filter on page indexes.
+  def pages(self, relId, pageFilter=None):
+    (_, rFile) = self.relationFile(relId)
+    if rFile:
+      return rFile.pages(pageFilter=pageFilter)
+
+  # Returns the zone map of a relation, or None if the relation does not keep one.
+  def zoneMap(self, relId):
+    (_, rFile) = self.relationFile(relId)
+    if rFile:
+      return rFile.zoneMap
+
+  # Per-segment page-based table scans, one page iterator per file segment.
+  def segments(self, relId, pinned=False):
+    (_, rFile) = self.relationFile(relId)
+    if rFile:
+      return [rFile.segment(i, pinned) for i in range(rFile.numSegments())]
+
+  # Asynchronous page-based table scan
+  def pagesAsync(self, relId, prefetch=8):
     (_, rFile) = self.relationFile(relId)
     if rFile:
-      return rFile.pages()
+      return rFile.pagesAsync(prefetch=prefetch)
 
 
   # File manager serialization
@@ -304,15 +927,23 @@ class FileManager:
       pfileClass     = pickle.dumps(self.fileClass).decode(encoding=FileManager.checkpointEncoding)
       prelationFiles = list(map(lambda entry: (entry[0], entry[1].fileIndex), self.relationFiles.items()))
       pfileMap       = list(map(lambda entry: (entry[0].fileIndex, entry[1].path), self.fileMap.items()))
-      return json.dumps((self.dataDir, self.indexDir, pfileClass, self.fileCounter, prelationFiles, pfileMap))
+      pbloomFilters  = [(relId, [(keySchema.packSchema().decode(), falsePositiveRate) \
+                                   for (keySchema, falsePositiveRate, _) in filters.values()]) \
+                          for (relId, filters) in self.bloomFilters.items()]
+      return json.dumps((self.dataDir, self.indexDir, pfileClass, self.fileCounter, prelationFiles, pfileMap, \
+                         sorted(self.clustered), pbloomFilters, sorted(self.zoneMapped)))
 
+  # Runtime options not stored in the checkpoint (e.g., 'directIO') may be passed as keyword arguments.
   @classmethod
-  def unpack(cls, bufferPool, strBuffer):
+  def unpack(cls, bufferPool, strBuffer, **kwargs):
     args = json.loads(strBuffer)
-    if len(args) == 6:
+    if len(args) in [6, 7, 8, 9]:
       unfileClass = pickle.loads(args[2].encode(encoding=FileManager.checkpointEncoding))
       return cls(bufferPool=bufferPool, dataDir=args[0], indexDir=args[1], \
-                 fileClass=unfileClass, fileCounter=args[3], restore=(args[4], args[5]))
+                 fileClass=unfileClass, fileCounter=args[3], restore=(args[4], args[5]), \
+                 clustered=args[6] if len(args) > 6 else [], \
+                 bloomFilters=args[7] if len(args) > 7 else [], \
+                 zoneMapped=args[8] if len(args) > 8 else [], **kwargs)
 
 
 if __name__ == "__main__":
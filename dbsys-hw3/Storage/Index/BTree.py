@@ -0,0 +1,754 @@
+import bisect, math, struct
+
+from Catalog.Identifiers import PageId, TupleId
+from Catalog.Schema      import DBSchema, Types
+from Storage.Page        import PageHeader, Page
+
+# Errors for missing and duplicate keys in our native indexes. When BerkeleyDB is
+# installed, these also derive from its errors, so that callers handle all index
+# types alike. Native indexes do not otherwise depend on BerkeleyDB.
+try:
+  from bsddb3 import db
+  notFoundBases = (db.DBNotFoundError, ValueError)
+  keyExistBases = (db.DBKeyExistError, ValueError)
+
+except ImportError:
+  notFoundBases = (ValueError,)
+  keyExistBases = (ValueError,)
+
+class KeyNotFoundError(*notFoundBases):
+  pass
+
+class KeyExistError(*keyExistBases):
+  pass
+
+class BTreePageHeader(PageHeader):
+  """
+  A B+-tree node header, extending the page header with the node type and,
+  for leaf nodes, the page index of the next leaf in key order.
+
+  Node entries are fixed-size tuples kept in sorted order in the page's data area.
+  Leaf entries are a key followed by a value, while internal entries are a separator
+  (the key and value of the first entry in the child) followed by the child's page index.
+
+  The binary representation of this header's additional fields is: (leaf, nextPage)
+
+  >>> import io
+  >>> buffer = io.BytesIO(bytes(4096))
+  >>> ph     = BTreePageHeader(buffer=buffer.getbuffer(), tupleSize=12)
+  >>> ph2    = BTreePageHeader.unpack(buffer.getbuffer())
+  >>> ph == ph2
+  True
+
+  >>> (ph2.leaf, ph2.nextPage == BTreePageHeader.noPage)
+  (True, True)
+
+  >>> ph.freeSpaceOffset == ph.headerSize() == PageHeader.size + BTreePageHeader.prefixRepr.size
+  True
+  """
+
+  prefixRepr = struct.Struct("BI")
+  noPage     = 0xFFFFFFFF
+
+  def __init__(self, **kwargs):
+    other = kwargs.get("other", None)
+    if other:
+      self.fromOther(other)
+
+    else:
+      self.leaf     = kwargs.get("leaf", True)
+      self.nextPage = kwargs.get("nextPage", BTreePageHeader.noPage)
+      super().__init__(**kwargs)
+
+  def __eq__(self, other):
+    return super().__eq__(other) and (
+            self.leaf == other.leaf
+            and self.nextPage == other.nextPage )
+
+  def postHeaderInitialize(self, **kwargs):
+    super().postHeaderInitialize(**kwargs)
+
+    # Push the node fields into the buffer for a fresh header.
+    fresh  = kwargs.get("flags", None) is None
+    buffer = kwargs.get("buffer", None)
+    if fresh and buffer:
+      buffer[PageHeader.size:self.headerSize()] = self.packPrefix()
+
+  def fromOther(self, other):
+    super().fromOther(other)
+    if isinstance(other, BTreePageHeader):
+      self.leaf     = other.leaf
+      self.nextPage = other.nextPage
+
+  def headerSize(self):
+    return PageHeader.size + BTreePageHeader.prefixRepr.size
+
+  def packPrefix(self):
+    return BTreePageHeader.prefixRepr.pack(int(self.leaf), self.nextPage)
+
+  def pack(self):
+    return super().pack() + self.packPrefix()
+
+  @classmethod
+  def unpack(cls, buffer):
+    values = PageHeader.binrepr.unpack_from(buffer)
+    (leaf, nextPage) = BTreePageHeader.prefixRepr.unpack_from(buffer, offset=PageHeader.size)
+    if len(values) == 4:
+      return cls(buffer=buffer, flags=values[0], tupleSize=values[1],
+                 freeSpaceOffset=values[2], pageCapacity=values[3],
+                 leaf=bool(leaf), nextPage=nextPage)
+
+
+class BTreePage(Page):
+  """
+  A B+-tree node, storing its entries in sorted order in a contiguous page.
+
+  Entries are inserted and removed by position, shifting any subsequent
+  entries within the page's buffer.
+
+  >>> from Catalog.Identifiers import FileId
+  >>> schema = DBSchema('entry', [('key', 'char(4)'), ('value', 'char(8)')])
+  >>> p = BTreePage(pageId=PageId(FileId(1), 0), buffer=bytes(4096), schema=schema)
+  >>> for e in [b'ccccCCCCCCCC', b'aaaaAAAAAAAA', b'bbbbBBBBBBBB']:
+  ...   p.insertEntry(bisect.bisect_left(p.entryKeys(12), e), e)
+
+  >>> [e[:4] for e in p.entries()]
+  [b'aaaa', b'bbbb', b'cccc']
+
+  >>> p.deleteEntry(1)
+  >>> [e[:4] for e in p.entries()]
+  [b'aaaa', b'cccc']
+
+  >>> p2 = BTreePage.unpack(p.pageId, p.pack())
+  >>> (p2.entries() == p.entries(), p2.header.leaf)
+  (True, True)
+  """
+
+  headerClass = BTreePageHeader
+
+  # Header constructor override for B+-tree nodes.
+  def initializeHeader(self, **kwargs):
+    schema = kwargs.get("schema", None)
+    if schema:
+      return BTreePageHeader(buffer=self.getbuffer(), tupleSize=schema.size)
+    else:
+      raise ValueError("No schema provided when constructing a B+-tree page.")
+
+  # Entry accessors.
+  def numEntries(self):
+    return self.header.numTuples()
+
+  def entryOffset(self, position):
+    return self.header.dataOffset() + position * self.header.tupleSize
+
+  def entry(self, position):
+    start = self.entryOffset(position)
+    return bytes(self.getbuffer()[start:start+self.header.tupleSize])
+
+  def entries(self):
+    return [self.entry(i) for i in range(self.numEntries())]
+
+  # Returns a sequence over the first 'prefixSize' bytes of each entry, for use with bisect.
+  def entryKeys(self, prefixSize):
+    return BTreePageKeys(self, prefixSize)
+
+  # Inserts an entry at the given position, shifting subsequent entries.
+  def insertEntry(self, position, entryData):
+    if self.header.hasFreeTuple() and len(entryData) == self.header.tupleSize:
+      size  = self.header.tupleSize
+      start = self.entryOffset(position)
+      end   = self.header.freeSpaceOffset
+      self.getbuffer()[start+size:end+size] = self.getbuffer()[start:end]
+      self.getbuffer()[start:start+size]    = entryData
+      self.header.freeSpaceOffset += size
+      self.setDirty(True)
+    else:
+      raise ValueError("Invalid B+-tree entry insertion")
+
+  # Removes the entry at the given position, shifting subsequent entries.
+  def deleteEntry(self, position):
+    size  = self.header.tupleSize
+    start = self.entryOffset(position)
+    end   = self.header.freeSpaceOffset
+    self.getbuffer()[start:end-size] = self.getbuffer()[start+size:end]
+    self.getbuffer()[end-size:end]   = b'\x00' * size
+    self.header.freeSpaceOffset -= size
+    self.setDirty(True)
+
+  # Replaces the contents of the node with the given entries.
+  def setEntries(self, entries, leaf, tupleSize, nextPage=BTreePageHeader.noPage):
+    self.header.leaf            = leaf
+    self.header.nextPage        = nextPage
+    self.header.tupleSize       = tupleSize
+    self.header.freeSpaceOffset = self.header.dataOffset()
+    data = b''.join(entries)
+    if len(data) > self.header.freeSpace():
+      raise ValueError("Too many entries for a B+-tree page")
+
+    start = self.header.dataOffset()
+    self.getbuffer()[start:start+len(data)] = data
+    self.getbuffer()[start+len(data):]      = bytes(self.header.pageCapacity - start - len(data))
+    self.header.freeSpaceOffset += len(data)
+    self.setDirty(True)
+
+
+class BTreePageKeys:
+  """
+  A lazy sequence over entry prefixes in a B+-tree page, for binary search with bisect.
+  """
+  def __init__(self, page, prefixSize):
+    self.page       = page
+    self.prefixSize = prefixSize
+
+  def __len__(self):
+    return self.page.numEntries()
+
+  def __getitem__(self, position):
+    start = self.page.entryOffset(position)
+    return bytes(self.page.getbuffer()[start:start+self.prefixSize])
+
+
+class BTree:
+  """
+  A B+-tree index stored in the pages of a storage file, and cached by the buffer pool.
+
+  The B+-tree maps fixed-size binary keys to tuple identifiers, and provides the subset
+  of the BerkeleyDB database and cursor interface used by our index manager. Thus a
+  B+-tree may be used wherever the index manager expects a BDB database object.
+
+  Entries are ordered by their key and value bytes (as with BDB's default comparison).
+  Non-unique trees support duplicate keys by keeping all entries for a key in value order.
+  Unique trees hold at most one value per key, where a put either replaces an existing
+  value, or raises an error when the 'noOverwrite' flag is given.
+
+  The root node always resides at page 0 of the storage file, with a root split
+  moving the root's contents into two new children. The tree counts its updates,
+  so that cursors reposition themselves when their leaf may have changed. Deletions remove entries
+  from leaves without merging nodes, and empty leaves are skipped during scans.
+  Bulk loading builds a tree bottom-up from a sorted sequence of entries.
+
+  >>> import random, shutil, Storage.BufferPool, Storage.FileManager
+  >>> from Catalog.Identifiers import FileId
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, dataDir='btree/')
+  >>> bp.setFileManager(fm)
+
+  >>> keySchema = DBSchema('employeeKey', [('id', 'int')])
+  >>> key       = lambda i: keySchema.pack(keySchema.instantiate(i))
+  >>> value     = lambda i: TupleId(PageId(FileId(0), i // 100), i % 100).pack()
+
+  # Create a non-unique tree, and insert enough entries to cause multiple splits.
+  >>> (fId, f) = fm.createIndexFile('test_btree', BTree.entrySchema(keySchema), BTreePage)
+  >>> tree = BTree(storageFile=f, name='test_btree')
+  >>> ids  = list(range(5000))
+  >>> random.shuffle(ids)
+  >>> for i in ids:
+  ...   tree.put(key(i % 1000), value(i))
+
+  >>> tree.height() > 1 and f.numPages() > 1
+  True
+
+  # Scans return entries in key order, and duplicates in value order.
+  >>> items = tree.items()
+  >>> len(items) == 5000 and items == sorted(items)
+  True
+
+  >>> tree.get(key(7)) == value(7)
+  True
+
+  # Cursor operations.
+  >>> crsr = tree.cursor()
+  >>> crsr.set(key(42)) == (key(42), value(42))
+  True
+
+  >>> [crsr.next() == (key(42), value(i)) for i in [1042, 2042]]
+  [True, True]
+
+  >>> crsr.get_both(key(42), value(3042)) == (key(42), value(3042))
+  True
+
+  >>> crsr.delete()
+  >>> crsr.next() == (key(42), value(4042))
+  True
+
+  >>> len(list(tree.lookup(key(42))))
+  4
+
+  >>> crsr.set(key(5000)) is None
+  True
+
+  >>> crsr.last() == tree.items()[-1]
+  True
+
+  # Delete all entries for a key.
+  >>> tree.delete(key(43))
+  >>> (tree.get(key(43)), len(tree.items()))
+  (None, 4994)
+
+  # A unique tree rejects duplicates when requested, and otherwise replaces values.
+  >>> (uId, uf) = fm.createIndexFile('unique_btree', BTree.entrySchema(keySchema), BTreePage)
+  >>> utree = BTree(storageFile=uf, name='unique_btree', unique=True)
+  >>> for i in ids:
+  ...   utree.put(key(i), value(i), flags=BTree.noOverwrite)
+
+  >>> utree.put(key(1), value(2), flags=BTree.noOverwrite)
+  Traceback (most recent call last):
+  ...
+  KeyExistError: Duplicate key in a unique B+-tree
+
+  >>> utree.delete(key(-1))
+  Traceback (most recent call last):
+  ...
+  KeyNotFoundError: Key not found in B+-tree
+
+  >>> utree.put(key(1), value(2))
+  >>> utree.get(key(1)) == value(2)
+  True
+
+  # Bulk load a tree from sorted entries, and compare against incremental insertion.
+  >>> (bId, bf) = fm.createIndexFile('bulk_btree', BTree.entrySchema(keySchema), BTreePage)
+  >>> btree = BTree(storageFile=bf, name='bulk_btree')
+  >>> items = tree.items()
+  >>> btree.bulkLoad(iter(items))
+  >>> btree.items() == items
+  True
+
+  >>> btree.get(key(999)) == tree.get(key(999))
+  True
+
+  >>> btree.put(key(43), value(43))
+  >>> len(btree.items())
+  4995
+
+  # Cursors are repositioned on their entry when later updates shift or split its leaf.
+  >>> crsr = btree.cursor()
+  >>> crsr.set(key(500)) == (key(500), value(500))
+  True
+
+  >>> for i in range(5000, 5400):
+  ...   btree.put(key(499), value(i))
+  >>> crsr.next() == (key(500), value(1500))
+  True
+
+  >>> crsr.delete()
+  >>> btree.delete(key(499))
+  >>> crsr.next() == (key(500), value(2500))
+  True
+
+  # Test reopening a tree from its storage file.
+  >>> bp.clear()
+  >>> BTree(storageFile=bf, name='bulk_btree').items() == btree.items()
+  True
+
+  >>> fm.close()
+  >>> shutil.rmtree('btree/')
+  """
+
+  noOverwrite       = 0x1
+  defaultFillFactor = 0.9
+
+  def __init__(self, **kwargs):
+    other = kwargs.get("other", None)
+    if other:
+      self.fromOther(other)
+
+    else:
+      self.storageFile = kwargs.get("storageFile", None)
+      self.name        = kwargs.get("name", None)
+      self.unique      = kwargs.get("unique", False)
+      self.fillFactor  = kwargs.get("fillFactor", BTree.defaultFillFactor)
+
+      if self.storageFile is None:
+        raise ValueError("No storage file given for a B+-tree")
+
+      self.bufferPool = self.storageFile.bufferPool
+      entrySchema     = self.storageFile.schema()
+      self.valueSize  = struct.calcsize(Types.formatType(entrySchema.types[1]))
+      self.entrySize  = entrySchema.size
+      self.keySize    = self.entrySize - self.valueSize
+      self.childRepr  = struct.Struct("I")
+      self.version    = 0
+
+      # Initialize an empty root leaf.
+      if self.storageFile.numPages() == 0:
+        self.storageFile.allocatePage()
+
+  def fromOther(self, other):
+    self.storageFile = other.storageFile
+    self.name        = other.name
+    self.unique      = other.unique
+    self.fillFactor  = other.fillFactor
+    self.bufferPool  = other.bufferPool
+    self.valueSize   = other.valueSize
+    self.entrySize   = other.entrySize
+    self.keySize     = other.keySize
+    self.childRepr   = other.childRepr
+    self.version     = other.version
+
+  # Returns the schema of the storage file entries for a B+-tree on the given key.
+  # Values default to tuple ids, and may be larger to hold additional attributes.
+  # Keys default to the size of the key schema, and may differ for encoded keys.
+  @classmethod
+  def entrySchema(cls, keySchema, valueSize=TupleId.size, keySize=None):
+    keySize = keySize if keySize is not None else keySchema.size
+    return DBSchema(keySchema.name+"Entry", [('key', 'char('+str(keySize)+')'),
+                                              ('value', 'char('+str(valueSize)+')')])
+
+  # BDB-compatible database methods.
+  def get_dbname(self):
+    return (self.name, None)
+
+  def fileId(self):
+    return self.storageFile.fileId
+
+  def close(self):
+    pass
+
+  def sync(self):
+    self.storageFile.flush()
+
+  def cursor(self, txn=None, flags=0):
+    return BTreeCursor(self)
+
+  # Returns the first value for the given key, or the default if the key is not present.
+  def get(self, key, default=None, txn=None):
+    found = self.cursor().set(key)
+    return found[1] if found else default
+
+  # Returns an iterator over the values for the given key.
+  def lookup(self, key):
+    crsr  = self.cursor()
+    found = crsr.set(key)
+    while found and found[0] == key:
+      yield found[1]
+      found = crsr.next()
+
+  # Returns an iterator over (key, value) pairs with keys in the given inclusive range.
+  # A missing bound leaves that end of the range open.
+  def scan(self, lowKey=None, highKey=None):
+    crsr  = self.cursor()
+    found = crsr.set_range(lowKey) if lowKey is not None else crsr.first()
+    while found and (highKey is None or found[0] <= highKey):
+      yield found
+      found = crsr.next()
+
+  def items(self, txn=None):
+    return list(self.scan())
+
+  def keys(self, txn=None):
+    return [k for (k, _) in self.scan()]
+
+  def put(self, key, value, txn=None, flags=0):
+    key   = bytes(key)
+    value = bytes(value)
+    if len(key) != self.keySize or len(value) != self.valueSize:
+      raise ValueError("Invalid B+-tree key or value size")
+
+    if self.unique:
+      crsr = self.cursor()
+      if crsr.set(key):
+        if flags & BTree.noOverwrite:
+          raise KeyExistError("Duplicate key in a unique B+-tree")
+        crsr.delete()
+
+    self.insertEntry(key + value)
+
+  # Removes all entries for the given key.
+  def delete(self, key, txn=None):
+    crsr  = self.cursor()
+    found = crsr.set(key)
+    if not found:
+      raise KeyNotFoundError("Key not found in B+-tree")
+
+    while found and found[0] == key:
+      crsr.delete()
+      found = crsr.next()
+
+
+  # Tree structure helpers.
+
+  def getPage(self, pageIndex, pinned=False):
+    return self.bufferPool.getPage(self.storageFile.pageId(pageIndex), pinned)
+
+  def unpinPage(self, pageIndex):
+    self.bufferPool.unpinPage(self.storageFile.pageId(pageIndex))
+
+  def allocatePage(self):
+    return self.storageFile.allocatePage().pageId.pageIndex
+
+  def internalEntrySize(self):
+    return self.entrySize + self.childRepr.size
+
+  def childPageIndex(self, entryData):
+    return self.childRepr.unpack_from(entryData, offset=self.entrySize)[0]
+
+  # Returns the position of the child to follow in an internal node for the given entry.
+  # The separator of the first child is ignored, thus it covers all entries below the second child.
+  def childPosition(self, page, entryData):
+    return max(0, bisect.bisect_right(page.entryKeys(self.entrySize), entryData, lo=1) - 1)
+
+  # Returns the path of internal page indexes from the root, and the leaf page index
+  # where the given entry belongs.
+  def descend(self, entryData):
+    path      = []
+    pageIndex = 0
+    page      = self.getPage(pageIndex)
+    while not page.header.leaf:
+      path.append(pageIndex)
+      pageIndex = self.childPageIndex(page.entry(self.childPosition(page, entryData)))
+      page      = self.getPage(pageIndex)
+    return (path, pageIndex, page)
+
+  # Returns the leaf page index and position of the first entry not less than the given entry data.
+  def search(self, entryData):
+    (_, pageIndex, page) = self.descend(entryData)
+    return (pageIndex, bisect.bisect_left(page.entryKeys(self.entrySize), entryData))
+
+  # Returns the page index and page of the rightmost leaf.
+  def lastLeaf(self):
+    pageIndex = 0
+    page      = self.getPage(pageIndex)
+    while not page.header.leaf:
+      pageIndex = self.childPageIndex(page.entry(page.numEntries() - 1))
+      page      = self.getPage(pageIndex)
+    return (pageIndex, page)
+
+  def height(self):
+    (path, _, _) = self.descend(b'')
+    return len(path) + 1
+
+  # Adds an entry to the tree, skipping exact duplicates of an existing entry.
+  def insertEntry(self, entryData):
+    (path, pageIndex, page) = self.descend(entryData)
+    position = bisect.bisect_left(page.entryKeys(self.entrySize), entryData)
+    if position < page.numEntries() and page.entry(position) == entryData:
+      return
+    self.insertIntoNode(path, pageIndex, position, entryData)
+    self.version += 1
+
+  # Inserts an entry into a node, splitting the node and propagating the split upwards if full.
+  def insertIntoNode(self, path, pageIndex, position, entryData):
+    page = self.getPage(pageIndex, pinned=True)
+    if page.header.hasFreeTuple():
+      page.insertEntry(position, entryData)
+      self.unpinPage(pageIndex)
+      return
+
+    leaf      = page.header.leaf
+    tupleSize = page.header.tupleSize
+    entries   = page.entries()
+    entries.insert(position, entryData)
+    middle    = len(entries) // 2
+
+    if pageIndex == 0:
+      # Split the root by moving its entries into two new children.
+      leftIndex  = self.allocatePage()
+      rightIndex = self.allocatePage()
+      left       = self.getPage(leftIndex, pinned=True)
+      right      = self.getPage(rightIndex, pinned=True)
+      left.setEntries(entries[:middle], leaf, tupleSize, rightIndex if leaf else BTreePageHeader.noPage)
+      right.setEntries(entries[middle:], leaf, tupleSize)
+
+      rootEntries = [entries[0][:self.entrySize] + self.childRepr.pack(leftIndex),
+                     entries[middle][:self.entrySize] + self.childRepr.pack(rightIndex)]
+      page.setEntries(rootEntries, False, self.internalEntrySize())
+
+      self.unpinPage(leftIndex)
+      self.unpinPage(rightIndex)
+      self.unpinPage(pageIndex)
+
+    else:
+      rightIndex = self.allocatePage()
+      right      = self.getPage(rightIndex, pinned=True)
+      right.setEntries(entries[middle:], leaf, tupleSize, page.header.nextPage if leaf else BTreePageHeader.noPage)
+      page.setEntries(entries[:middle], leaf, tupleSize, rightIndex if leaf else BTreePageHeader.noPage)
+      self.unpinPage(rightIndex)
+      self.unpinPage(pageIndex)
+
+      # Add a separator for the new node to the parent.
+      separator   = entries[middle][:self.entrySize]
+      parentIndex = path.pop()
+      parent      = self.getPage(parentIndex)
+      parentPos   = bisect.bisect_right(parent.entryKeys(self.entrySize), separator, lo=1)
+      self.insertIntoNode(path, parentIndex, parentPos, separator + self.childRepr.pack(rightIndex))
+
+
+  # Bulk loading.
+
+  # Builds the tree bottom-up from an iterable of (key, value) pairs sorted by key and value.
+  # The tree must be empty. Nodes are filled to the tree's fill factor, and written directly
+  # to the storage file rather than through the buffer pool.
+  def bulkLoad(self, entries):
+    if self.cursor().first() is not None:
+      raise ValueError("Bulk loading requires an empty B+-tree")
+
+    self.bufferPool.flushFilePages(self.storageFile.fileId)
+    self.version += 1
+
+    leafCapacity     = self.nodeCapacity(self.entrySize, True)
+    internalCapacity = self.nodeCapacity(self.internalEntrySize())
+    groupCapacity    = self.nodeCapacity(self.internalEntrySize(), True)
+
+    # Write leaves in page order starting from page 1, delaying each leaf until its successor
+    # is known. If all entries fit in a single leaf, it becomes the root.
+    children  = []
+    pending   = None
+    nodeIndex = 1
+    lastEntry = None
+
+    for (key, value) in entries:
+      entryData = bytes(key) + bytes(value)
+      if lastEntry is not None and (entryData < lastEntry or (self.unique and entryData[:self.keySize] == lastEntry[:self.keySize])):
+        raise ValueError("Unsorted or duplicate entries while bulk loading a B+-tree")
+      lastEntry = entryData
+
+      if pending is None or len(pending) == leafCapacity:
+        if pending is not None:
+          self.writeNode(nodeIndex, pending, True, self.entrySize, nodeIndex + 1)
+          children.append((pending[0], nodeIndex))
+          nodeIndex += 1
+        pending = []
+
+      pending.append(entryData)
+
+    if not children:
+      self.writeNode(0, pending or [], True, self.entrySize)
+      return
+
+    self.writeNode(nodeIndex, pending, True, self.entrySize)
+    children.append((pending[0], nodeIndex))
+    nodeIndex += 1
+
+    # Build internal levels until the remaining children fit in the root.
+    while len(children) > internalCapacity:
+      parents = []
+      for i in range(0, len(children), groupCapacity):
+        group = children[i:i+groupCapacity]
+        self.writeNode(nodeIndex, [self.internalEntry(c) for c in group], False, self.internalEntrySize())
+        parents.append((group[0][0], nodeIndex))
+        nodeIndex += 1
+      children = parents
+
+    self.writeNode(0, [self.internalEntry(c) for c in children], False, self.internalEntrySize())
+
+  # Returns the number of entries of the given size per node, optionally scaled by the fill factor.
+  def nodeCapacity(self, entrySize, filled=False):
+    headerSize = PageHeader.size + BTreePageHeader.prefixRepr.size
+    capacity   = math.floor((self.storageFile.pageSize() - headerSize) / entrySize)
+    return max(2, math.floor(capacity * self.fillFactor)) if filled else capacity
+
+  def internalEntry(self, child):
+    (firstEntry, pageIndex) = child
+    return firstEntry[:self.entrySize] + self.childRepr.pack(pageIndex)
+
+  def writeNode(self, pageIndex, entries, leaf, tupleSize, nextPage=BTreePageHeader.noPage):
+    page = self.storageFile.emptyPage(pageIndex)
+    page.setEntries(entries, leaf, tupleSize, nextPage)
+    self.storageFile.writePage(page)
+
+
+class BTreeCursor:
+  """
+  A cursor over a B+-tree, positioned on a leaf entry.
+
+  Cursor methods return (key, value) pairs, or None when no matching entry exists.
+  Following a delete, the cursor's next entry is the one after the deleted entry.
+
+  A cursor remembers its entry and the tree's version when it was positioned. If the
+  tree has been updated since, the cursor seeks back to its entry before moving on,
+  as the entry may have shifted within its leaf or moved to a new leaf in a split.
+  """
+  def __init__(self, tree):
+    self.tree      = tree
+    self.pageIndex = None
+    self.position  = None
+    self.deleted   = False
+    self.entryData = None
+    self.version   = None
+
+  def close(self):
+    self.pageIndex = None
+
+  # Moves to the first valid entry at or after the current position, following leaf links.
+  def settle(self):
+    self.deleted = False
+    while self.pageIndex is not None:
+      page = self.tree.getPage(self.pageIndex)
+      if self.position < page.numEntries():
+        self.entryData = page.entry(self.position)
+        self.version   = self.tree.version
+        return (self.entryData[:self.tree.keySize], self.entryData[self.tree.keySize:])
+
+      nextPage = page.header.nextPage
+      self.pageIndex = None if nextPage == BTreePageHeader.noPage else nextPage
+      self.position  = 0
+
+  def seek(self, entryData):
+    (self.pageIndex, self.position) = self.tree.search(entryData)
+    return self.settle()
+
+  # Seeks back to the cursor's entry if the tree was updated since the cursor was
+  # positioned. If the entry no longer exists, the cursor is left on its successor,
+  # as if the entry had been deleted through this cursor.
+  def revalidate(self):
+    if self.pageIndex is not None and self.version != self.tree.version:
+      (entryData, deleted) = (self.entryData, self.deleted)
+      found = self.seek(entryData)
+      self.deleted = deleted or found is None or found[0] + found[1] != entryData
+
+  def first(self):
+    return self.seek(b'')
+
+  # Returns the last entry in the rightmost leaf, or None if that leaf is empty
+  # (which may occur following deletions, as leaves are not merged).
+  def last(self):
+    (self.pageIndex, page) = self.tree.lastLeaf()
+    self.position = page.numEntries() - 1
+    if self.position >= 0:
+      return self.settle()
+    self.pageIndex = None
+
+  def set(self, key):
+    key   = bytes(key)
+    found = self.seek(key + bytes(self.tree.valueSize))
+    if found and found[0] == key:
+      return found
+    self.pageIndex = None
+
+  def set_range(self, key):
+    return self.seek(bytes(key) + bytes(self.tree.valueSize))
+
+  def get_both(self, key, value):
+    entryData = bytes(key) + bytes(value)
+    found     = self.seek(entryData)
+    if found and found[0] + found[1] == entryData:
+      return found
+    self.pageIndex = None
+
+  def next(self):
+    self.revalidate()
+    if self.pageIndex is not None:
+      if not self.deleted:
+        self.position += 1
+      return self.settle()
+
+  # Removes the entry at the cursor.
+  def delete(self):
+    self.revalidate()
+    if self.pageIndex is not None and not self.deleted:
+      self.tree.getPage(self.pageIndex).deleteEntry(self.position)
+      self.tree.version += 1
+      self.version       = self.tree.version
+      self.deleted       = True
+    else:
+      raise ValueError("Invalid B+-tree cursor position for delete")
+
+  # Adds an entry to the tree, positioning the cursor on the new entry.
+  def put(self, key, value, flags=0):
+    self.tree.put(key, value, flags=flags)
+    self.get_both(key, value)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
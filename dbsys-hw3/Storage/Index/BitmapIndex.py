@@ -0,0 +1,338 @@
+import bisect, os, pickle, zlib
+
+from Catalog.Identifiers import FileId, PageId, TupleId
+from Storage.Index.BTree import KeyNotFoundError
+
+class BitmapIndex:
+  """
+  A bitmap index, for attributes with few distinct values.
+
+  The index holds a bitmap of tuple ids for each key. Bitmaps are compressed by page:
+  each bitmap is a dictionary from the index of a page holding matching tuples to an
+  integer whose set bits are the slots of those tuples, thus pages without matching
+  tuples take no space. Bitmaps are combined with bitwise AND and OR operations
+  on the pages they share, and yield tuple ids in page and slot order.
+
+  As with B+-trees, the index provides the subset of the BerkeleyDB database and cursor
+  interface used by our index manager. Values must be tuple ids, and duplicate keys are
+  kept in tuple id order. Bitmaps are held in memory, and written to a zlib-compressed
+  file on sync or close.
+
+  >>> import os, tempfile
+  >>> from Catalog.Schema import DBSchema
+  >>> keySchema = DBSchema('flagKey', [('flag', 'char(1)')])
+  >>> key       = lambda f: keySchema.pack(keySchema.instantiate(f))
+  >>> value     = lambda i: TupleId(PageId(FileId(3), i // 100), i % 100).pack()
+
+  >>> path = os.path.join(tempfile.mkdtemp(), 'flags.bitmap')
+  >>> idx  = BitmapIndex(path=path, name='flags')
+  >>> for i in range(1000):
+  ...   idx.put(key('ANR'[i % 3]), value(i))
+
+  >>> [BitmapIndex.count(idx.bitmap(key(f))) for f in 'ANRX']
+  [334, 333, 333, 0]
+
+  # Bitwise operations over bitmaps, producing sorted tuple ids.
+  >>> odd = BitmapIndex.union([idx.bitmap(key('A')), idx.bitmap(key('R'))])
+  >>> [(t.pageId.pageIndex, t.tupleIndex) for t in BitmapIndex.tupleIds(FileId(3), odd)][:4]
+  [(0, 0), (0, 2), (0, 3), (0, 5)]
+
+  >>> BitmapIndex.count(BitmapIndex.intersect([odd, idx.bitmap(key('N'))]))
+  0
+
+  # Cursor operations.
+  >>> crsr = idx.cursor()
+  >>> crsr.set(key('N')) == (key('N'), value(1))
+  True
+
+  >>> crsr.next() == (key('N'), value(4))
+  True
+
+  >>> crsr.get_both(key('N'), value(997)) == (key('N'), value(997))
+  True
+
+  >>> crsr.delete()
+  >>> (crsr.next_dup(), crsr.next() == (key('R'), value(2)))
+  (None, True)
+
+  >>> crsr.set(key('X')) is None
+  True
+
+  >>> len(idx.items())
+  999
+
+  # Test reopening an index from its file.
+  >>> idx.close()
+  >>> idx2 = BitmapIndex(path=path, name='flags')
+  >>> idx2.items() == idx.items()
+  True
+
+  >>> idx2.remove()
+  >>> os.path.exists(path)
+  False
+  """
+
+  def __init__(self, **kwargs):
+    other = kwargs.get("other", None)
+    if other:
+      self.fromOther(other)
+
+    else:
+      self.path       = kwargs.get("path", None)
+      self.name       = kwargs.get("name", None)
+      self.fileIndex  = None    # The file id of the tuples in the index
+      self.bitmaps    = {}      # key -> { page index -> slot bits }
+      self.keyVersion = 0       # Incremented whenever a key is added or removed
+
+      if self.path is None:
+        raise ValueError("No file path given for a bitmap index")
+
+      if os.path.exists(self.path):
+        self.load()
+
+  def fromOther(self, other):
+    self.path       = other.path
+    self.name       = other.name
+    self.fileIndex  = other.fileIndex
+    self.bitmaps    = other.bitmaps
+    self.keyVersion = other.keyVersion
+
+  # BDB-compatible database methods.
+  def get_dbname(self):
+    return (self.name, None)
+
+  def close(self):
+    self.save()
+
+  def sync(self):
+    self.save()
+
+  def cursor(self, txn=None, flags=0):
+    return BitmapCursor(self)
+
+  # Returns the first value for the given key, or the default if the key is not present.
+  def get(self, key, default=None, txn=None):
+    found = self.cursor().set(key)
+    return found[1] if found else default
+
+  def items(self, txn=None):
+    fileId = FileId(self.fileIndex) if self.fileIndex is not None else None
+    return [(key, tupleId.pack()) for key in sorted(self.bitmaps) \
+                                  for tupleId in BitmapIndex.tupleIds(fileId, self.bitmaps[key])]
+
+  def keys(self, txn=None):
+    return [k for (k, _) in self.items()]
+
+  def put(self, key, value, txn=None, flags=0):
+    if len(value) != TupleId.size:
+      raise ValueError("Invalid bitmap index value, expected a tuple id")
+
+    tupleId = TupleId.unpack(value)
+    self.fileIndex = tupleId.pageId.fileId.fileIndex
+
+    key = bytes(key)
+    if key not in self.bitmaps:
+      self.bitmaps[key] = {}
+      self.keyVersion  += 1
+
+    bitmap    = self.bitmaps[key]
+    pageIndex = tupleId.pageId.pageIndex
+    bitmap[pageIndex] = bitmap.get(pageIndex, 0) | (1 << tupleId.tupleIndex)
+
+  # Removes all entries for the given key.
+  def delete(self, key, txn=None):
+    if self.bitmaps.pop(bytes(key), None) is None:
+      raise KeyNotFoundError("Key not found in bitmap index")
+    self.keyVersion += 1
+
+  # Removes a single entry, dropping empty pages and keys.
+  def clear(self, key, pageIndex, slot):
+    bitmap = self.bitmaps.get(key, None)
+    if bitmap and pageIndex in bitmap:
+      bitmap[pageIndex] &= ~(1 << slot)
+      if not bitmap[pageIndex]:
+        del bitmap[pageIndex]
+      if not bitmap:
+        del self.bitmaps[key]
+        self.keyVersion += 1
+
+  # Removes the index file.
+  def remove(self):
+    self.bitmaps = {}
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+
+  # Bitmap operations.
+
+  # Returns the bitmap of the given key, which is empty for a missing key.
+  def bitmap(self, key):
+    return self.bitmaps.get(bytes(key), {})
+
+  # Returns the pagewise bitwise AND of a list of bitmaps.
+  @staticmethod
+  def intersect(bitmaps):
+    bitmaps = sorted(bitmaps, key=len)
+    if not bitmaps:
+      return {}
+
+    result = dict(bitmaps[0])
+    for bitmap in bitmaps[1:]:
+      result = dict((p, bits & bitmap[p]) for (p, bits) in result.items() if bits & bitmap.get(p, 0))
+    return result
+
+  # Returns the pagewise bitwise OR of a list of bitmaps.
+  @staticmethod
+  def union(bitmaps):
+    result = {}
+    for bitmap in bitmaps:
+      for (p, bits) in bitmap.items():
+        result[p] = result.get(p, 0) | bits
+    return result
+
+  # Returns the number of tuples in a bitmap.
+  @staticmethod
+  def count(bitmap):
+    return sum(bin(bits).count('1') for bits in bitmap.values())
+
+  # Returns an iterator over the tuple ids of a bitmap for the given file, in page and slot order.
+  @staticmethod
+  def tupleIds(fileId, bitmap):
+    for pageIndex in sorted(bitmap):
+      pageId = PageId(fileId, pageIndex)
+      bits   = bitmap[pageIndex]
+      while bits:
+        lowest = bits & -bits
+        yield TupleId(pageId, lowest.bit_length() - 1)
+        bits ^= lowest
+
+
+  # Bitmap index serialization, storing the slot bits of each page as bytes.
+  def save(self):
+    bitmaps = dict((key, [(p, bits.to_bytes((bits.bit_length() + 7) // 8, 'little')) \
+                            for (p, bits) in bitmap.items()]) \
+                     for (key, bitmap) in self.bitmaps.items())
+    with open(self.path, 'wb') as f:
+      f.write(zlib.compress(pickle.dumps((self.fileIndex, bitmaps))))
+
+  def load(self):
+    with open(self.path, 'rb') as f:
+      (self.fileIndex, bitmaps) = pickle.loads(zlib.decompress(f.read()))
+    self.bitmaps = dict((key, dict((p, int.from_bytes(bits, 'little')) for (p, bits) in pages)) \
+                          for (key, pages) in bitmaps.items())
+
+
+class BitmapCursor:
+  """
+  A cursor over a bitmap index, positioned on a key, page and slot.
+
+  Cursor methods return (key, value) pairs, or None when no matching entry exists.
+  Following a delete, the cursor's next entry is the one after the deleted entry.
+  The cursor visits the keys present when it was positioned, and the pages of
+  a key present when it first moved to that key.
+  """
+  def __init__(self, index):
+    self.index      = index
+    self.keys       = None
+    self.keyVersion = None
+    self.pagesKey   = None
+    self.pages      = None
+    self.keyPos     = None
+    self.pageIndex  = None
+    self.slot       = None
+
+  def close(self):
+    self.keyPos = None
+
+  # Refreshes the sorted keys of the index, if keys were added or removed.
+  def sortedKeys(self):
+    if self.keyVersion != self.index.keyVersion:
+      self.keys       = sorted(self.index.bitmaps)
+      self.keyVersion = self.index.keyVersion
+    return self.keys
+
+  # Moves to the first entry at or after the given key position, page and slot.
+  def seek(self, keyPos, pageIndex=0, slot=0):
+    keys = self.keys
+    while keyPos < len(keys):
+      key    = keys[keyPos]
+      bitmap = self.index.bitmaps.get(key, {})
+      if key != self.pagesKey:
+        (self.pagesKey, self.pages) = (key, sorted(bitmap))
+
+      pagePos = bisect.bisect_left(self.pages, pageIndex)
+      while pagePos < len(self.pages):
+        page = self.pages[pagePos]
+        bits = bitmap.get(page, 0)
+        if page == pageIndex:
+          bits = (bits >> slot) << slot
+        if bits:
+          (self.keyPos, self.pageIndex, self.slot) = (keyPos, page, (bits & -bits).bit_length() - 1)
+          return self.entry()
+        pagePos += 1
+
+      (keyPos, pageIndex, slot) = (keyPos + 1, 0, 0)
+
+    self.keyPos = None
+
+  def entry(self):
+    fileId = FileId(self.index.fileIndex)
+    return (self.keys[self.keyPos], TupleId(PageId(fileId, self.pageIndex), self.slot).pack())
+
+  def first(self):
+    self.sortedKeys()
+    return self.seek(0)
+
+  def set(self, key):
+    key   = bytes(key)
+    keys  = self.sortedKeys()
+    found = self.seek(bisect.bisect_left(keys, key))
+    if found and found[0] == key:
+      return found
+    self.keyPos = None
+
+  def set_range(self, key):
+    keys = self.sortedKeys()
+    return self.seek(bisect.bisect_left(keys, bytes(key)))
+
+  def get_both(self, key, value):
+    key     = bytes(key)
+    tupleId = TupleId.unpack(value)
+    bits    = self.index.bitmap(key).get(tupleId.pageId.pageIndex, 0)
+    if bits & (1 << tupleId.tupleIndex):
+      keys = self.sortedKeys()
+      (self.keyPos, self.pageIndex, self.slot) = \
+        (bisect.bisect_left(keys, key), tupleId.pageId.pageIndex, tupleId.tupleIndex)
+      return self.entry()
+    self.keyPos = None
+
+  def next(self):
+    if self.keyPos is not None:
+      return self.seek(self.keyPos, self.pageIndex, self.slot + 1)
+
+  # Returns the next entry with the same key as the current entry.
+  # As with BDB, the cursor keeps its position when there is no such entry.
+  def next_dup(self):
+    if self.keyPos is not None:
+      position = (self.keyPos, self.pageIndex, self.slot)
+      found    = self.next()
+      if found and found[0] == self.keys[position[0]]:
+        return found
+      (self.keyPos, self.pageIndex, self.slot) = position
+
+  # Removes the entry at the cursor.
+  def delete(self):
+    if self.keyPos is not None:
+      self.index.clear(self.keys[self.keyPos], self.pageIndex, self.slot)
+    else:
+      raise ValueError("Invalid bitmap index cursor position for delete")
+
+  # Adds an entry to the index, positioning the cursor on the new entry.
+  def put(self, key, value, flags=0):
+    self.index.put(key, value, flags=flags)
+    self.get_both(key, value)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
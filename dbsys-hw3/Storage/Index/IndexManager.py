@@ -1,8 +1,12 @@
-import json, os, os.path
+import heapq, itertools, json, operator, os, os.path, tempfile
 
 from bsddb3              import db
-from Catalog.Schema      import DBSchema, DBSchemaEncoder, DBSchemaDecoder
+from struct              import Struct
+from Catalog.Schema      import DBSchema, DBSchemaEncoder, DBSchemaDecoder, Types
 from Catalog.Identifiers import FileId, PageId, TupleId
+from Storage.Index.BTree import BTree, BTreePage
+from Storage.Index.BitmapIndex import BitmapIndex
+from Storage.Index.KeyEncoder import KeyEncoder
 
 class IndexManager:
   """
@@ -35,6 +39,41 @@ class IndexManager:
   In a similar fashion to the file manager, the index manager checkpoints its
   internal data structures to disk.
 
+  Indexes may alternatively be native B+-trees (see Storage.Index.BTree), selected
+  with the 'indexType' keyword argument either as a default for the index manager,
+  or for an individual index on creation. B+-tree indexes are stored in storage files
+  registered with the file manager, so that their pages are cached in our buffer pool.
+  These indexes are available once a file manager is attached with setFileManager.
+
+  Index keys are stored with an order-preserving encoding (see Storage.Index.KeyEncoder),
+  so that indexes sort numeric keys by value with a bytewise comparison. The index
+  manager's methods accept and return keys packed with their key schema, converting
+  them to and from their encoded form.
+
+  Point lookups may instead use hash indexes, selected with an 'indexType' of "hash".
+  These are BerkeleyDB hash databases, which do not order their keys. Range scans over
+  hash indexes thus scan the whole index, unless they seek a single full key, and hash
+  primary indexes cannot cluster a relation.
+
+  Attributes with few distinct values may instead use bitmap indexes, selected with an
+  'indexType' of "bitmap" (see Storage.Index.BitmapIndex). These are secondary indexes
+  holding a bitmap of tuple ids per key, which may be combined with bitwise AND and OR
+  operations to evaluate conjunctions and disjunctions of equality predicates.
+
+  An index may also include additional attributes of the relation in its values,
+  stored after the tuple identifier. Such a covering index can answer queries that
+  only reference its key and included attributes without accessing the heap file
+  (see Query.Operators.IndexOnlyScan).
+
+  With the 'transactional' keyword argument, the BerkeleyDB environment logs all index
+  modifications and recovers the indexes to their last committed state when opened.
+  Index modifications then run in a transaction, which the file manager commits as
+  a group along with the heap pages modified alongside the indexes (see FileManager).
+
+  The BerkeleyDB cache size may be set with the 'cacheSize' keyword argument, and
+  changed at runtime up to the 'maxCacheSize' keyword argument. Otherwise, the
+  environment uses BerkeleyDB's default cache size.
+
   >>> im = IndexManager()
 
   ## Test low-level BDB database operations
@@ -160,6 +199,89 @@ class IndexManager:
   >>> [ageSchema.unpack(k).age for (k,_) in im.scanByIndex(indexId2)] # doctest:+ELLIPSIS
   [20, 22, 24, ..., 38]
 
+  # Range scans over the leading key attribute.
+  >>> [keySchema.unpack(k).id for (k,_) in im.rangeByIndex(schema.name, indexId1, 3, 6, True, False)]
+  [3, 4, 5]
+
+  >>> [ageSchema.unpack(k).age for (k,_) in im.rangeByIndex(schema.name, indexId2, low=33)]
+  [34, 36, 38]
+
+  # Keys are ordered by value, including negative and multi-byte integers.
+  >>> others = [(schema.pack(schema.instantiate(i, 30, 0.0)), TupleId(pageId, 200+j)) for (j, i) in enumerate([-5, 300, -70000])]
+  >>> im.insertTuples(schema.name, others)
+  >>> [keySchema.unpack(k).id for (k,_) in im.scanByIndex(indexId1)] # doctest:+ELLIPSIS
+  [-70000, -5, 0, 1, ..., 9, 300]
+
+  >>> [keySchema.unpack(k).id for (k,_) in im.rangeByIndex(schema.name, indexId1, -10, 1000, False, True)] # doctest:+ELLIPSIS
+  [-5, 0, 1, ..., 9, 300]
+
+  # Bounds are converted to the key's type, and ranges whose bounds cannot be encoded
+  # are not seekable, but still answered by filtering the index.
+  >>> [keySchema.unpack(k).id for (k,_) in im.rangeByIndex(schema.name, indexId1, 1.5, 4.5, False, False)]
+  [2, 3, 4]
+
+  >>> (im.seekableRange(schema.name, indexId1, 1e20), [keySchema.unpack(k).id for (k,_) in im.rangeByIndex(schema.name, indexId1, 8, 1e20)])
+  (False, [8, 9, 300])
+
+  >>> im.deleteTuples(schema.name, others)
+
+  # Secondary indexes hold duplicate keys.
+  >>> dupData = schema.pack(schema.instantiate(50, 20, 0))
+  >>> im.insertTuple(schema.name, dupData, TupleId(pageId, 50))
+  >>> [tId.tupleIndex for tId in im.lookupByIndex(indexId2, ageSchema.pack(ageSchema.instantiate(20)))]
+  [0, 50]
+
+  # Batched lookups return the tuple ids of the keys found, in key order.
+  >>> ageKeys = [ageSchema.pack(ageSchema.instantiate(age)) for age in [38, 20, 21, 20, 24]]
+  >>> [(ageSchema.unpack(k).age, [tId.tupleIndex for tId in tIds]) for (k, tIds) in im.lookupMany(indexId2, ageKeys)]
+  [(20, [0, 50]), (24, [2]), (38, [9])]
+
+  # Relocating tuples that swap locations keeps the entries of both, including for duplicate keys.
+  >>> swap = lambda a, b: [(TupleId(pageId, a), TupleId(pageId, b), testTuples[0][0]), (TupleId(pageId, b), TupleId(pageId, a), dupData)]
+  >>> im.relocateTuples(schema.name, swap(0, 50))
+  >>> ([tId.tupleIndex for tId in im.lookupByIndex(indexId2, ageSchema.pack(ageSchema.instantiate(20)))], \
+       [tId.tupleIndex for i in [0, 50] for tId in im.lookupByIndex(indexId1, keySchema.pack(keySchema.instantiate(i)))])
+  ([0, 50], [50, 0])
+
+  >>> im.relocateTuples(schema.name, swap(50, 0))
+  >>> [tId.tupleIndex for i in [0, 50] for tId in im.lookupByIndex(indexId1, keySchema.pack(keySchema.instantiate(i)))]
+  [0, 50]
+
+  >>> im.deleteTuple(schema.name, dupData, TupleId(pageId, 50))
+
+  ## Batched index maintenance tests
+
+  # Keys are extracted directly from packed tuples, in any attribute order.
+  >>> salaryKey = DBSchema('employeeSalaryId', [('salary', 'double'), ('id', 'int')])
+  >>> extract   = im.keyExtractor(schema, salaryKey, KeyEncoder(salaryKey))
+  >>> extract(memoryview(e1Data)) == KeyEncoder(salaryKey).encode([100000.0, 1])
+  True
+
+  >>> im.keyExtractor(schema, salaryKey)(e1Data) == salaryKey.pack(salaryKey.instantiate(100000.0, 1))
+  True
+
+  # Insert a batch of tuples, in descending key order.
+  >>> batch = [(schema.pack(schema.instantiate(i, 60-i, 1000*i)), TupleId(pageId, 100+i)) for i in range(19, 9, -1)]
+  >>> im.insertTuples(schema.name, batch)
+  >>> [keySchema.unpack(k).id for (k,_) in im.scanByIndex(indexId1)] # doctest:+ELLIPSIS
+  [0, 1, 2, ..., 19]
+
+  # Update the ages of the batch, and look up one of the new ages.
+  >>> updates = [(tup, schema.pack(schema.instantiate(i, 70-i, 1000*i)), tupId) \
+                   for (i, (tup, tupId)) in zip(range(19, 9, -1), batch)]
+  >>> im.updateTuples(schema.name, updates)
+  >>> idx2Key = ageSchema.pack(ageSchema.instantiate(55))
+  >>> [(tId.pageId.pageIndex, tId.tupleIndex) for tId in im.lookupByIndex(indexId2, idx2Key)]
+  [(1, 115)]
+
+  # Delete the batch.
+  >>> im.deleteTuples(schema.name, [(newTup, tupId) for (_, newTup, tupId) in updates])
+  >>> [keySchema.unpack(k).id for (k,_) in im.scanByIndex(indexId1)] # doctest:+ELLIPSIS
+  [0, 1, 2, ..., 9]
+
+  >>> [ageSchema.unpack(k).age for (k,_) in im.scanByIndex(indexId2)] # doctest:+ELLIPSIS
+  [20, 22, 24, ..., 38]
+
 
   # Test index removal
   >>> im.removeIndex(schema.name, indexId1)
@@ -170,13 +292,209 @@ class IndexManager:
   >>> im.indexes(schema.name) # doctest:+ELLIPSIS
   []
 
+  ## Test B+-tree indexes, whose pages are cached in the file manager's buffer pool.
+  >>> import shutil, Storage.BufferPool, Storage.FileManager
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, dataDir='btree/', indexType='btree')
+  >>> bp.setFileManager(fm)
+
+  >>> btreeId1 = fm.indexManager.createIndex(schema.name, schema, keySchema, True)
+  >>> btreeId2 = fm.indexManager.createIndex(schema.name, schema, ageSchema, False)
+  >>> isinstance(fm.indexManager.getIndex(btreeId1), BTree)
+  True
+
+  >>> for (tup, tupId) in testTuples:
+  ...    _ = fm.indexManager.insertTuple(schema.name, tup, tupId)
+  ...
+
+  >>> fm.indexManager.insertTuple(schema.name, testTuples[0][0], TupleId(pageId, 100))
+  Traceback (most recent call last):
+  ...
+  Storage.Index.BTree.KeyExistError: Duplicate key in a unique B+-tree
+
+  >>> [keySchema.unpack(k).id for (k,_) in fm.indexManager.scanByIndex(btreeId1)] # doctest:+ELLIPSIS
+  [0, 1, 2, ..., 9]
+
+  # Secondary B+-tree indexes hold duplicate keys.
+  >>> im2 = fm.indexManager
+  >>> im2.updateTuple(schema.name, testTuples[1][0], schema.pack(schema.instantiate(1, 20, 0)), testTuples[1][1])
+  >>> idx2Key = schema.projectBinary(testTuples[0][0], ageSchema)
+  >>> [tId.tupleIndex for tId in im2.lookupByIndex(btreeId2, idx2Key)]
+  [0, 1]
+
+  # Test B+-tree index restoration with the file manager.
+  >>> fm.close()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, dataDir='btree/')
+  >>> bp.setFileManager(fm)
+  >>> [tId.tupleIndex for tId in fm.indexManager.lookupByIndex(btreeId2, idx2Key)]
+  [0, 1]
+
+  >>> fm.indexManager.removeIndex(schema.name, btreeId2)
+  >>> fm.indexManager.indexes(schema.name) # doctest:+ELLIPSIS
+  [(..., True, ...)]
+
+  # Build an index bottom-up from a relation's tuples, sorting entries in small runs.
+  >>> fm.indexManager.removeIndex(schema.name, btreeId1)
+  >>> fm.createRelation(schema.name, schema)
+  >>> for (tup, _) in reversed(testTuples):
+  ...    _ = fm.insertTuple(schema.name, tup)
+  ...
+
+  >>> stages  = []
+  >>> buildId = fm.createIndex(schema.name, schema, ageSchema, False, build=True, runSize=4, \
+                               progress=lambda stage, count: stages.append((stage, count)))
+  >>> stages
+  [('sort', 4), ('sort', 8), ('sort', 10), ('load', 4), ('load', 8), ('load', 10)]
+
+  >>> [ageSchema.unpack(k).age for (k,_) in fm.indexManager.scanByIndex(buildId)] # doctest:+ELLIPSIS
+  [20, 22, 24, ..., 38]
+
+  # Build a covering index, including the salary attribute in its values.
+  >>> fm.indexManager.removeIndex(schema.name, buildId)
+  >>> salarySchema = DBSchema('employeeSalary', [('salary', 'double')])
+  >>> coverId = fm.createIndex(schema.name, schema, ageSchema, False, build=True, indexType='btree', include=salarySchema)
+  >>> fm.indexManager.coveringIndex(schema.name, {'age', 'salary'}) == coverId
+  True
+
+  >>> fm.indexManager.coveringIndex(schema.name, {'id', 'salary'}) is None
+  True
+
+  >>> [(ageSchema.unpack(k).age, salarySchema.unpack(v[TupleId.size:]).salary) \
+        for (k, v) in fm.indexManager.scanByIndex(coverId)][:3]
+  [(20, 50000.0), (22, 55000.0), (24, 60000.0)]
+
+  # Included attributes are maintained on updates that leave the key unchanged.
+  >>> tupId = TupleId.unpack(next(fm.indexManager.scanByIndex(coverId))[1])
+  >>> fm.updateTuple(schema.name, tupId, schema.pack(schema.instantiate(0, 20, 1.0)))
+  >>> [salarySchema.unpack(v[TupleId.size:]).salary for (_, v) in fm.indexManager.scanByIndex(coverId)][:2]
+  [1.0, 55000.0]
+
+  >>> fm.createIndex(schema.name, schema, keySchema, True, include=DBSchema('bonus', [('bonus', 'int')]))
+  Traceback (most recent call last):
+  ...
+  ValueError: Invalid included attributes for an index on employee
+
+  # Included attributes are restored with the index manager.
+  >>> fm.close()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, dataDir='btree/')
+  >>> bp.setFileManager(fm)
+  >>> fm.indexManager.includedSchema(coverId).fields
+  ['salary']
+
+  ## Test hash indexes for point lookups.
+  >>> hashId = fm.createIndex(schema.name, schema, keySchema, True, build=True, indexType='hash')
+  >>> fm.indexManager.orderedIndex(fm.indexManager.getIndex(hashId))
+  False
+
+  >>> lookup = lambda i: fm.lookupByKey(schema.name, keySchema.pack(keySchema.instantiate(i)))
+  >>> schema.unpack(bp.getPage(lookup(7).pageId).getTuple(lookup(7))).age
+  34
+
+  >>> lookup(42) is None
+  True
+
+  >>> fm.updateByKey(schema.name, keySchema.pack(keySchema.instantiate(7)), schema.pack(schema.instantiate(42, 34, 0)))
+  >>> (lookup(7), lookup(42) is not None)
+  (None, True)
+
+  >>> fm.deleteByKey(schema.name, keySchema.pack(keySchema.instantiate(42)))
+  >>> lookup(42) is None
+  True
+
+  # Secondary hash indexes hold duplicates. Only full key equality ranges seek the index,
+  # while other ranges scan all entries.
+  >>> ageHashId = fm.createIndex(schema.name, schema, ageSchema, False, build=True, indexType='hash')
+  >>> fm.insertTuple(schema.name, schema.pack(schema.instantiate(11, 24, 0))) is not None
+  True
+
+  >>> fm.indexManager.seekableRange(schema.name, ageHashId, 24, 24)
+  True
+
+  >>> sorted(ageSchema.unpack(k).age for (k, _) in fm.indexManager.rangeByIndex(schema.name, ageHashId, 24, 24))
+  [24, 24]
+
+  >>> hashKeys = [ageSchema.pack(ageSchema.instantiate(age)) for age in [30, 25, 24]]
+  >>> sorted((ageSchema.unpack(k).age, len(tIds)) for (k, tIds) in fm.lookupMany(schema.name, ageHashId, hashKeys))
+  [(24, 2), (30, 1)]
+
+  >>> fm.indexManager.seekableRange(schema.name, ageHashId, 30, None)
+  False
+
+  >>> sorted(ageSchema.unpack(k).age for (k, _) in fm.indexManager.rangeByIndex(schema.name, ageHashId, 30, None))
+  [30, 32, 36, 38]
+
+  >>> fm.clusterRelation(schema.name)
+  Traceback (most recent call last):
+  ...
+  ValueError: Cannot cluster relation employee on an unordered primary index
+
+  # Hash indexes are reopened with their database type.
+  >>> fm.close()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, dataDir='btree/')
+  >>> bp.setFileManager(fm)
+  >>> (fm.indexManager.orderedIndex(fm.indexManager.getIndex(hashId)), lookup(3) is not None)
+  (False, True)
+
+  ## Test bitmap indexes, combining the bitmaps of equality predicates.
+  >>> flagSchema = DBSchema('orders', [('id', 'int'), ('status', 'char(1)'), ('priority', 'int')])
+  >>> fm.createRelation(flagSchema.name, flagSchema)
+  >>> _ = fm.insertTuples(flagSchema.name, [flagSchema.pack(flagSchema.instantiate(i, 'FOP'[i % 3], i % 5)) \
+                                             for i in range(300)])
+  >>> statusSchema   = DBSchema('ordersStatus', [('status', 'char(1)')])
+  >>> prioritySchema = DBSchema('ordersPriority', [('priority', 'int')])
+  >>> statusId   = fm.createIndex(flagSchema.name, flagSchema, statusSchema, False, build=True, indexType='bitmap')
+  >>> priorityId = fm.createIndex(flagSchema.name, flagSchema, prioritySchema, False, build=True, indexType='bitmap')
+  >>> sorted(fm.indexManager.bitmapIndexes(flagSchema.name).items()) == [('priority', priorityId), ('status', statusId)]
+  True
+
+  >>> im3   = fm.indexManager
+  >>> terms = ('and', [('eq', 'status', ['O']), ('eq', 'priority', [0, 1])])
+  >>> (fileId, _) = fm.relationFile(flagSchema.name)
+  >>> matches = [fm.bufferPool.getPage(t.pageId).getTuple(t) for t in BitmapIndex.tupleIds(fileId, im3.evaluateBitmaps(flagSchema.name, terms))]
+  >>> (len(matches), [flagSchema.unpack(tup).id for tup in matches][:6])
+  (40, [1, 10, 16, 25, 31, 40])
+
+  >>> BitmapIndex.count(im3.evaluateBitmaps(flagSchema.name, ('or', [('eq', 'status', ['F']), ('eq', 'priority', [4])])))
+  140
+
+  # Term values are converted to their attribute's type, and terms with values
+  # that cannot be encoded are not answered by bitmap indexes.
+  >>> im3.bitmapTerms(flagSchema.name, ('and', [('eq', 'status', ['O']), ('eq', 'priority', [1.5, 2.0])]))
+  ('and', [('eq', 'status', ['O']), ('eq', 'priority', [2])])
+
+  >>> im3.bitmapTerms(flagSchema.name, ('eq', 'status', [5])) is None
+  True
+
+  # Bitmap indexes are maintained by tuple modifications, and restored with the index manager.
+  >>> fm.deleteTuple(flagSchema.name, TupleId.unpack(next(im3.rangeByIndex(flagSchema.name, statusId, 'O', 'O'))[1]))
+  >>> fm.close()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, dataDir='btree/')
+  >>> bp.setFileManager(fm)
+  >>> BitmapIndex.count(fm.indexManager.evaluateBitmaps(flagSchema.name, ('eq', 'status', ['O'])))
+  99
+
+  >>> fm.createIndex(flagSchema.name, flagSchema, DBSchema('ordersId', [('id', 'int')]), True, indexType='bitmap')
+  Traceback (most recent call last):
+  ...
+  ValueError: Bitmap indexes must be secondary indexes
+
+  >>> fm.close()
+  >>> shutil.rmtree('btree/')
   """
 
-  defaultIndexDir = "data/index"
+  defaultIndexDir  = "data/index"
+  defaultIndexType = "bdb"
+  defaultRunSize   = 100000
+  runBlockEntries  = 4096
 
   checkpointEncoding = "latin1"
   checkpointFile     = "db.im"
 
+  # The database holding the last committed sequence number, in transactional mode.
+  commitFile   = "db.commit"
+  commitKey    = b"sequence"
+  sequenceRepr = Struct("Q")
+
   def __init__(self, **kwargs):
     other = kwargs.get("other", None)
     if other:
@@ -184,6 +502,14 @@ class IndexManager:
 
     else:
       self.indexDir   = kwargs.get("indexDir", IndexManager.defaultIndexDir)
+      self.indexType  = kwargs.get("indexType", IndexManager.defaultIndexType)
+      self.transactional = kwargs.get("transactional", False)
+      self.cacheSize  = kwargs.get("cacheSize", None)
+      self.maxCacheSize = kwargs.get("maxCacheSize", self.cacheSize)
+      self.txn        = None
+      self.fileMgr    = None
+      self.keyEncoders = {}
+      self.extractors  = {}
       checkpointFound = os.path.exists(os.path.join(self.indexDir, IndexManager.checkpointFile))
       restoring       = "restore" in kwargs
 
@@ -194,6 +520,9 @@ class IndexManager:
         self.indexCounter    = kwargs.get("indexCounter", 0)
         self.relationIndexes = kwargs.get("relationIndexes", {}) # rel id -> (relation schema, primary, dict(secondaries))
         self.indexMap        = kwargs.get("indexMap", {})        # index id -> DB object
+        self.indexOptions    = kwargs.get("indexOptions", {})    # index id -> B+-tree options
+        self.indexIncludes   = kwargs.get("indexIncludes", {})   # index id -> included attribute schema
+        self.pendingIndexes  = {}                                 # index id -> B+-tree filename
 
         self.initializeDB(self.indexDir)
 
@@ -202,8 +531,16 @@ class IndexManager:
           for i in kwargs["restore"][0]:
             self.relationIndexes[i[0]] = (i[1][0], i[1][1], dict(i[1][2]))
 
+          # B+-tree indexes are opened once a file manager is attached.
+          secondaryIds = set(indexId for (_, _, secondaries) in self.relationIndexes.values() \
+                                     for indexId in secondaries.values())
           for i in kwargs["restore"][1]:
-            self.indexMap[i[0]] = self.openIndexDB(i[1])
+            if self.indexOptions.get(i[0], {}).get("type", None) == "bitmap":
+              self.indexMap[i[0]] = self.openBitmap(i[1][0])
+            elif i[0] in self.indexOptions:
+              self.pendingIndexes[i[0]] = i[1][0]
+            else:
+              self.indexMap[i[0]] = self.openIndexDB(i[1][0], i[0] in secondaryIds)
 
       else:
         self.restore()
@@ -213,13 +550,30 @@ class IndexManager:
     self.indexCounter    = other.indexCounter
     self.relationIndexes = other.relationIndexes
     self.indexMap        = other.indexMap
+    self.indexType       = other.indexType
+    self.transactional   = other.transactional
+    self.cacheSize       = other.cacheSize
+    self.maxCacheSize    = other.maxCacheSize
+    self.txn             = other.txn
+    self.indexOptions    = other.indexOptions
+    self.indexIncludes   = other.indexIncludes
+    self.pendingIndexes  = other.pendingIndexes
+    self.fileMgr         = other.fileMgr
+    self.keyEncoders     = other.keyEncoders
+    self.extractors      = other.extractors
     self.env             = other.env
+    self.commitDb        = other.commitDb
 
-  # Close all open indexes.
+  # Close all open indexes, committing any open transaction.
   def close(self):
+    self.commit()
     for idxId in self.indexMap:
       self.closeIndexDB(self.indexMap[idxId])
 
+    if self.commitDb is not None:
+      self.commitDb.close()
+      self.env.txn_checkpoint()
+
   # Save the index manager internals to the data directory.
   def checkpoint(self):
     imPath = os.path.join(self.indexDir, IndexManager.checkpointFile)
@@ -230,28 +584,62 @@ class IndexManager:
   def restore(self):
     imPath = os.path.join(self.indexDir, IndexManager.checkpointFile)
     with open(imPath, 'r', encoding=IndexManager.checkpointEncoding) as f:
-      other = IndexManager.unpack(f.read())
+      other = IndexManager.unpack(f.read(), indexType=self.indexType, transactional=self.transactional, \
+                                  cacheSize=self.cacheSize, maxCacheSize=self.maxCacheSize)
       self.fromOther(other)
 
+  # Attaches the file manager holding the storage files of B+-tree indexes,
+  # and opens any B+-tree indexes restored from a checkpoint.
+  def setFileManager(self, fileMgr):
+    self.fileMgr = fileMgr
+    for (indexId, filename) in self.pendingIndexes.items():
+      self.indexMap[indexId] = self.openBTree(filename, self.indexOptions[indexId])
+    self.pendingIndexes = {}
+
 
   # Berkeley DB utility methods.
 
   # Initializes a new BerkeleyDB environment and database to store a set of indexes.
+  # A transactional environment runs recovery when opened, and holds the commit
+  # sequence database.
   def initializeDB(self, dbDir):
-    self.env = db.DBEnv()
-    envFlags = db.DB_CREATE | db.DB_INIT_MPOOL
+    self.env      = db.DBEnv()
+    self.commitDb = None
+    envFlags      = db.DB_CREATE | db.DB_INIT_MPOOL
+    if self.cacheSize:
+      self.env.set_cache_max(*IndexManager.cacheSizeArgs(max(self.cacheSize, self.maxCacheSize or 0)))
+      self.env.set_cachesize(*IndexManager.cacheSizeArgs(self.cacheSize), 1)
+    if self.transactional:
+      envFlags |= db.DB_INIT_TXN | db.DB_INIT_LOG | db.DB_INIT_LOCK | db.DB_RECOVER
+      self.env.log_set_config(db.DB_LOG_AUTO_REMOVE, True)
     self.env.open(dbDir, envFlags)
 
-  # TODO: set duplicate flags for secondary indexes as needed.
-  def createIndexDB(self, filename):
+    if self.transactional:
+      self.commitDb = db.DB(dbEnv=self.env)
+      self.commitDb.open(IndexManager.commitFile, db.DB_BTREE, db.DB_CREATE | db.DB_AUTO_COMMIT)
+
+  # Secondary indexes hold duplicate keys, kept in value (i.e., tuple id) order.
+  # Indexes are BTree databases by default, or hash databases with the 'dbType' argument.
+  # Database files cannot be truncated in a transactional environment, thus any existing
+  # file is removed instead.
+  def createIndexDB(self, filename, duplicates=False, dbType=db.DB_BTREE):
     indexDb = db.DB(dbEnv=self.env)
+    if duplicates:
+      indexDb.set_flags(db.DB_DUPSORT)
     dbFlags = db.DB_CREATE | db.DB_TRUNCATE
-    indexDb.open(filename, db.DB_BTREE, dbFlags)
+    if self.transactional:
+      if os.path.exists(os.path.join(self.indexDir, filename)):
+        self.env.dbremove(filename, flags=db.DB_AUTO_COMMIT)
+      dbFlags = db.DB_CREATE | db.DB_AUTO_COMMIT
+    indexDb.open(filename, dbType, dbFlags)
     return indexDb
 
-  def openIndexDB(self, filename):
+  # Opens an existing index, whose database type is read from the database file.
+  def openIndexDB(self, filename, duplicates=False):
     indexDb = db.DB(dbEnv=self.env)
-    indexDb.open(filename, db.DB_BTREE)
+    if duplicates:
+      indexDb.set_flags(db.DB_DUPSORT)
+    indexDb.open(filename, db.DB_UNKNOWN, db.DB_AUTO_COMMIT if self.transactional else 0)
     return indexDb
 
   def closeIndexDB(self, indexDb):
@@ -260,7 +648,108 @@ class IndexManager:
   def removeIndexDB(self, indexDb):
     filename, _ = indexDb.get_dbname()
     self.closeIndexDB(indexDb)
-    self.env.dbremove(filename)
+    if isinstance(indexDb, BTree):
+      self.fileMgr.removeIndexFile(indexDb.fileId())
+    elif isinstance(indexDb, BitmapIndex):
+      indexDb.remove()
+    else:
+      self.env.dbremove(filename, flags=db.DB_AUTO_COMMIT if self.transactional else 0)
+
+
+  # Transaction methods.
+  # In transactional mode, index modifications and lookups run in a transaction begun on
+  # first use, which is committed as a group with the heap pages modified alongside the
+  # indexes (see FileManager.commit).
+
+  # Returns the open transaction, beginning one if necessary, or None if the
+  # index manager is not transactional.
+  def transaction(self):
+    if self.transactional and self.txn is None:
+      self.txn = self.env.txn_begin()
+    return self.txn
+
+  # Commits the open transaction. The given commit sequence number is recorded in the
+  # same transaction, so that the commit of the index changes is also the commit point
+  # of any heap pages journaled with that sequence number.
+  def commit(self, sequence=None):
+    if self.transactional:
+      if sequence is not None:
+        self.commitDb.put(IndexManager.commitKey, IndexManager.sequenceRepr.pack(sequence), txn=self.transaction())
+      if self.txn is not None:
+        self.txn.commit()
+        self.txn = None
+
+  # Returns the last committed sequence number, or 0 if there is none.
+  def commitSequence(self):
+    if self.transactional:
+      data = self.commitDb.get(IndexManager.commitKey, txn=self.txn)
+      return IndexManager.sequenceRepr.unpack(data)[0] if data is not None else 0
+    return 0
+
+
+  # Cache methods.
+
+  # Returns a cache size in bytes as the gigabytes and bytes expected by BerkeleyDB.
+  @staticmethod
+  def cacheSizeArgs(cacheSize):
+    return (cacheSize >> 30, cacheSize & ((1 << 30) - 1))
+
+  # Resizes the BerkeleyDB cache of an open environment, up to its maximum cache size.
+  def setCacheSize(self, cacheSize):
+    if not self.cacheSize:
+      raise ValueError("Cannot resize the index cache, no cache size was set")
+    if cacheSize > self.maxCacheSize:
+      raise ValueError("Index cache size exceeds its maximum size")
+
+    self.env.set_cachesize(*IndexManager.cacheSizeArgs(cacheSize), 1)
+    self.cacheSize = cacheSize
+
+  # Returns the number of page requests served from, and missing, the BerkeleyDB cache.
+  def cacheStats(self):
+    (stats, _) = self.env.memp_stat()
+    return (stats['cache_hit'], stats['cache_miss'])
+
+
+  # B+-tree utility methods.
+
+  # Creates a B+-tree index in a new storage file from the file manager.
+  # The index values hold a tuple id followed by any included attributes.
+  def createBTree(self, filename, keySchema, unique, include=None):
+    if self.fileMgr is None:
+      raise ValueError("No file manager available for a B+-tree index")
+
+    valueSize   = TupleId.size + (include.size if include else 0)
+    entrySchema = BTree.entrySchema(keySchema, valueSize, KeyEncoder(keySchema).size)
+    (fileId, storageFile) = self.fileMgr.createIndexFile(filename, entrySchema, BTreePage)
+    return BTree(storageFile=storageFile, name=filename, unique=unique)
+
+  def openBTree(self, filename, options):
+    storageFile = self.fileMgr.indexFile(FileId(options["fileId"]))
+    if storageFile is None:
+      raise ValueError("No storage file found for B+-tree index "+filename)
+    return BTree(storageFile=storageFile, name=filename, unique=options["unique"])
+
+  def btreeOptions(self, indexDb):
+    return {"fileId": indexDb.fileId().fileIndex, "unique": indexDb.unique}
+
+  # Bitmap index utility methods.
+
+  # Bitmap indexes are stored in a file per index in the index directory.
+  def createBitmap(self, filename):
+    indexDb = self.openBitmap(filename)
+    indexDb.remove()
+    return indexDb
+
+  def openBitmap(self, filename):
+    return BitmapIndex(path=os.path.join(self.indexDir, filename+".bitmap"), name=filename)
+
+  # Returns whether the given index orders its entries by key.
+  def orderedIndex(self, indexDb):
+    return isinstance(indexDb, (BTree, BitmapIndex)) or indexDb.get_type() != db.DB_HASH
+
+  # Returns the put flags preventing overwrites of an existing key for the given index.
+  def noOverwriteFlag(self, indexDb):
+    return BTree.noOverwrite if isinstance(indexDb, BTree) else db.DB_NOOVERWRITE
 
 
   # Index identifier methods.
@@ -310,20 +799,48 @@ class IndexManager:
 
     return errorMsg
 
-  # Creates a new index for the given key as a BDB database.
+  # Creates a new index for the given key as a BDB database, as a B+-tree, as a BDB
+  # hash database, or as a bitmap index, as requested by the 'indexType' argument
+  # ("bdb", "btree", "hash" or "bitmap") or the index manager's default type.
   # Returns the index id of a newly created index from key -> relation
   # If the index is indicated to be a primary index, the values are tuple identifiers,
   # while for secondary indexes, the values are sets of tuple identifiers.
   # This method should ensure that no relation has two primary indexes.
-  def createIndex(self, relId, relSchema, keySchema, primary):
+  # The optional 'include' schema lists relation attributes stored in the index values.
+  def createIndex(self, relId, relSchema, keySchema, primary, indexType=None, include=None):
     # Check if this is a duplicate index and abort.
     errorMsg = self.checkDuplicateIndex(relId, keySchema, primary)
     if errorMsg:
       raise ValueError(errorMsg)
 
+    indexType = indexType if indexType else self.indexType
+    if indexType not in ["bdb", "btree", "hash", "bitmap"]:
+      raise ValueError("Invalid index type: "+str(indexType))
+
+    if indexType == "bitmap" and primary:
+      raise ValueError("Bitmap indexes must be secondary indexes")
+
+    if indexType == "bitmap" and include is not None:
+      raise ValueError("Bitmap indexes cannot include attributes")
+
+    if include is not None and any(f not in relSchema.fields or f in keySchema.fields for f in include.fields):
+      raise ValueError("Invalid included attributes for an index on "+str(relId))
+
     indexId, indexFile = self.generateIndexFileName(relId)
-    indexDb = self.createIndexDB(indexFile)
+    if indexType == "btree":
+      indexDb = self.createBTree(indexFile, keySchema, primary, include)
+      self.indexOptions[indexId] = self.btreeOptions(indexDb)
+    elif indexType == "hash":
+      indexDb = self.createIndexDB(indexFile, not primary, db.DB_HASH)
+    elif indexType == "bitmap":
+      indexDb = self.createBitmap(indexFile)
+      self.indexOptions[indexId] = {"type": "bitmap"}
+    else:
+      indexDb = self.createIndexDB(indexFile, not primary)
+
     self.indexMap[indexId] = indexDb
+    if include is not None:
+      self.indexIncludes[indexId] = include
 
     # Add the new index to the relationFiles data structure.
     if primary:
@@ -351,6 +868,10 @@ class IndexManager:
 
     self.indexCounter = max(self.indexCounter, indexId+1)
     self.indexMap[indexId] = indexDb
+    if isinstance(indexDb, BTree):
+      self.indexOptions[indexId] = self.btreeOptions(indexDb)
+    elif isinstance(indexDb, BitmapIndex):
+      self.indexOptions[indexId] = {"type": "bitmap"}
 
     # Add the new index to the relationFiles data structure.
     if primary:
@@ -386,6 +907,9 @@ class IndexManager:
       if self.relationIndexes[relId][1] is None and not self.relationIndexes[relId][2]:
         del self.relationIndexes[relId]
 
+    self.indexOptions.pop(indexId, None)
+    self.indexIncludes.pop(indexId, None)
+    self.keyEncoders.pop(indexId, None)
     if indexId in self.indexMap:
       indexDb = self.indexMap.pop(indexId, None)
       if indexDb and detach:
@@ -402,15 +926,73 @@ class IndexManager:
     if indexes:
       return next((x[2] for x in indexes if keySchema.match(x[0])), None)
 
+  # Returns the order-preserving key encoder of an index.
+  def keyEncoder(self, indexId):
+    if indexId not in self.keyEncoders:
+      keySchema = None
+      for (_, primary, secondaries) in self.relationIndexes.values():
+        candidates = ([primary] if primary else []) + list(secondaries.items())
+        keySchema  = next((k for (k, i) in candidates if i == indexId), keySchema)
+
+      if keySchema is None:
+        raise ValueError("Invalid index id for a key encoder: "+str(indexId))
+      self.keyEncoders[indexId] = KeyEncoder(keySchema)
+
+    return self.keyEncoders[indexId]
+
+  # Returns the schema of the attributes included in an index's values, or None.
+  def includedSchema(self, indexId):
+    return self.indexIncludes.get(indexId, None)
+
+  # Returns the id of an index whose key and included attributes cover all of the
+  # given attributes of a relation, preferring the index with the smallest entries.
+  def coveringIndex(self, relId, attributes):
+    candidates = []
+    for (keySchema, _, indexId) in self.indexes(relId):
+      include = self.includedSchema(indexId)
+      covered = set(keySchema.fields) | set(include.fields if include else [])
+      if set(attributes) <= covered and self.getIndex(indexId) is not None:
+        candidates.append((keySchema.size + (include.size if include else 0), indexId))
+    return min(candidates)[1] if candidates else None
+
   # Auxiliary index helpers.
 
   def hasPrimaryIndex(self, relId):
     return self.hasIndexes(relId) and self.relationIndexes[relId][1] is not None
 
   def getPrimaryIndex(self, relId):
-    if self.hasIndexes(relId):
+    if self.hasPrimaryIndex(relId):
       _, primary, _ = self.relationIndexes[relId]
-      return self.getIndex(primary[0])
+      return self.getIndex(primary[1])
+
+  def isPrimaryIndex(self, relId, indexId):
+    return self.hasPrimaryIndex(relId) and self.relationIndexes[relId][1][1] == indexId
+
+  # Returns the positions of the given tuples in primary key order, each paired with the
+  # tuple id of the first stored tuple whose primary key is not less than the tuple's key,
+  # or of the last tuple in key order if there is no such tuple. This is used to place new
+  # tuples of a clustered relation near their key order neighbours. Tuples falling between
+  # the same pair of stored keys share a neighbour, thus the index is probed once per run.
+  def primaryNeighbours(self, relId, tupleDataList):
+    indexDb = self.getPrimaryIndex(relId)
+    if indexDb is not None and self.orderedIndex(indexDb):
+      schema, (keySchema, indexId), _ = self.relationIndexes[relId]
+      extract = self.keyExtractor(schema, keySchema, self.keyEncoder(indexId))
+      keyed   = sorted((bytes(extract(tupleData)), i) for (i, tupleData) in enumerate(tupleDataList))
+
+      crsr       = indexDb.cursor(txn=self.transaction())
+      found      = None
+      pastEnd    = False
+      neighbours = []
+      for (indexKey, i) in keyed:
+        if not pastEnd and (found is None or bytes(found[0]) < indexKey):
+          found = crsr.set_range(indexKey)
+          if found is None:
+            (found, pastEnd) = (crsr.last(), True)
+        neighbours.append((i, TupleId.unpack(found[1]) if found else None))
+
+      crsr.close()
+      return neighbours
 
 
   # Index access methods.
@@ -418,74 +1000,235 @@ class IndexManager:
   # Updates all indexes on the relation to add the new tuple.
   # The key for each index should be extracted from the full tuple given in tupleData.
   def insertTuple(self, relId, tupleData, tupleId):
-    if self.hasIndexes(relId):
-      schema, _, _ = self.relationIndexes[relId]
-      indexes      = self.indexes(relId)
-      if indexes:
-        for (keySchema, primary, indexId) in indexes:
-          indexDb  = self.getIndex(indexId)
-          if indexDb is not None:
-            indexKey = schema.projectBinary(tupleData, keySchema)
-            putFlags = db.DB_NOOVERWRITE if primary else 0
-            indexDb.put(indexKey, tupleId.pack(), flags=putFlags)
+    self.insertTuples(relId, [(tupleData, tupleId)])
 
   # Updates all indexes on the relation to remove the given tuple.
   # The key for each index should be extracted from the full tuple given in tupleData.
   def deleteTuple(self, relId, tupleData, tupleId):
-    if self.hasIndexes(relId):
-      schema, _, _ = self.relationIndexes[relId]
-      indexes      = self.indexes(relId)
-      if indexes:
-        for (keySchema, primary, indexId) in indexes:
-          indexDb  = self.getIndex(indexId)
-          if indexDb is not None:
-            indexKey = schema.projectBinary(tupleData, keySchema)
-            if primary:
-              indexDb.delete(indexKey)
-            else:
-              # Delete only the tuple matching the given tuple id.
-              crsr = indexDb.cursor()
-              found = crsr.get_both(indexKey, tupleId.pack())
-              if found:
-                crsr.delete()
-              crsr.close()
+    self.deleteTuples(relId, [(tupleData, tupleId)])
 
   # Updates all indexes on the relation to refresh the given tuple.
-  # The old and new keys for each index should be extracted from the full tuples.
-  # For each index, based on whether the key is changing, this method should issue
-  # the appropriate DB delete+insert calls.
+  # The old and new entries for each index are extracted from the full tuples, and
+  # only entries whose key or included attributes have changed are replaced.
   # Note: since our storage engine uses heap files only, the tuple id itself should not change.
   def updateTuple(self, relId, oldData, newData, tupleId):
-    if self.hasIndexes(relId):
-      schema, _, _ = self.relationIndexes[relId]
-      indexes      = self.indexes(relId)
-      if indexes:
-        for (keySchema, primary, indexId) in indexes:
-          indexDb = self.getIndex(indexId)
-          if indexDb is not None:
-            oldKey  = schema.projectBinary(oldData, keySchema)
-            newKey  = schema.projectBinary(newData, keySchema)
-
-            # If the keys are the same, we do not need to perform any operations.
-            # That is, we assume the tuple id argument is the same as the existing
-            # entry (since this is a tuple id), and we do not check this.
-            if oldKey == newKey:
-              pass
-
-            # Insert a new index entry if the key has changed.
-            else:
-              if primary:
-                indexDb.delete(oldKey)
-                indexDb.put(newKey, tupleId.pack(), flags=db.DB_NOOVERWRITE)
-              else:
-                # Update only the tuple matching the given tuple id.
-                crsr = indexDb.cursor()
-                found = crsr.get_both(oldKey, tupleId.pack())
-                if found:
-                  crsr.delete()
-                  crsr.put(newKey, tupleId.pack(), flags=db.DB_KEYLAST)
-                    # TODO: flags based on whether the secondary index is unique?
-                crsr.close()
+    self.updateTuples(relId, [(oldData, newData, tupleId)])
+
+
+  # Batched index access methods.
+  # These maintain all indexes on the relation for a list of modified tuples. Index entries
+  # are extracted directly from the packed tuples, and each index applies its entries
+  # in key order, with a single cursor for secondary index deletions.
+
+  # Returns a function extracting a binary key from a packed tuple of the given schema,
+  # packed with the key schema or encoded with the given key encoder.
+  # Extractors are compiled once per relation and key schema.
+  def keyExtractor(self, schema, keySchema, encoder=None):
+    cacheKey = (tuple(schema.schema()), tuple(keySchema.schema()), encoder is not None)
+    if cacheKey not in self.extractors:
+      self.extractors[cacheKey] = self.compileKeyExtractor(schema, keySchema, encoder)
+    return self.extractors[cacheKey]
+
+  # Packed keys are byte slices of the tuple (see DBSchema.projector), as are encoded keys
+  # of character attributes only. Other encoded keys read their attributes from the tuple
+  # with a single struct, skipping the remaining attributes as padding.
+  def compileKeyExtractor(self, schema, keySchema, encoder):
+    project = schema.projector(keySchema)
+    if encoder is None or all(Types.parseType(t)["typeStr"] in ['char', 'text'] for t in keySchema.types):
+      return project
+
+    positions = [schema.fields.index(f) for f in keySchema.fields]
+    order     = sorted(range(len(positions)), key=lambda i: schema.offsets[positions[i]])
+    (format, offset) = ('=', 0)
+    for i in order:
+      j = positions[i]
+      if schema.types[j] != keySchema.types[i] or schema.offsets[j] < offset:
+        return lambda tupleData: encoder.fromPacked(project(tupleData))
+
+      padding = schema.offsets[j] - offset
+      format += (str(padding) + 'x' if padding else '') + Types.formatType(schema.types[j])
+      offset  = schema.offsets[j] + schema.sizes[j]
+
+    reader = Struct(format)
+    if order == sorted(order):
+      return lambda tupleData: encoder.encode(reader.unpack_from(tupleData))
+
+    reorder = operator.itemgetter(*[order.index(i) for i in range(len(order))])
+    return lambda tupleData: encoder.encode(reorder(reader.unpack_from(tupleData)))
+
+  # Returns a function constructing an index value for a tuple id and packed tuple,
+  # as the packed tuple id followed by any attributes included in the index.
+  def valueBuilder(self, schema, indexId):
+    include = self.includedSchema(indexId)
+    if include is None:
+      return lambda tupleId, tupleData: tupleId.pack()
+
+    extractIncluded = self.keyExtractor(schema, include)
+    return lambda tupleId, tupleData: tupleId.pack() + extractIncluded(tupleData)
+
+  # Returns the indexes on the relation, as (primary, index object, entries) triples,
+  # with the (key, value) entries built from the given list of (tuple data, tuple id)
+  # pairs in input order.
+  def batchEntries(self, relId, tuples):
+    schema, _, _ = self.relationIndexes[relId]
+    indexes      = [(keySchema, primary, indexId) for (keySchema, primary, indexId) in self.indexes(relId) \
+                      if self.getIndex(indexId) is not None]
+    if not indexes:
+      return []
+
+    result = []
+    for (keySchema, primary, indexId) in indexes:
+      extractKey = self.keyExtractor(schema, keySchema, self.keyEncoder(indexId))
+      buildValue = self.valueBuilder(schema, indexId)
+      result.append((primary, self.getIndex(indexId), \
+                     [(extractKey(tupleData), buildValue(tupleId, tupleData)) for (tupleData, tupleId) in tuples]))
+    return result
+
+  # Removes the given (key, value) entries from an index, in key order.
+  def deleteEntries(self, indexDb, primary, entries):
+    if primary:
+      for (indexKey, _) in entries:
+        indexDb.delete(indexKey, txn=self.transaction())
+    else:
+      crsr = indexDb.cursor(txn=self.transaction())
+      for (indexKey, indexValue) in entries:
+        found = crsr.get_both(indexKey, indexValue)
+        if found:
+          crsr.delete()
+      crsr.close()
+
+  # Adds the given (key, value) entries to an index, in key order.
+  def insertEntries(self, indexDb, primary, entries):
+    putFlags = self.noOverwriteFlag(indexDb) if primary else 0
+    txn      = self.transaction()
+    for (indexKey, indexValue) in entries:
+      indexDb.put(indexKey, indexValue, txn=txn, flags=putFlags)
+
+  # Updates all indexes on the relation to add a list of (tuple data, tuple id) pairs.
+  def insertTuples(self, relId, tuples):
+    if self.hasIndexes(relId) and tuples:
+      for (primary, indexDb, entries) in self.batchEntries(relId, tuples):
+        self.insertEntries(indexDb, primary, sorted(entries))
+
+  # Updates all indexes on the relation to remove a list of (tuple data, tuple id) pairs.
+  def deleteTuples(self, relId, tuples):
+    if self.hasIndexes(relId) and tuples:
+      for (primary, indexDb, entries) in self.batchEntries(relId, tuples):
+        self.deleteEntries(indexDb, primary, sorted(entries))
+
+  # Updates all indexes on the relation for a list of (old data, new data, tuple id) triples.
+  # For each index, all changed entries are removed before any new entries are added,
+  # so that a batch may exchange keys between tuples of a unique index.
+  def updateTuples(self, relId, updates):
+    if self.hasIndexes(relId) and updates:
+      oldEntries = self.batchEntries(relId, [(oldData, tupleId) for (oldData, _, tupleId) in updates])
+      newEntries = self.batchEntries(relId, [(newData, tupleId) for (_, newData, tupleId) in updates])
+      for ((primary, indexDb, oldIndexEntries), (_, _, newIndexEntries)) in zip(oldEntries, newEntries):
+        changed = [(o, n) for (o, n) in zip(oldIndexEntries, newIndexEntries) if o != n]
+        self.deleteEntries(indexDb, primary, sorted(o for (o, _) in changed))
+        self.insertEntries(indexDb, primary, sorted(n for (_, n) in changed))
+
+
+  # Updates all indexes on the relation to refer to the new locations of moved tuples.
+  # The moves are given as a list of (old tuple id, new tuple id, tuple data) triples,
+  # as produced when compacting a storage file. For each index, we remove all old
+  # entries in key order with a single cursor before adding the new entries, so that
+  # a tuple moving into the previous location of another is not removed with it.
+  def relocateTuples(self, relId, moves):
+    if self.hasIndexes(relId) and moves:
+      oldEntries = self.batchEntries(relId, [(tupleData, oldId) for (oldId, _, tupleData) in moves])
+      newEntries = self.batchEntries(relId, [(tupleData, newId) for (_, newId, tupleData) in moves])
+      for ((_, indexDb, oldIndexEntries), (_, _, newIndexEntries)) in zip(oldEntries, newEntries):
+        self.deleteEntries(indexDb, False, sorted(oldIndexEntries))
+        self.insertEntries(indexDb, False, sorted(newIndexEntries))
+
+
+  # Bulk index construction.
+
+  # Populates an empty index from an iterable of (tuple id, tuple data) pairs, such as a
+  # single scan of the relation. Index entries are sorted externally: runs of at most
+  # 'runSize' entries are sorted in memory and spilled to temporary files in the index
+  # directory, then merged in key order while loading the index. B+-tree indexes are
+  # built bottom-up by bulk loading, while BDB indexes are populated in key order.
+  #
+  # The optional progress callback is invoked as progress(stage, entries), for the "sort"
+  # stage after each run, and the "load" stage after every 'runSize' entries loaded.
+  def buildIndex(self, relId, indexId, tuples, progress=None, runSize=None):
+    indexDb = self.getIndex(indexId)
+    index   = next((x for x in self.indexes(relId) if x[2] == indexId), None)
+    if indexDb is None or index is None:
+      raise ValueError("Invalid index for bulk construction on relation "+str(relId))
+
+    schema, _, _          = self.relationIndexes[relId]
+    keySchema, primary, _ = index
+    runSize               = runSize if runSize else IndexManager.defaultRunSize
+
+    include    = self.includedSchema(indexId)
+    valueSize  = TupleId.size + (include.size if include else 0)
+    encoder    = self.keyEncoder(indexId)
+    extractKey = self.keyExtractor(schema, keySchema, encoder)
+    buildValue = self.valueBuilder(schema, indexId)
+    entries    = ((extractKey(tupleData) + buildValue(tupleId, tupleData)) for (tupleId, tupleData) in tuples)
+    (runs, runFiles) = self.sortRuns(entries, encoder.size + valueSize, runSize, progress)
+    try:
+      merged = ((entry[:encoder.size], entry[encoder.size:]) for entry in heapq.merge(*runs))
+      loaded = self.reportProgress(merged, "load", runSize, progress)
+      if isinstance(indexDb, BTree):
+        indexDb.bulkLoad(loaded)
+      else:
+        putFlags = self.noOverwriteFlag(indexDb) if primary else 0
+        txn      = self.transaction()
+        for (indexKey, indexValue) in loaded:
+          indexDb.put(indexKey, indexValue, txn=txn, flags=putFlags)
+    finally:
+      for runFile in runFiles:
+        runFile.close()
+
+  # Splits binary index entries into sorted runs, returning a list of run iterators and
+  # the list of temporary files backing them. A single run is kept in memory.
+  def sortRuns(self, entries, entrySize, runSize, progress=None):
+    entries  = iter(entries)
+    runFiles = []
+    count    = 0
+
+    run = sorted(itertools.islice(entries, runSize))
+    while run:
+      count += len(run)
+      if progress:
+        progress("sort", count)
+
+      nextRun = sorted(itertools.islice(entries, runSize))
+      if not runFiles and not nextRun:
+        return ([run], [])
+
+      runFile = tempfile.TemporaryFile(dir=self.indexDir)
+      runFile.write(b''.join(run))
+      runFile.seek(0)
+      runFiles.append(runFile)
+      run = nextRun
+
+    return ([self.readRun(runFile, entrySize) for runFile in runFiles], runFiles)
+
+  # Returns an iterator over the fixed-size entries of a run file, read in blocks.
+  def readRun(self, runFile, entrySize):
+    while True:
+      block = runFile.read(entrySize * IndexManager.runBlockEntries)
+      if not block:
+        break
+      for offset in range(0, len(block), entrySize):
+        yield block[offset:offset+entrySize]
+
+  # Passes through an iterator, reporting the number of elements consumed to a progress callback.
+  def reportProgress(self, iterator, stage, interval, progress=None):
+    count = 0
+    for element in iterator:
+      yield element
+      count += 1
+      if progress and count % interval == 0:
+        progress(stage, count)
+
+    if progress and count % interval != 0:
+      progress(stage, count)
 
 
   # Lookup methods.
@@ -498,7 +1241,8 @@ class IndexManager:
     result = []
     indexDb = self.getIndex(indexId)
     if indexDb is not None:
-      crsr = indexDb.cursor()
+      keyData = self.keyEncoder(indexId).fromPacked(keyData)
+      crsr = indexDb.cursor(txn=self.transaction())
 
       data = crsr.set(keyData)
       while data and data[0] == keyData:
@@ -508,30 +1252,266 @@ class IndexManager:
       crsr.close()
       return iter(result)
 
+  # Perform index lookups for a batch of keys, packed with the index's key schema.
+  # The distinct keys are probed in encoded key order with a single cursor moving forward
+  # through an ordered index. After the entries of one key, the cursor rests on the first
+  # entry of a larger key, thus the next key is only sought when it lies further ahead.
+  # Unordered (hash) indexes seek each key with the same cursor.
+  # This returns a list of (key, tuple id list) pairs in key order, for the keys found.
+  def lookupMany(self, indexId, keys):
+    indexDb = self.getIndex(indexId)
+    if indexDb is not None:
+      encoder = self.keyEncoder(indexId)
+      ordered = self.orderedIndex(indexDb)
+      probes  = sorted(set((encoder.fromPacked(key), bytes(key)) for key in keys))
+      result  = []
+
+      crsr = indexDb.cursor(txn=self.transaction())
+      step = crsr.next if ordered else crsr.next_dup
+      (entry, positioned) = (None, False)
+      for (indexKey, key) in probes:
+        if not ordered:
+          entry = crsr.set(indexKey)
+        elif not positioned or (entry is not None and entry[0] < indexKey):
+          (entry, positioned) = (crsr.set_range(indexKey), True)
+
+        tupleIds = []
+        while entry is not None and entry[0] == indexKey:
+          tupleIds.append(TupleId.unpack(entry[1]))
+          entry = step()
+
+        if tupleIds:
+          result.append((key, tupleIds))
+
+      crsr.close()
+      return result
+
   # Retrieve a tuple based on its key.
   # This method returns None if the relation does not have a primary index,
   # or if the key does not exist in the index.
   # Otherwise it returns a single tuple identifier.
   def lookupByKey(self, relId, keyData):
     indexDb = self.getPrimaryIndex(relId)
-    if indexDb:
-      return TupleId.unpack(indexDb.get(keyData))
+    if indexDb is not None:
+      _, (_, indexId), _ = self.relationIndexes[relId]
+      data = indexDb.get(self.keyEncoder(indexId).fromPacked(keyData), txn=self.transaction())
+      return TupleId.unpack(data) if data is not None else None
+
+
+  # Returns the key schema of an index on the given relation.
+  def indexKeySchema(self, relId, indexId):
+    return next((keySchema for (keySchema, _, i) in self.indexes(relId) if i == indexId), None)
+
+  # Returns whether a range scan over the given index seeks the range, rather than
+  # scanning the whole index. Unordered indexes only seek a single full key.
+  def seekableRange(self, relId, indexId, low=None, high=None, lowInclusive=True, highInclusive=True):
+    indexDb   = self.getIndex(indexId)
+    keySchema = self.indexKeySchema(relId, indexId)
+    bounds    = self.keyRange(indexId, low, high, lowInclusive, highInclusive)
+    if indexDb is None or keySchema is None or bounds is None:
+      return False
+
+    (low, high, lowInclusive, highInclusive) = bounds
+    if self.orderedIndex(indexDb):
+      return low is not None or high is not None
+
+    return len(keySchema.fields) == 1 and low is not None \
+             and low == high and lowInclusive and highInclusive
+
+  # Returns a range over the leading key attribute of an index with its bounds converted
+  # to the attribute's type (see KeyEncoder.convertBound), as a (low, high, lowInclusive,
+  # highInclusive) tuple, or None if either bound cannot be encoded.
+  def keyRange(self, indexId, low=None, high=None, lowInclusive=True, highInclusive=True):
+    encoder = self.keyEncoder(indexId)
+    if low is not None:
+      lowBound = encoder.convertBound(low, lowInclusive, True)
+      if lowBound is None:
+        return None
+      (low, lowInclusive) = lowBound
+
+    if high is not None:
+      highBound = encoder.convertBound(high, highInclusive, False)
+      if highBound is None:
+        return None
+      (high, highInclusive) = highBound
+
+    return (low, high, lowInclusive, highInclusive)
+
+  # Returns the smallest and largest values of the leading key attribute of an ordered
+  # index, or None if the index is unordered or empty.
+  def leadingKeyBounds(self, indexId):
+    indexDb = self.getIndex(indexId)
+    if indexDb is None or not self.orderedIndex(indexDb):
+      return None
+
+    if isinstance(indexDb, BitmapIndex):
+      keys   = [key for (key, bitmap) in indexDb.bitmaps.items() if bitmap]
+      bounds = (min(keys), max(keys)) if keys else None
+    else:
+      crsr = indexDb.cursor(txn=self.transaction())
+      try:
+        (first, last) = (crsr.first(), crsr.last())
+      finally:
+        crsr.close()
+      bounds = (first[0], last[0]) if first and last else None
+
+    encoder = self.keyEncoder(indexId)
+    return tuple(encoder.decode(key)[0] for key in bounds) if bounds else None
+
+  # Estimates the number of entries of an index whose leading key attribute lies in a range,
+  # for a relation with the given number of tuples, without scanning the range. Ranges over
+  # numeric attributes are interpolated between the index's smallest and largest keys assuming
+  # uniformly distributed keys, where ranges over integers count the integers they hold.
+  # Equality on a primary index matches a single tuple, and other ranges fall back to
+  # System R's default selectivities of 1/10 for equality and 1/3 for ranges.
+  def estimateRange(self, relId, indexId, numTuples, low=None, high=None, lowInclusive=True, highInclusive=True):
+    bounds = self.keyRange(indexId, low, high, lowInclusive, highInclusive)
+    if bounds is None or (bounds[0] is None and bounds[1] is None):
+      return numTuples
+
+    (low, high, lowInclusive, highInclusive) = bounds
+    keySchema = self.indexKeySchema(relId, indexId)
+    equality  = low == high and lowInclusive and highInclusive
+    if equality and len(keySchema.fields) == 1 and self.isPrimaryIndex(relId, indexId):
+      return min(1, numTuples)
+
+    typeStr   = Types.parseType(keySchema.types[0])["typeStr"]
+    numeric   = typeStr in KeyEncoder.integerTypes or typeStr in KeyEncoder.floatTypes
+    keyBounds = self.leadingKeyBounds(indexId) if numeric else None
+    if keyBounds is None:
+      return numTuples * (0.1 if equality else 1 / 3)
+
+    (minKey, maxKey) = keyBounds
+    lo = minKey if low is None or low < minKey else low
+    hi = maxKey if high is None or high > maxKey else high
+    if typeStr in KeyEncoder.integerTypes:
+      lo += 1 if lo == low and not lowInclusive else 0
+      hi -= 1 if hi == high and not highInclusive else 0
+      fraction = max(0, hi - lo + 1) / (maxKey - minKey + 1)
+    elif equality:
+      fraction = 0.1 if minKey <= low <= maxKey else 0.0
+    else:
+      fraction = (max(0.0, hi - lo) / (maxKey - minKey)) if maxKey > minKey else float(lo <= hi)
+
+    return numTuples * fraction
+
+  # Range scan over an index, returning an iterator of (key, value) entries whose
+  # leading key attribute lies in the given range, where either bound may be None.
+  # For ordered indexes, the scan positions a cursor at the low bound and stops past
+  # the high bound. Unordered indexes seek a single full key, or filter a full scan.
+  # Ranges whose bounds cannot be encoded in the key's type also filter a full scan.
+  def rangeByIndex(self, relId, indexId, low=None, high=None, lowInclusive=True, highInclusive=True):
+    indexDb   = self.getIndex(indexId)
+    keySchema = self.indexKeySchema(relId, indexId)
+    if indexDb is None or keySchema is None:
+      raise ValueError("Invalid index for a range scan on relation "+str(relId))
+
+    encoder   = self.keyEncoder(indexId)
+    ordered   = self.orderedIndex(indexDb)
+    bounds    = self.keyRange(indexId, low, high, lowInclusive, highInclusive)
+    if bounds is not None:
+      (low, high, lowInclusive, highInclusive) = bounds
+
+    aboveLow  = lambda v: low is None or v > low or (lowInclusive and v == low)
+    belowHigh = lambda v: high is None or v < high or (highInclusive and v == high)
+
+    crsr = indexDb.cursor(txn=self.transaction())
+    try:
+      if ordered and bounds is not None:
+        entry = crsr.set_range(encoder.encodePrefix([low])) if low is not None else crsr.first()
+        step  = crsr.next
+      elif bounds is not None and self.seekableRange(relId, indexId, low, high, lowInclusive, highInclusive):
+        entry = crsr.set(encoder.encode([low]))
+        step  = crsr.next_dup
+      else:
+        entry = crsr.first()
+        step  = crsr.next
+
+      while entry:
+        value = encoder.decode(entry[0])[0]
+        if not belowHigh(value):
+          if ordered:
+            break
+        elif aboveLow(value):
+          yield (encoder.toPacked(entry[0]), entry[1])
+        entry = step()
+    finally:
+      crsr.close()
+
+  # Bitmap evaluation methods.
+
+  # Returns the bitmap indexes of a relation over a single attribute, as a dictionary
+  # from the attribute to the index id.
+  def bitmapIndexes(self, relId):
+    return dict((keySchema.fields[0], indexId) for (keySchema, _, indexId) in self.indexes(relId) \
+                  if len(keySchema.fields) == 1 and isinstance(self.getIndex(indexId), BitmapIndex))
+
+  # Returns the bitmap of the tuples with the given key, packed with its key schema.
+  def bitmapLookup(self, indexId, keyData):
+    indexDb = self.getIndex(indexId)
+    if not isinstance(indexDb, BitmapIndex):
+      raise ValueError("Invalid bitmap index: "+str(indexId))
+    return indexDb.bitmap(self.keyEncoder(indexId).fromPacked(keyData))
+
+  # Converts the values of a tree of equality terms, as produced by ExpressionInfo.equalityTerms,
+  # to the types of the bitmap indexes on their attributes (see KeyEncoder.convertBound).
+  # Values that no key equals, such as fractions for integer attributes, are dropped.
+  # Returns None if a term's attribute has no bitmap index, or a value cannot be encoded.
+  def bitmapTerms(self, relId, term):
+    if term[0] == 'eq':
+      indexId = self.bitmapIndexes(relId).get(term[1], None)
+      if indexId is None:
+        return None
+
+      encoder = self.keyEncoder(indexId)
+      values  = []
+      for v in term[2]:
+        converted = encoder.convertBound(v, True, True)
+        if converted is None:
+          return None
+        if converted[0] == v:
+          values.append(converted[0])
+      return ('eq', term[1], values)
+
+    terms = [self.bitmapTerms(relId, t) for t in term[1]]
+    return None if None in terms else (term[0], terms)
+
+  # Returns the bitmap of the tuples of a relation matching a tree of terms, as produced
+  # by ExpressionInfo.equalityTerms. Equality terms are answered by the bitmap indexes
+  # on their attribute, and combined with bitwise AND and OR operations.
+  def evaluateBitmaps(self, relId, term):
+    converted = self.bitmapTerms(relId, term)
+    if converted is None:
+      raise ValueError("Cannot answer terms with the bitmap indexes of "+str(relId)+": "+str(term))
+    return self.combineBitmaps(relId, converted)
+
+  def combineBitmaps(self, relId, term):
+    if term[0] == 'eq':
+      indexId   = self.bitmapIndexes(relId)[term[1]]
+      keySchema = self.indexKeySchema(relId, indexId)
+      return BitmapIndex.union([self.bitmapLookup(indexId, keySchema.pack(keySchema.instantiate(v))) \
+                                  for v in term[2]])
+
+    bitmaps = [self.combineBitmaps(relId, t) for t in term[1]]
+    return BitmapIndex.intersect(bitmaps) if term[0] == 'and' else BitmapIndex.union(bitmaps)
 
 
   # Index scan operations.
-  # These return an ordered iterator of (key, tuple id) pairs
+  # These return an ordered iterator of (key, value) pairs, where each value is a packed
+  # tuple id followed by any included attributes.
 
   # Scan over a specific index.
   def scanByIndex(self, indexId):
     indexDb = self.getIndex(indexId)
     if indexDb is not None:
-      return iter(indexDb.items())
+      encoder = self.keyEncoder(indexId)
+      return ((encoder.toPacked(key), value) for (key, value) in indexDb.items(txn=self.transaction()))
 
   # Scan over the primary index for a relation.
   def scanByKey(self, relId):
-    indexDb = self.getPrimaryIndex(relId)
-    if indexDb is not None:
-      return iter(indexDb.items())
+    if self.hasPrimaryIndex(relId):
+      _, (_, indexId), _ = self.relationIndexes[relId]
+      return self.scanByIndex(indexId)
 
 
   # Index manager serialization
@@ -543,13 +1523,23 @@ class IndexManager:
       # Convert secondaries dictionary to a list since it has an object as a key type (incompatible w/ JSON)
       pRelIndexes = list(map(lambda x: (x[0], (x[1][0], x[1][1], list(x[1][2].items()))), self.relationIndexes.items()))
       pIndexMap   = list(map(lambda entry: (entry[0], entry[1].get_dbname()), self.indexMap.items()))
-      return json.dumps((self.indexDir, self.indexCounter, pRelIndexes, pIndexMap), cls=DBSchemaEncoder)
+      pIndexMap  += list(map(lambda entry: (entry[0], (entry[1], None)), self.pendingIndexes.items()))
+      pOptions    = list(self.indexOptions.items())
+      pIncludes   = list(self.indexIncludes.items())
+      return json.dumps((self.indexDir, self.indexCounter, pRelIndexes, pIndexMap, pOptions, pIncludes), cls=DBSchemaEncoder)
 
+  # Runtime options not stored in the checkpoint (e.g., 'indexType') may be passed as keyword arguments.
   @classmethod
-  def unpack(cls, buffer):
+  def unpack(cls, buffer, **kwargs):
     args = json.loads(buffer, cls=DBSchemaDecoder)
     if len(args) == 4:
-      return cls(indexDir=args[0], indexCounter=args[1], restore=(args[2], args[3]))
+      return cls(indexDir=args[0], indexCounter=args[1], restore=(args[2], args[3]), **kwargs)
+    elif len(args) == 5:
+      return cls(indexDir=args[0], indexCounter=args[1], restore=(args[2], args[3]), \
+                 indexOptions=dict(args[4]), **kwargs)
+    elif len(args) == 6:
+      return cls(indexDir=args[0], indexCounter=args[1], restore=(args[2], args[3]), \
+                 indexOptions=dict(args[4]), indexIncludes=dict(args[5]), **kwargs)
 
 
 if __name__ == "__main__":
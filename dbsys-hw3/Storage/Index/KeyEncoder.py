@@ -0,0 +1,165 @@
+import math
+from struct         import Struct, error as StructError
+from Catalog.Schema import DBSchema, Types
+
+class KeyEncoder:
+  """
+  An order-preserving binary encoding for index keys.
+
+  Keys packed with a schema's native struct representation do not sort bytewise in
+  the order of their values, since integers and floating point numbers are stored
+  little-endian and in two's complement or IEEE sign-magnitude form. This encoder
+  packs each key attribute so that a bytewise comparison of encoded keys matches
+  the comparison of their values, attribute by attribute:
+
+  - integers are stored big-endian, with their sign bit flipped.
+  - floats and doubles are stored big-endian, with the sign bit flipped for positive
+    values, and all bits flipped for negative values.
+  - character sequences are stored as their bytes, padded with zeros to their declared
+    length. The padding acts as a terminator, ordering a string before its extensions.
+
+  Encoded keys have a fixed size, with no alignment padding between attributes.
+  Thus BerkeleyDB's default bytewise comparison, and that of our B+-trees, order
+  composite keys correctly without any comparison callback.
+
+  >>> keySchema = DBSchema('key', [('a', 'int'), ('b', 'double'), ('c', 'char(4)')])
+  >>> encoder   = KeyEncoder(keySchema)
+  >>> encoder.size
+  16
+
+  >>> keys = [(i, d, s) for i in [-300, -1, 0, 1, 256] for d in [-2.5, -0.0, 1e-3, 7.0] for s in ['', 'a', 'ab', 'b']]
+  >>> sorted(keys, key=encoder.encode) == sorted(keys)
+  True
+
+  >>> encoder.decode(encoder.encode((-300, -2.5, 'ab')))
+  [-300, -2.5, 'ab']
+
+  # Conversion from and to the schema's native binary representation.
+  >>> packed = keySchema.pack(keySchema.instantiate(42, 0.5, 'xy'))
+  >>> encoder.toPacked(encoder.fromPacked(packed)) == packed
+  True
+
+  # Prefixes of a key encode its leading attributes.
+  >>> encoder.encode((5, 1.0, 'z')).startswith(encoder.encodePrefix([5]))
+  True
+
+  # Range bounds are converted to the type of the leading attribute, rounding fractional
+  # bounds on integers towards the inside of the range. Bounds that cannot be encoded
+  # are rejected.
+  >>> (encoder.convertBound(2.5, False, True), encoder.convertBound(2.5, False, False))
+  ((3, True), (2, True))
+
+  >>> (encoder.convertBound(3.0, False, True), encoder.convertBound('x', True, True), encoder.convertBound(1e20, True, False))
+  ((3, False), None, None)
+  """
+
+  # Struct formats of the encoded representation, and the width in bits of numeric types.
+  integerTypes = { 'byte': ('B', 0), 'short': ('H', 16), 'int': ('I', 32) }
+  floatTypes   = { 'float': ('f', 'I', 32), 'double': ('d', 'Q', 64) }
+
+  def __init__(self, keySchema):
+    self.keySchema = keySchema
+    self.formats   = []
+    self.encoders  = []
+    self.decoders  = []
+
+    for typeDesc in keySchema.types:
+      typeStr = Types.parseType(typeDesc)["typeStr"]
+      if typeStr in KeyEncoder.integerTypes:
+        (format, bits) = KeyEncoder.integerTypes[typeStr]
+        (encoder, decoder) = self.integerCodec(bits)
+      elif typeStr in KeyEncoder.floatTypes:
+        (floatFormat, format, bits) = KeyEncoder.floatTypes[typeStr]
+        (encoder, decoder) = self.floatCodec(floatFormat, format, bits)
+      elif typeStr in ['char', 'text']:
+        format = Types.formatType(typeDesc)
+        (encoder, decoder) = (self.stringEncoder, None)
+      else:
+        raise ValueError("Unsupported index key type: "+str(typeDesc))
+
+      self.formats.append(format)
+      self.encoders.append(encoder)
+      self.decoders.append(decoder)
+
+    self.binrepr  = Struct('>' + ''.join(self.formats))
+    self.size     = self.binrepr.size
+    self.prefixes = {}
+
+  # Returns the encoding and decoding functions of a signed integer type.
+  # Unsigned types (with a zero bit width) are stored as is.
+  def integerCodec(self, bits):
+    if bits == 0:
+      return (None, None)
+    bias = 1 << (bits - 1)
+    return (lambda v: v + bias, lambda v: v - bias)
+
+  # Returns the encoding and decoding functions of a floating point type,
+  # operating on the IEEE representation of the value as an unsigned integer.
+  def floatCodec(self, floatFormat, intFormat, bits):
+    floatRepr = Struct('>' + floatFormat)
+    intRepr   = Struct('>' + intFormat)
+    signBit   = 1 << (bits - 1)
+    allBits   = (1 << bits) - 1
+
+    def encode(value):
+      u = intRepr.unpack(floatRepr.pack(value))[0]
+      return u ^ allBits if u & signBit else u | signBit
+
+    def decode(u):
+      u = u ^ signBit if u & signBit else u ^ allBits
+      return floatRepr.unpack(intRepr.pack(u))[0]
+
+    return (encode, decode)
+
+  def stringEncoder(self, value):
+    return value.encode() if isinstance(value, str) else value
+
+  # Encodes a sequence of attribute values, as Python values or those of the schema's struct.
+  def encode(self, values):
+    return self.binrepr.pack(*[f(v) if f else v for (f, v) in zip(self.encoders, values)])
+
+  # Encodes the values of the leading attributes of a key, for use as a search prefix.
+  def encodePrefix(self, values):
+    n = len(values)
+    if n not in self.prefixes:
+      self.prefixes[n] = Struct('>' + ''.join(self.formats[:n]))
+    return self.prefixes[n].pack(*[f(v) if f else v for (f, v) in zip(self.encoders, values)])
+
+  # Converts a range bound on the leading key attribute to the attribute's type, returning
+  # the converted bound and whether it is inclusive, or None if it cannot be encoded.
+  # Fractional bounds on integer attributes are rounded up for low bounds and down for
+  # high bounds, and become inclusive.
+  def convertBound(self, value, inclusive, lower):
+    try:
+      if Types.parseType(self.keySchema.types[0])["typeStr"] in KeyEncoder.integerTypes:
+        if not isinstance(value, (int, float)):
+          return None
+        if value != int(value):
+          (value, inclusive) = (math.ceil(value) if lower else math.floor(value), True)
+        value = int(value)
+      self.encodePrefix([value])
+    except (StructError, TypeError, ValueError, OverflowError):
+      return None
+    return (value, inclusive)
+
+  # Decodes an encoded key into a list of attribute values in the schema's struct form,
+  # that is with character sequences as zero-padded bytes.
+  def decodeRaw(self, data):
+    return [f(v) if f else v for (f, v) in zip(self.decoders, self.binrepr.unpack(data))]
+
+  # Decodes an encoded key into a list of Python attribute values.
+  def decode(self, data):
+    return [Types.formatValue(v, t, False) for (v, t) in zip(self.decodeRaw(data), self.keySchema.types)]
+
+  # Converts a key packed with the key schema into its encoded form.
+  def fromPacked(self, packedKey):
+    return self.encode(self.keySchema.binrepr.unpack(packedKey))
+
+  # Converts an encoded key into the key schema's packed form.
+  def toPacked(self, data):
+    return self.keySchema.binrepr.pack(*self.decodeRaw(data))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
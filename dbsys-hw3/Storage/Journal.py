@@ -0,0 +1,121 @@
+import os, os.path, zlib
+from struct import Struct
+
+class PageJournal:
+  """
+  A redo journal of page images, for writing a group of pages atomically.
+
+  Before a group of pages is written in place, the images of all its pages are written
+  to the journal with the group's commit sequence number, and forced to disk. Should
+  the in-place writes be interrupted, replaying the journal completes them. The journal
+  holds a single group, and is cleared once the group's pages are on disk.
+
+  A journal ends with a checksum of its contents, thus a journal whose own write was
+  interrupted is not read back.
+
+  >>> import tempfile
+  >>> journal = PageJournal(path=os.path.join(tempfile.mkdtemp(), 'db.journal'))
+  >>> journal.read() is None
+  True
+
+  >>> journal.write(7, [(0, 1, b'abcd'), (2, 0, b'efgh')])
+  >>> journal.read()
+  (7, [(0, 1, b'abcd'), (2, 0, b'efgh')])
+
+  # A torn journal write is ignored.
+  >>> with open(journal.path, 'r+b') as f:
+  ...   _ = f.truncate(os.path.getsize(journal.path) - 1)
+  >>> journal.read() is None
+  True
+
+  >>> journal.clear()
+  >>> os.path.exists(journal.path)
+  False
+  """
+
+  magic = b"PJNL"
+
+  # Binary representation of the journal's header (its magic number, sequence number and
+  # number of pages), of each page's file index, page index and image length, and of
+  # the trailing checksum.
+  headerRepr  = Struct("=4sQI")
+  recordRepr  = Struct("=IIQ")
+  trailerRepr = Struct("=I")
+
+  def __init__(self, **kwargs):
+    other = kwargs.get("other", None)
+    if other:
+      self.fromOther(other)
+
+    else:
+      self.path = kwargs.get("path", None)
+      if self.path is None:
+        raise ValueError("No file path given for a page journal")
+
+  def fromOther(self, other):
+    self.path = other.path
+
+  # Writes a group of (file index, page index, page image) triples to the journal,
+  # returning once the journal is on disk.
+  def write(self, sequence, images):
+    chunks = [PageJournal.headerRepr.pack(PageJournal.magic, sequence, len(images))]
+    for (fileIndex, pageIndex, image) in images:
+      chunks.append(PageJournal.recordRepr.pack(fileIndex, pageIndex, len(image)))
+      chunks.append(bytes(image))
+
+    data = b''.join(chunks)
+    with open(self.path, 'wb') as f:
+      f.write(data + PageJournal.trailerRepr.pack(zlib.crc32(data)))
+      f.flush()
+      os.fsync(f.fileno())
+    self.syncDirectory()
+
+  # Returns the journal's sequence number and page images, or None if there is
+  # no complete journal.
+  def read(self):
+    if not os.path.exists(self.path):
+      return None
+
+    with open(self.path, 'rb') as f:
+      data = f.read()
+
+    trailerSize = PageJournal.trailerRepr.size
+    if len(data) < PageJournal.headerRepr.size + trailerSize:
+      return None
+
+    (body, trailer) = (data[:-trailerSize], data[-trailerSize:])
+    if PageJournal.trailerRepr.unpack(trailer)[0] != zlib.crc32(body):
+      return None
+
+    (magic, sequence, count) = PageJournal.headerRepr.unpack_from(body)
+    if magic != PageJournal.magic:
+      return None
+
+    images = []
+    offset = PageJournal.headerRepr.size
+    for _ in range(count):
+      (fileIndex, pageIndex, length) = PageJournal.recordRepr.unpack_from(body, offset)
+      offset += PageJournal.recordRepr.size
+      images.append((fileIndex, pageIndex, body[offset:offset+length]))
+      offset += length
+
+    return (sequence, images)
+
+  # Removes the journal once its pages are on disk.
+  def clear(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+      self.syncDirectory()
+
+  # Forces the creation or removal of the journal file to disk.
+  def syncDirectory(self):
+    fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+    try:
+      os.fsync(fd)
+    finally:
+      os.close(fd)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
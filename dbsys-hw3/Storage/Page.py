@@ -11,7 +11,8 @@ class PageHeader:
 
   This includes the page's flags (e.g., whether the page is dirty), as well as
   the tuple size for a page, the free space offset within a page and the
-  page's capacity.
+  page's capacity. Offsets and capacities are stored as unsigned ints, allowing
+  pages larger than 64KB.
 
   This simple page header supports only fixed-size tuples, and a write-once
   implementation of pages by using only a free space offset. That is, the
@@ -73,7 +74,7 @@ class PageHeader:
 
   >>> tuplesToTest = 10
   >>> [ph.nextFreeTuple() for i in range(0,tuplesToTest)]
-  [24, 40, 56, 72, 88, 104, 120, 136, 152, 168]
+  [28, 44, 60, 76, 92, 108, 124, 140, 156, 172]
 
   >>> ph.numTuples() == tuplesToTest+1
   True
@@ -92,7 +93,7 @@ class PageHeader:
 
   # Fill the page.
   >>> [ph.nextFreeTuple() for i in range(0, remainingTuples)] # doctest:+ELLIPSIS
-  [184, 200, ..., 4072]
+  [188, 204, ..., 4076]
 
   >>> ph.hasFreeTuple()
   False
@@ -103,9 +104,15 @@ class PageHeader:
 
   >>> ph.freeSpace() < ph.tupleSize
   True
+
+  # Large pages are supported by the header.
+  >>> bigBuffer = io.BytesIO(bytes(1 << 20))
+  >>> ph4       = PageHeader(buffer=bigBuffer.getbuffer(), tupleSize=16)
+  >>> PageHeader.unpack(bigBuffer.getbuffer()).pageCapacity
+  1048576
   """
 
-  binrepr   = struct.Struct("cHHH") # char + 3 unsigned shorts
+  binrepr   = struct.Struct("cHII") # char + unsigned short tuple size + 2 unsigned ints
   size      = binrepr.size
 
   # Flag bitmasks
@@ -181,6 +188,10 @@ class PageHeader:
   def numTuples(self):
     return int(self.usedSpace() / self.tupleSize)
 
+  # Returns the maximum number of tuples that can be held in this page.
+  def maxTuples(self):
+    return math.floor((self.pageCapacity - self.dataOffset()) / self.tupleSize)
+
   # Tuple index for a given offset
   def tupleIndex(self, offset):
     return math.floor((offset - self.dataOffset()) / self.tupleSize)
@@ -272,6 +283,12 @@ class PageHeader:
   def useTuple(self, tupleId):
     self.useTupleIndex(tupleId.tupleIndex)
 
+  # Marks the tuples with indexes in the range [start, end) as used, e.g., once a
+  # page writer has filled them in order.
+  def useTupleRange(self, start, end):
+    if start < end:
+      self.useTupleIndex(end - 1)
+
   # Marks the tuple as being free.
   # In a contiguous tuple, all tuples after the given tuple id become free.
   def resetTupleIndex(self, tupleIndex):
@@ -380,6 +397,9 @@ class Page(BytesIO):
   >>> [schema.unpack(tup).age for tup in p]
   [28, 20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
 
+  >>> [tId.tupleIndex for tId in p.tupleIds()]
+  [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+
   # Test clearing of first tuple
   >>> tId = TupleId(p.pageId, 0)
   >>> sizeBeforeClear = p.header.usedSpace()
@@ -449,6 +469,10 @@ class Page(BytesIO):
   def __iter__(self):
     return PageTupleIterator(self)
 
+  # Returns the tuple ids of all tuples present in the page.
+  def tupleIds(self):
+    return [TupleId(self.pageId, i) for i in range(self.header.numTuples())]
+
   # Dirty bit accessors
   def isDirty(self):
     return self.header.isDirty()
@@ -75,13 +75,19 @@ class SlottedPageHeader(PageHeader):
 
   >>> ph.freeSpace() < ph.tupleSize
   True
+
+  # Slot counts may exceed an unsigned short on large pages.
+  >>> bigBuffer = io.BytesIO(bytes(1 << 20))
+  >>> ph3       = SlottedPageHeader(buffer=bigBuffer.getbuffer(), tupleSize=8)
+  >>> SlottedPageHeader.unpack(bigBuffer.getbuffer()).numSlots == ph3.numSlots > 65535
+  True
   """
 
   # # Slots are two unsigned shorts: slot offset and slot data length
   # slotRepr    = Struct("HH")
   # slotSize    = slotRepr.size
 
-  prefixFmt   = "H"
+  prefixFmt   = "I"
   prefixRepr  = struct.Struct(prefixFmt)
 
   def __init__(self, **kwargs):
@@ -342,6 +348,23 @@ class SlottedPageHeader(PageHeader):
     self.setSlot(tupleIndex, True)
     super().useTupleIndex(tupleIndex)
 
+  # Marks a range of tuples as being used, setting whole bytes of the slot
+  # bitvector at once where possible.
+  def useTupleRange(self, start, end):
+    i = start
+    while i < end and i % 8:
+      self.setSlot(i, True)
+      i += 1
+
+    fullEnd = end - (end % 8)
+    if i < fullEnd:
+      self.slots[i >> 3 : fullEnd >> 3] = b'\xff' * ((fullEnd - i) >> 3)
+
+    for j in range(max(i, fullEnd), end):
+      self.setSlot(j, True)
+
+    super().useTupleRange(start, end)
+
   # Marks the tuple as being free.
   # In a slotted page, we reset the given slot. Note we do not update the
   # parent's freeSpaceOffset since the tuple's validity is overriden by the slot.
@@ -354,7 +377,7 @@ class SlottedPageHeader(PageHeader):
 
   @classmethod
   def binrepr(cls, buffer):
-    lenStruct    = Struct("H")
+    lenStruct    = SlottedPageHeader.prefixRepr
     numSlots     = lenStruct.unpack_from(buffer, offset=PageHeader.size)[0]
     slotArrayLen = numSlots >> 3
     if numSlots % 8 != 0:
@@ -465,6 +488,9 @@ class SlottedPage(Page):
   >>> [schema.unpack(tup).age for tup in p]
   [20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
 
+  >>> [tId.tupleIndex for tId in p.tupleIds()]
+  [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+
   # Check that the page's slots have tracked the deletion.
   >>> p.header.usedSpace() == (sizeBeforeRemove - p.header.tupleSize)
   True
@@ -500,6 +526,10 @@ class SlottedPage(Page):
   def __iter__(self):
     return SlottedPageTupleIterator(self)
 
+  # Returns the tuple ids of all tuples present in the page, based on its used slots.
+  def tupleIds(self):
+    return [TupleId(self.pageId, i) for i in self.header.usedSlots()]
+
   # Override contiguous page's deleteTuple to prevent it shifting data.
   def deleteTuple(self, tupleId):
     if self.header and tupleId:
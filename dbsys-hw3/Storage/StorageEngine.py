@@ -1,3 +1,4 @@
+from Catalog.Identifiers import TupleId
 from Catalog.Schema      import DBSchema
 from Storage.FileManager import FileManager
 from Storage.BufferPool  import BufferPool
@@ -10,6 +11,13 @@ class StorageEngine:
   based on the functionality provided by the buffer pool, file manager and
   the remaining components of the storage engine.
 
+  With the 'memoryBudget' keyword argument, the storage engine splits a number of bytes
+  between the buffer pool, the BerkeleyDB cache of its indexes, and operator work memory,
+  according to the fractions of the 'memorySplit' keyword argument. Work memory bounds
+  the pages pinned by operators for their blocks (e.g., in block nested loops joins) and
+  the entries sorted in memory when building an index. Memory may be moved between the
+  buffer pool and the index cache at runtime with rebalanceMemory.
+
   >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
 
   >>> storage = StorageEngine()
@@ -28,16 +36,146 @@ class StorageEngine:
   >>> [schema.unpack(tup).id for tup in storage.tuples(schema.name)] == list(range(20))
   True
 
+  # Test vacuuming after deleting most of a relation's tuples.
+  >>> from Catalog.Identifiers import TupleId
+  >>> keySchema = DBSchema('employeeKey', [('id', 'int')])
+  >>> storage.createRelation('churn', schema)
+  >>> indexId = storage.createIndex('churn', schema, keySchema, True)
+  >>> tupleIds = [storage.insertTuple('churn', schema.pack(schema.instantiate(i, i))) for i in range(2000)]
+  >>> for tupleId in reversed(tupleIds[:1500]):
+  ...    storage.deleteTuple('churn', tupleId)
+
+  >>> (numPages, numTuples, density) = storage.densityReport(['churn'])['churn']
+  >>> (numPages, numTuples, density < 0.5)
+  (2, 500, True)
+
+  >>> (numPages, numTuples, density) = storage.vacuum('churn')
+  >>> (numPages, numTuples, density > 0.4)
+  (1, 500, True)
+
+  >>> sorted([schema.unpack(tup).id for tup in storage.tuples('churn')]) == list(range(1500, 2000))
+  True
+
+  # Index entries refer to the relocated tuples.
+  >>> def lookup(i):
+  ...   keyData = keySchema.pack(keySchema.instantiate(i))
+  ...   tupleId = next(storage.fileMgr.lookupByIndex('churn', indexId, keyData))
+  ...   return schema.unpack(storage.bufferPool.getPage(tupleId.pageId).getTuple(tupleId)).id
+  >>> all(lookup(i) == i for i in range(1500, 2000))
+  True
+
+  # Test batched insertion and update, maintaining the index once per batch.
+  >>> batchIds = storage.insertTuples('churn', [schema.pack(schema.instantiate(i, i)) for i in range(2000, 2100)])
+  >>> storage.updateTuples('churn', [(tupleId, schema.pack(schema.instantiate(i+100, i))) \
+                                       for (i, tupleId) in zip(range(2000, 2100), batchIds)])
+  >>> all(lookup(i) == i for i in range(2100, 2200))
+  True
+
+  >>> storage.deleteTuples('churn', batchIds[50:])
+  >>> sorted([schema.unpack(tup).id for tup in storage.tuples('churn')]) == list(range(1500, 2000)) + list(range(2100, 2150))
+  True
+
+  # Test clustering a relation on its primary key.
+  >>> import random
+  >>> storage.createRelation('clustered', schema, clustered=True)
+  >>> clusterId = storage.createIndex('clustered', schema, keySchema, True, indexType='btree')
+  >>> ids = list(range(-1000, 3000, 2))
+  >>> random.shuffle(ids)
+  >>> _ = storage.insertTuples('clustered', [schema.pack(schema.instantiate(i, i)) for i in ids])
+  >>> keyOrder = lambda: [keySchema.unpack(k).id for (k, _) in storage.fileMgr.indexManager.scanByIndex(clusterId)]
+
+  # A batch is inserted in key order, so the relation starts out clustered.
+  >>> [schema.unpack(tup).id for tup in storage.tuples('clustered')] == keyOrder()
+  True
+
+  >>> (numPages, numTuples, _) = storage.clusterRelation('clustered', fillFactor=0.8)
+  >>> (numPages, numTuples)
+  (3, 2000)
+
+  >>> [schema.unpack(tup).id for tup in storage.tuples('clustered')] == keyOrder() == sorted(ids)
+  True
+
+  # New tuples are placed on the page of their successor in key order.
+  >>> def clusterLookup(i):
+  ...   keyData = keySchema.pack(keySchema.instantiate(i))
+  ...   return next(storage.fileMgr.lookupByIndex('clustered', clusterId, keyData))
+  >>> tupleId = storage.insertTuple('clustered', schema.pack(schema.instantiate(1001, 0)))
+  >>> tupleId.pageId == clusterLookup(1002).pageId == clusterLookup(1001).pageId
+  True
+
+  # Batches are inserted in key order, next to their successors.
+  >>> batch = [1009, 1003, 1007, 1005]
+  >>> _ = storage.insertTuples('clustered', [schema.pack(schema.instantiate(i, 0)) for i in batch])
+  >>> [i for i in (schema.unpack(tup).id for tup in storage.tuples('clustered')) if i in batch]
+  [1003, 1005, 1007, 1009]
+
+  >>> all(clusterLookup(i).pageId == clusterLookup(i + 1).pageId for i in batch)
+  True
+
+  # Test asynchronous table scan
+  >>> import asyncio
+  >>> async def asyncScan():
+  ...   return [schema.unpack(tup).id async for (_, page) in storage.pagesAsync(schema.name) for tup in page]
+  >>> asyncio.run(asyncScan()) == list(range(20))
+  True
+
+  # Test a memory budget, moving memory to the buffer pool while a scan misses it.
+  >>> import shutil
+  >>> budgeted = StorageEngine(dataDir='budget/', memoryBudget=1 << 20)
+  >>> shares = budgeted.memoryShares()
+  >>> (shares['bufferPool'], shares['indexCache'], shares['workMemory'])
+  (629145, 262144, 157286)
+
+  >>> budgeted.workMemoryPages()
+  19
+
+  >>> budgeted.createRelation(schema.name, schema)
+  >>> _ = budgeted.insertTuples(schema.name, [schema.pack(schema.instantiate(i, i)) for i in range(100000)])
+  >>> for _ in range(2):
+  ...   _ = sum(1 for _ in budgeted.pages(schema.name))
+  >>> budgeted.bufferPool.misses > 0
+  True
+
+  >>> shares = budgeted.rebalanceMemory()
+  >>> (shares['bufferPool'], shares['indexCache'])
+  (679936, 209716)
+
+  >>> budgeted.close()
+  >>> shutil.rmtree('budget/')
+
   """
 
+  # Memory budgets: the default fractions of the budget for the buffer pool, the index
+  # cache and work memory, the fraction of the budget moved by each rebalancing, and the
+  # fraction the buffer pool and index cache keep at least.
+  defaultMemorySplit = (0.6, 0.25, 0.15)
+  rebalanceStep      = 0.05
+  minMemoryShare     = 0.1
+
   def __init__(self, **kwargs):
     other = kwargs.get("other", None)
     if other:
       self.fromOther(other)
 
     else:
-      bpArgs          = {k:v for (k,v) in kwargs.items() if k in ["pageSize", "poolSize"]}
-      fmArgs          = {k:v for (k,v) in kwargs.items() if k in ["pageSize", "dataDir", "indexDir"]}
+      bpArgs          = {k:v for (k,v) in kwargs.items() if k in ["pageSize", "poolSize", "ioThreads"]}
+      fmArgs          = {k:v for (k,v) in kwargs.items() \
+                           if k in ["pageSize", "dataDir", "indexDir", "directIO", "indexType", "transactional", "groupCommitSize"]}
+
+      self.memoryBudget = kwargs.get("memoryBudget", None)
+      self.workMemory   = None
+      self.cacheMisses  = (0, 0)    # Buffer pool and index cache misses at the last rebalancing
+
+      if self.memoryBudget:
+        split = kwargs.get("memorySplit", StorageEngine.defaultMemorySplit)
+        if len(split) != 3 or any(f <= 0 for f in split) or sum(split) > 1.0 + 1e-9:
+          raise ValueError("Invalid memory split, expected buffer pool, index cache and work memory fractions")
+
+        (poolSize, cacheSize, workMemory) = [int(self.memoryBudget * f) for f in split]
+        bpArgs.update(poolSize=poolSize, maxPoolSize=poolSize + cacheSize)
+        fmArgs.update(indexCacheSize=cacheSize, maxIndexCacheSize=poolSize + cacheSize)
+        self.workMemory = workMemory
+
       self.bufferPool = BufferPool(**bpArgs)
       self.fileMgr    = FileManager(bufferPool=self.bufferPool, **fmArgs)
 
@@ -45,13 +183,19 @@ class StorageEngine:
         self.bufferPool.setFileManager(self.fileMgr)
 
   def fromOther(self, other):
-    self.bufferPool = other.bufferPool
-    self.fileMgr    = other.fileMgr
+    self.bufferPool   = other.bufferPool
+    self.fileMgr      = other.fileMgr
+    self.memoryBudget = other.memoryBudget
+    self.workMemory   = other.workMemory
+    self.cacheMisses  = other.cacheMisses
 
   def close(self):
     if self.fileMgr:
       self.fileMgr.close()
 
+    if self.bufferPool:
+      self.bufferPool.shutdownIO()
+
   # Data definition operations
 
   def relations(self):
@@ -62,9 +206,9 @@ class StorageEngine:
     if self.fileMgr:
       return self.fileMgr.hasRelation(relId)
 
-  def createRelation(self, relId, schema):
+  def createRelation(self, relId, schema, **kwargs):
     if self.fileMgr:
-      self.fileMgr.createRelation(relId, schema)
+      self.fileMgr.createRelation(relId, schema, **kwargs)
     else:
       raise ValueError("Could not create relation, no file manager found")
 
@@ -88,9 +232,12 @@ class StorageEngine:
     if self.fileMgr:
       return self.fileMgr.hasIndex(relId, keySchema)
 
-  def createIndex(self, relId, relSchema, keySchema, primary):
+  # Index builds sort as many entries in memory as fit in work memory, if any.
+  def createIndex(self, relId, relSchema, keySchema, primary, **kwargs):
     if self.fileMgr:
-      return self.fileMgr.createIndex(relId, relSchema, keySchema, primary)
+      if self.workMemory and kwargs.get("build", False) and "runSize" not in kwargs:
+        kwargs["runSize"] = max(1, self.workMemory // (keySchema.size + TupleId.size))
+      return self.fileMgr.createIndex(relId, relSchema, keySchema, primary, **kwargs)
 
   def addIndex(self, relId, relSchema, keySchema, primary, indexId, indexDb):
     if self.fileMgr:
@@ -104,6 +251,84 @@ class StorageEngine:
     if self.fileMgr:
       return self.fileMgr.getIndex(indexId)
 
+  # Creates a Bloom filter over a relation's lookup or join key.
+  def createBloomFilter(self, relId, keySchema, **kwargs):
+    if self.fileMgr:
+      self.fileMgr.createBloomFilter(relId, keySchema, **kwargs)
+    else:
+      raise ValueError("Could not create Bloom filter, no file manager found")
+
+
+  # Relation maintenance operations
+
+  # Vacuums a relation, returning its density report after compaction.
+  def vacuum(self, relId):
+    if self.fileMgr:
+      return self.fileMgr.vacuum(relId)
+    else:
+      raise ValueError("Could not vacuum relation, no file manager found")
+
+  # Reorganizes a relation in primary key order, keeping later insertions near their neighbours.
+  def clusterRelation(self, relId, fillFactor=1.0):
+    if self.fileMgr:
+      return self.fileMgr.clusterRelation(relId, fillFactor)
+    else:
+      raise ValueError("Could not cluster relation, no file manager found")
+
+  # Commits all tuple operations since the last commit, in transactional mode.
+  def commit(self):
+    if self.fileMgr:
+      self.fileMgr.commit()
+
+  # Returns density reports, as (pages, tuples, fraction of capacity used), per relation.
+  def densityReport(self, relIds=None):
+    if self.fileMgr:
+      return self.fileMgr.densityReport(relIds)
+
+
+  # Memory management
+
+  # Returns the bytes held by the buffer pool, index cache and work memory.
+  # The index cache and work memory sizes are None without a memory budget.
+  def memoryShares(self):
+    return {"bufferPool": self.bufferPool.size(),
+            "indexCache": self.fileMgr.indexManager.cacheSize if self.fileMgr else None,
+            "workMemory": self.workMemory}
+
+  # Returns the number of buffer pool pages operators may hold as work memory,
+  # or None without a memory budget.
+  def workMemoryPages(self):
+    if self.workMemory is not None:
+      return max(1, self.workMemory // self.bufferPool.pageSize)
+
+  # Moves a step of the memory budget between the buffer pool and the index cache,
+  # towards the one with more misses since the last rebalancing, provided the other
+  # keeps its minimum share. Misses rather than hit rates are compared, since each
+  # miss is an I/O that more memory may save. Returns the resulting memory shares.
+  def rebalanceMemory(self):
+    if not self.memoryBudget:
+      raise ValueError("Could not rebalance memory, no memory budget found")
+
+    indexManager      = self.fileMgr.indexManager
+    misses            = (self.bufferPool.misses, indexManager.cacheStats()[1])
+    (poolMisses, cacheMisses) = (misses[0] - self.cacheMisses[0], misses[1] - self.cacheMisses[1])
+    self.cacheMisses  = misses
+
+    step      = int(self.memoryBudget * StorageEngine.rebalanceStep)
+    minimum   = int(self.memoryBudget * StorageEngine.minMemoryShare)
+    poolSize  = self.bufferPool.size()
+    cacheSize = indexManager.cacheSize
+
+    if poolMisses > cacheMisses and cacheSize - step >= minimum:
+      indexManager.setCacheSize(cacheSize - step)
+      self.bufferPool.resize(poolSize + step)
+
+    elif cacheMisses > poolMisses and poolSize - step >= minimum:
+      self.bufferPool.resize(poolSize - step)
+      indexManager.setCacheSize(cacheSize + step)
+
+    return self.memoryShares()
+
 
   # Data manipulation operations
 
@@ -126,15 +351,55 @@ class StorageEngine:
     else:
       raise ValueError("Could not update tuple, no file manager found")
 
+  # Batched tuple operations, maintaining indexes once per batch.
+  def insertTuples(self, relId, tupleDataList):
+    if self.fileMgr:
+      return self.fileMgr.insertTuples(relId, tupleDataList)
+    else:
+      raise ValueError("Could not insert tuples, no file manager found")
+
+  def deleteTuples(self, relId, tupleIds):
+    if self.fileMgr:
+      self.fileMgr.deleteTuples(relId, tupleIds)
+    else:
+      raise ValueError("Could not delete tuples, no file manager found")
+
+  def updateTuples(self, relId, updates):
+    if self.fileMgr:
+      self.fileMgr.updateTuples(relId, updates)
+    else:
+      raise ValueError("Could not update tuples, no file manager found")
+
   # Tuple-based table scan
   def tuples(self, relId):
     if self.fileMgr:
       return self.fileMgr.tuples(relId)
 
-  # Page-based table scan
-  def pages(self, relId):
+  # Page-based table scan, optionally skipping pages rejected by a filter on page indexes.
+  def pages(self, relId, pageFilter=None):
+    if self.fileMgr:
+      return self.fileMgr.pages(relId, pageFilter)
+
+  # Returns the per-page zone map of a relation, if it keeps one.
+  def zoneMap(self, relId):
+    if self.fileMgr:
+      return self.fileMgr.zoneMap(relId)
+
+  # Per-segment page-based table scans.
+  # Each segment's iterator may be consumed independently, e.g., by a parallel scan.
+  def segments(self, relId, pinned=False):
+    if self.fileMgr:
+      return self.fileMgr.segments(relId, pinned)
+
+  # Asynchronous page access and table scan.
+  # These allow a server to overlap the I/O of many concurrent scans and index probes.
+  async def getPageAsync(self, pageId, pinned=False):
+    if self.bufferPool:
+      return await self.bufferPool.getPageAsync(pageId, pinned)
+
+  def pagesAsync(self, relId, prefetch=8):
     if self.fileMgr:
-      return self.fileMgr.pages(relId)
+      return self.fileMgr.pagesAsync(relId, prefetch)
 
 
 if __name__ == "__main__":
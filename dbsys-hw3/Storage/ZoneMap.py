@@ -0,0 +1,119 @@
+import pickle
+from Catalog.Schema import DBSchema, Types
+
+class ZoneMap:
+  """
+  A zone map, summarizing the numeric attributes of a file's tuples by page.
+
+  Each page holding a tuple has a zone, with the minimum and maximum value of every
+  numeric attribute of the tuples added to the page. Zones only widen as tuples are
+  added or updated, thus they remain valid bounds after deletions and may be tightened
+  by rebuilding the map. Pages without a zone are assumed to hold any values.
+
+  Scans may skip the pages whose zones lie outside of the ranges of a predicate,
+  given as (low, lowInclusive, high, highInclusive) tuples per attribute, where an
+  unbounded end is None.
+
+  >>> schema = DBSchema('lineitem', [('id', 'int'), ('shipdate', 'int'), ('flag', 'char(1)')])
+  >>> zm = ZoneMap(schema)
+  >>> zm.fields
+  ['id', 'shipdate']
+
+  >>> for i in range(100):
+  ...   zm.addTuple(i // 10, schema.pack(schema.instantiate(i, 19940101 + i, 'A')))
+
+  >>> zm.zone(3)
+  ([30, 19940131], [39, 19940140])
+
+  >>> ranges = {'shipdate': (19940125, True, 19940145, False)}
+  >>> [pageIndex for pageIndex in range(12) if zm.pageMayMatch(pageIndex, ranges)]
+  [2, 3, 4, 10, 11]
+
+  >>> [pageIndex for pageIndex in range(10) if zm.pageMayMatch(pageIndex, {'id': (None, True, 10, False)})]
+  [0]
+
+  # Test zone map serialization.
+  >>> ZoneMap.unpack(schema, zm.pack()).zone(3)
+  ([30, 19940131], [39, 19940140])
+  """
+
+  numericTypes = ['byte', 'short', 'int', 'float', 'double']
+
+  def __init__(self, schema, **kwargs):
+    other = kwargs.get("other", None)
+    if other:
+      self.fromOther(other)
+
+    else:
+      self.schema    = schema
+      self.positions = [i for (i, t) in enumerate(schema.types) \
+                          if Types.parseType(t)["typeStr"] in ZoneMap.numericTypes]
+      self.fields    = [schema.fields[i] for i in self.positions]
+      self.zones     = kwargs.get("zones", {})
+
+  def fromOther(self, other):
+    self.schema    = other.schema
+    self.positions = other.positions
+    self.fields    = other.fields
+    self.zones     = other.zones
+
+  # Returns the (minimums, maximums) of the numeric attributes on a page, or None.
+  def zone(self, pageIndex):
+    return self.zones.get(pageIndex, None)
+
+  # Widens the zone of a page with a tuple added to it.
+  def addTuple(self, pageIndex, tupleData):
+    if self.positions:
+      values = self.schema.binrepr.unpack_from(tupleData)
+      values = [values[i] for i in self.positions]
+      zone   = self.zones.get(pageIndex, None)
+      if zone is None:
+        self.zones[pageIndex] = (values, list(values))
+      else:
+        (mins, maxs) = zone
+        for (i, v) in enumerate(values):
+          if v < mins[i]:
+            mins[i] = v
+          elif v > maxs[i]:
+            maxs[i] = v
+
+  def clear(self):
+    self.zones = {}
+
+  # Drops the zones of pages beyond the given number of pages.
+  def truncate(self, numPages):
+    self.zones = dict([(i, zone) for (i, zone) in self.zones.items() if i < numPages])
+
+  # Returns whether a page may hold tuples with attribute values in the given ranges.
+  def pageMayMatch(self, pageIndex, ranges):
+    zone = self.zones.get(pageIndex, None)
+    if zone is None or not ranges:
+      return True
+
+    (mins, maxs) = zone
+    for (i, field) in enumerate(self.fields):
+      if field in ranges:
+        (low, lowInclusive, high, highInclusive) = ranges[field]
+        if low is not None and (maxs[i] < low or (maxs[i] == low and not lowInclusive)):
+          return False
+        if high is not None and (mins[i] > high or (mins[i] == high and not highInclusive)):
+          return False
+    return True
+
+
+  # Zone map serialization
+  def pack(self):
+    return pickle.dumps((self.fields, self.zones))
+
+  @classmethod
+  def unpack(cls, schema, buffer):
+    (fields, zones) = pickle.loads(buffer)
+    zoneMap = cls(schema, zones=zones)
+    if zoneMap.fields != fields:
+      raise ValueError("Invalid zone map for schema " + schema.name)
+    return zoneMap
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
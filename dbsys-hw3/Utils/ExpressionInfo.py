@@ -41,3 +41,153 @@ class ExpressionInfo(ast.NodeVisitor):
 
   def isAttribute(self):
     return self.onlyNames
+
+  # Returns the range of values of an attribute implied by the comparisons of the
+  # attribute with constants in the expression's conjuncts, as a tuple of
+  # (low, lowInclusive, high, highInclusive) where an unbounded end is None.
+  # Returns None if no conjunct restricts the attribute.
+  def attributeRange(self, attribute):
+    bounds  = []
+    pending = [ast.parse(self.expr).body[0].value]
+    while pending:
+      conjunct = pending.pop()
+      if isinstance(conjunct, ast.BoolOp) and isinstance(conjunct.op, ast.And):
+        pending.extend(conjunct.values)
+
+      elif isinstance(conjunct, ast.Compare):
+        operands = [conjunct.left] + conjunct.comparators
+        for (left, op, right) in zip(operands, conjunct.ops, operands[1:]):
+          bound = self.comparisonBound(attribute, left, op, right)
+          if bound:
+            bounds.extend(bound)
+
+    if not bounds:
+      return None
+
+    (low, lowInclusive, high, highInclusive) = (None, True, None, True)
+    for (side, value, inclusive) in bounds:
+      if side == 'low' and (low is None or value > low or (value == low and not inclusive)):
+        (low, lowInclusive) = (value, inclusive)
+      elif side == 'high' and (high is None or value < high or (value == high and not inclusive)):
+        (high, highInclusive) = (value, inclusive)
+    return (low, lowInclusive, high, highInclusive)
+
+  # Returns the bounds, as (side, value, inclusive) triples, of a single comparison
+  # between the attribute and a constant, or None for any other comparison.
+  def comparisonBound(self, attribute, left, op, right):
+    flipped = { ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq }
+    opType  = type(op)
+    if opType not in flipped:
+      return None
+
+    if isinstance(right, ast.Name) and right.id == attribute:
+      (left, right, opType) = (right, left, flipped[opType])
+
+    if not(isinstance(left, ast.Name) and left.id == attribute):
+      return None
+
+    try:
+      value = ast.literal_eval(right)
+    except ValueError:
+      return None
+
+    if opType == ast.Eq:
+      return [('low', value, True), ('high', value, True)]
+    elif opType in [ast.Gt, ast.GtE]:
+      return [('low', value, opType == ast.GtE)]
+    else:
+      return [('high', value, opType == ast.LtE)]
+
+  # Returns the part of the expression made of conjunctions, disjunctions, and equality
+  # or membership tests of the given attributes with constants, as a tree of
+  # ('and', terms), ('or', terms) and ('eq', attribute, values) terms, where an
+  # equality term matches any of its values. Conjuncts that are not such terms are
+  # dropped, thus the tree matches a superset of the tuples satisfying the expression.
+  # Returns None if the expression has no such terms.
+  def equalityTerms(self, attributes):
+    return self.equalityTerm(ast.parse(self.expr).body[0].value, attributes)
+
+  def equalityTerm(self, node, attributes):
+    if isinstance(node, ast.BoolOp):
+      terms = [self.equalityTerm(value, attributes) for value in node.values]
+      if isinstance(node.op, ast.Or):
+        return ('or', terms) if all(terms) else None
+
+      terms = [term for term in terms if term]
+      return terms[0] if len(terms) == 1 else (('and', terms) if terms else None)
+
+    elif isinstance(node, ast.Compare) and len(node.ops) == 1:
+      (left, op, right) = (node.left, node.ops[0], node.comparators[0])
+      if isinstance(op, ast.Eq) and isinstance(right, ast.Name):
+        (left, right) = (right, left)
+
+      if isinstance(left, ast.Name) and left.id in attributes and isinstance(op, (ast.Eq, ast.In)):
+        try:
+          value = ast.literal_eval(right)
+        except ValueError:
+          return None
+
+        if isinstance(op, ast.Eq):
+          return ('eq', left.id, [value])
+        elif isinstance(value, (list, tuple, set)):
+          return ('eq', left.id, list(value))
+
+    return None
+
+  # Compiles the expression into a Python function over tuples of the given schemas.
+  # The function takes one tuple of attribute values per schema positionally, as unpacked
+  # by the schema's binary representation (i.e., with character attributes as padded
+  # bytes), and binds the attributes referenced by the expression as local variables,
+  # decoding character attributes as DBSchema.unpack would. Other names are resolved in
+  # the given globals, e.g., those of the operator evaluating the expression.
+  # With 'raw' unset, the function takes tuples of already decoded attribute values.
+  def compileFunction(self, schemas, env, raw=True):
+    attributes = self.getAttributes()
+    params     = ["_values" + str(i) for i in range(len(schemas))]
+    body       = []
+    for (param, schema) in zip(params, schemas):
+      bindings    = ExpressionInfo.attributeBindings(param, schema, attributes, raw)
+      body       += ["  " + binding for binding in bindings]
+      attributes  = attributes - set(schema.fields)
+
+    source    = "def _compiled(" + ", ".join(params) + "):\n" \
+                  + "".join(line + "\n" for line in body) \
+                  + "  return (\n" + self.expr + "\n  )\n"
+    namespace = dict(env)
+    exec(compile(source, "<expression>", "exec"), namespace)
+    return namespace["_compiled"]
+
+  # Returns the statements binding the given attributes of a schema as local variables,
+  # from the tuple of unpacked attribute values named by 'param'.
+  @staticmethod
+  def attributeBindings(param, schema, attributes, raw=True):
+    bindings = []
+    for (i, (field, typeDesc)) in enumerate(schema.schema()):
+      if field in attributes:
+        value = param + "[" + str(i) + "]"
+        if raw and typeDesc.startswith(("char", "text")):
+          value += ".decode().rstrip(" + repr("\x00 \n") + ")"
+        bindings.append(field + " = " + value)
+    return bindings
+
+  # Compiles the expression into a Python function over a columnar batch of the given
+  # schema (see Query.Batch) and a selection vector of the batch's row indexes.
+  # The function returns the expression's value for each selected row or, as a filter,
+  # the selected rows for which the expression holds. Only the columns referenced by
+  # the expression are accessed, and thus decoded by the batch.
+  def compileBatchFunction(self, schema, env, filter=False):
+    attributes = self.getAttributes()
+    columns    = [(i, field) for (i, field) in enumerate(schema.fields) if field in attributes]
+    targets    = "(" + ", ".join(["_i"] + [field for (_, field) in columns]) + ",)"
+    sources    = "zip(" + ", ".join(["_selection"] \
+                   + ["map(_batch.column(" + str(i) + ").__getitem__, _selection)" for (i, _) in columns]) + ")"
+
+    if filter:
+      comprehension = "[_i for " + targets + " in " + sources + " if (\n" + self.expr + "\n)]"
+    else:
+      comprehension = "[(\n" + self.expr + "\n) for " + targets + " in " + sources + "]"
+
+    source    = "def _compiled(_batch, _selection):\n  return " + comprehension + "\n"
+    namespace = dict(env)
+    exec(compile(source, "<expression>", "exec"), namespace)
+    return namespace["_compiled"]
@@ -1,5 +1,6 @@
-import io, math, os, os.path, random, shutil, time, timeit
+import contextlib, io, math, multiprocessing, os, os.path, random, resource, shutil, time, timeit
 
+from Catalog.Identifiers   import TupleId
 from Catalog.Schema        import DBSchema
 from Storage.StorageEngine import StorageEngine
 from Database              import Database
@@ -65,8 +66,58 @@ class WorkloadGenerator:
                           setup="from __main__ import WorkloadGenerator", number=10))) # doctest:+ELLIPSIS
   Tuples: ...
   Total time: ...
+
+  # Sweep the page size of the scanned relations over the workload modes,
+  # keeping the buffer pool's frames at the default page size.
+  >>> results = wg.pageSizeSweep('test/datasets/tpch-tiny', 1.0, [4096, 65536], relations=['lineitem', 'orders']) # doctest:+ELLIPSIS
+  Page size: 4096, Mode: 1, Execution time: ...
+  ...
+  Page size: 65536, Mode: 4, Execution time: ...
+
+  >>> [(pageSize, mode) for (pageSize, mode, _) in results] # doctest:+NORMALIZE_WHITESPACE
+  [(4096, 1), (4096, 2), (4096, 3), (4096, 4), (65536, 1), (65536, 2), (65536, 3), (65536, 4)]
+
+  # Compare memory use with buffered and direct I/O.
+  >>> results = wg.directIOBenchmark('test/datasets/tpch-tiny', 1.0) # doctest:+ELLIPSIS
+  Direct I/O: False, Active: False, Page cache growth (KB): ..., Max RSS (KB): ..., Execution time: ...
+  Direct I/O: True, Active: ..., Page cache growth (KB): ..., Max RSS (KB): ..., Execution time: ...
+
+  >>> [directIO for (directIO, _, _, _, _) in results]
+  [False, True]
+
+  # Compare incremental index construction against a bottom-up build from sorted runs.
+  >>> results = wg.indexBuildBenchmark('test/datasets/tpch-tiny', 1.0) # doctest:+ELLIPSIS
+  Index type: bdb, Method: incremental, Entries: 586, Execution time: ...
+  Index type: bdb, Method: build, Entries: 586, Execution time: ...
+  Index type: btree, Method: incremental, Entries: 586, Execution time: ...
+  Index type: btree, Method: build, Entries: 586, Execution time: ...
+
+  # Compare point lookup latency on primary keys across index types.
+  >>> results = wg.pointLookupBenchmark('test/datasets/tpch-tiny', 1.0, lookups=1000) # doctest:+ELLIPSIS
+  Index type: bdb, Lookups: 1000, Found: ..., Mean latency (us): ...
+  Index type: btree, Lookups: 1000, Found: ..., Mean latency (us): ...
+  Index type: hash, Lookups: 1000, Found: ..., Mean latency (us): ...
+
+  >>> len(set(found for (_, _, found, _) in results))
+  1
+
+  # Crash a transactional database while modifying orders, between operations or while
+  # committing, and check that recovery restores the last committed state.
+  >>> results = wg.crashRecoveryTest('test/datasets/tpch-tiny', 1.0, trials=4) # doctest:+ELLIPSIS
+  Trial: 0, Crash: operation, Recovered sequence: ..., Tuples: ..., Consistent: True
+  Trial: 1, Crash: commit, Recovered sequence: ..., Tuples: ..., Consistent: True
+  Trial: 2, Crash: operation, Recovered sequence: ..., Tuples: ..., Consistent: True
+  Trial: 3, Crash: commit, Recovered sequence: ..., Tuples: ..., Consistent: True
+
+  # Compare the throughput of single tuple insertions across group commit sizes.
+  >>> results = wg.groupCommitBenchmark('test/datasets/tpch-tiny', 1.0, [1, 64]) # doctest:+ELLIPSIS
+  Group commit size: None, Tuples: 150, Throughput: ...
+  Group commit size: 1, Tuples: 150, Throughput: ...
+  Group commit size: 64, Tuples: 150, Throughput: ...
   """
 
+  loadBatchSize = 10000
+
   def __init__(self):
     random.seed(a=12345)
     self.initializeSchemas()
@@ -179,14 +230,19 @@ class WorkloadGenerator:
     return CSVParser("|", fieldParsers)
 
   # Create the TPC-H relations in the given storage engine, removing if already present.
-  def createRelations(self, db):
+  # Relations may be given their own page size with the optional 'pageSizes' dictionary.
+  def createRelations(self, db, pageSizes=None):
     for i in self.schemas:
       if db.hasRelation(i):
         db.removeRelation(i)
-      db.createRelation(i, self.schemas[i].schema())
+      if pageSizes and i in pageSizes:
+        db.createRelation(i, self.schemas[i].schema(), pageSize=pageSizes[i])
+      else:
+        db.createRelation(i, self.schemas[i].schema())
 
   # Load the CSV files corresponding to the TPC-H relations into the given storage engine.
   # This method (naively) samples the dataset based on the scale factor.
+  # Tuples are inserted in batches of 'loadBatchSize', maintaining indexes once per batch.
   def loadDataset(self, db, datadir, scaleFactor):
     self.tupleIds = {}
     for i in self.schemas:
@@ -195,19 +251,28 @@ class WorkloadGenerator:
         if os.path.exists(filePath):
           with open(filePath) as f:
             self.tupleIds[i] = []
+            batch = []
             for line in f:
               if random.random() <= scaleFactor:
                 tup = self.schemas[i].instantiate(*(self.parsers[i].parse(line)))
-                tupleId = db.insertTuple(i, self.schemas[i].pack(tup))
-                if tupleId is not None:
-                  self.tupleIds[i].append(tupleId)
-                else:
-                  raise ValueError("Failed to insert tuple")
+                batch.append(self.schemas[i].pack(tup))
+                if len(batch) == WorkloadGenerator.loadBatchSize:
+                  self.insertBatch(db, i, batch)
+                  batch = []
+            self.insertBatch(db, i, batch)
         else:
           raise ValueError("Could not find file: " + filePath)
       else:
         raise ValueError("Uninitialized relation: "+i)
 
+  def insertBatch(self, db, relId, batch):
+    if batch:
+      tupleIds = db.insertTuples(relId, batch)
+      if tupleIds is not None and all(tupleId is not None for tupleId in tupleIds):
+        self.tupleIds[relId].extend(tupleIds)
+      else:
+        raise ValueError("Failed to insert tuple")
+
   # Scan through all the stored tuples for the given relations
   def scanRelations(self, db, relations):
     start = time.time()
@@ -287,6 +352,311 @@ class WorkloadGenerator:
     shutil.rmtree(db.fileManager().dataDir, ignore_errors=True)
     del db
 
+  # Benchmarks workload modes over a range of page sizes, loading the dataset once per page size.
+  # When relations are given, only those relations use the swept page size, and the buffer pool
+  # keeps its default frame size. Otherwise the page size applies to the whole database.
+  # Returns a list of (page size, workload mode, execution time) triples.
+  def pageSizeSweep(self, datadir, scaleFactor, pageSizes, workloadModes=(1, 2, 3, 4), relations=None):
+    results = []
+    for pageSize in pageSizes:
+      if relations:
+        db = Database()
+        self.createRelations(db, dict([(rel, pageSize) for rel in relations]))
+      else:
+        db = Database(pageSize=pageSize)
+        self.createRelations(db)
+
+      self.loadDataset(db, datadir, scaleFactor)
+      for mode in workloadModes:
+        with contextlib.redirect_stdout(io.StringIO()):
+          start = time.time()
+          self.runOperations(db, mode)
+          end = time.time()
+
+        results.append((pageSize, mode, end - start))
+        print("Page size: " + str(pageSize) + ", Mode: " + str(mode) + ", Execution time: " + str(end - start))
+
+      db.close()
+      shutil.rmtree(db.fileManager().dataDir, ignore_errors=True)
+      del db
+
+    return results
+
+  # Returns the size of the OS page cache in KB, where available.
+  def pageCacheSize(self):
+    try:
+      with open('/proc/meminfo') as f:
+        for line in f:
+          if line.startswith('Cached:'):
+            return int(line.split()[1])
+    except OSError:
+      return None
+
+  # Benchmarks memory use with buffered and direct I/O, loading and running a workload mode.
+  # Reports the growth of the OS page cache while running, the process' maximum resident set size,
+  # and whether direct I/O was active for the workload's relations (i.e., was supported by the
+  # file system). Note the maximum resident set size is cumulative over the process lifetime.
+  # Returns a list of (direct I/O, active, page cache growth, max RSS, execution time) tuples.
+  def directIOBenchmark(self, datadir, scaleFactor, workloadMode=1):
+    results = []
+    for directIO in [False, True]:
+      cacheBefore = self.pageCacheSize()
+      start = time.time()
+
+      db = Database(directIO=directIO)
+      with contextlib.redirect_stdout(io.StringIO()):
+        self.createRelations(db)
+        self.loadDataset(db, datadir, scaleFactor)
+        db.bufferPool().clear()
+        self.runOperations(db, workloadMode)
+
+      end        = time.time()
+      cacheAfter = self.pageCacheSize()
+      cacheDelta = cacheAfter - cacheBefore if cacheBefore is not None and cacheAfter is not None else None
+      maxRSS     = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      active     = all(db.fileManager().relationFile(rel)[1].directIO for rel in ['lineitem', 'orders'])
+
+      results.append((directIO, active, cacheDelta, maxRSS, end - start))
+      print("Direct I/O: " + str(directIO) + ", Active: " + str(active) \
+              + ", Page cache growth (KB): " + str(cacheDelta) + ", Max RSS (KB): " + str(maxRSS) \
+              + ", Execution time: " + str(end - start))
+
+      db.close()
+      shutil.rmtree(db.fileManager().dataDir, ignore_errors=True)
+      del db
+
+    return results
+
+  # Benchmarks the construction of a primary index on lineitem for each index type,
+  # comparing per-tuple insertion over a scan of the relation against a bottom-up
+  # build from externally sorted runs. Each index is removed after being timed.
+  # Returns a list of (index type, method, entries, execution time) tuples.
+  def indexBuildBenchmark(self, datadir, scaleFactor, indexTypes=("bdb", "btree"), runSize=None):
+    results = []
+    db = Database()
+    self.createRelations(db)
+    self.loadDataset(db, datadir, scaleFactor)
+
+    fileMgr   = db.fileManager()
+    schema    = self.schemas['lineitem']
+    keySchema = DBSchema('lineitemKey', [('L_ORDERKEY', 'int'), ('L_LINENUMBER', 'int')])
+
+    for indexType in indexTypes:
+      for method in ["incremental", "build"]:
+        start = time.time()
+        if method == "build":
+          indexId = db.storageEngine().createIndex('lineitem', schema, keySchema, True, \
+                                                   indexType=indexType, build=True, runSize=runSize)
+        else:
+          indexId = db.storageEngine().createIndex('lineitem', schema, keySchema, True, indexType=indexType)
+          for (tupleId, tupleData) in fileMgr.tuplesWithIds('lineitem'):
+            fileMgr.indexManager.insertTuple('lineitem', tupleData, tupleId)
+        end = time.time()
+
+        entries = sum(1 for _ in fileMgr.indexManager.scanByIndex(indexId))
+        results.append((indexType, method, entries, end - start))
+        print("Index type: " + indexType + ", Method: " + method + ", Entries: " + str(entries) \
+                + ", Execution time: " + str(end - start))
+
+        fileMgr.indexManager.removeIndex('lineitem', indexId)
+
+    db.close()
+    shutil.rmtree(db.fileManager().dataDir, ignore_errors=True)
+    del db
+    return results
+
+  # Benchmarks primary key lookups on orders for each index type, through the file
+  # manager's lookupByKey. The same random sample of keys is probed with every index,
+  # with roughly one in ten keys missing from the relation.
+  # Returns a list of (index type, lookups, keys found, mean latency in microseconds) tuples.
+  def pointLookupBenchmark(self, datadir, scaleFactor, indexTypes=("bdb", "btree", "hash"), lookups=10000):
+    results = []
+    db = Database()
+    self.createRelations(db)
+    self.loadDataset(db, datadir, scaleFactor)
+
+    fileMgr   = db.fileManager()
+    schema    = self.schemas['orders']
+    keySchema = DBSchema('ordersKey', [('O_ORDERKEY', 'int')])
+
+    keys    = [schema.unpack(tup).O_ORDERKEY for tup in fileMgr.tuples('orders')]
+    missing = [max(keys) + i + 1 for i in range(max(1, len(keys) // 10))]
+    rng     = random.Random(12345)
+    probes  = [keySchema.pack(keySchema.instantiate(k)) for k in rng.choices(keys + missing, k=lookups)]
+
+    for indexType in indexTypes:
+      indexId = db.storageEngine().createIndex('orders', schema, keySchema, True, indexType=indexType, build=True)
+
+      found = 0
+      start = time.perf_counter()
+      for keyData in probes:
+        if fileMgr.lookupByKey('orders', keyData) is not None:
+          found += 1
+      end = time.perf_counter()
+
+      latency = (end - start) * 1e6 / max(1, lookups)
+      results.append((indexType, lookups, found, latency))
+      print("Index type: " + indexType + ", Lookups: " + str(lookups) + ", Found: " + str(found) \
+              + ", Mean latency (us): " + str(latency))
+
+      fileMgr.indexManager.removeIndex('orders', indexId)
+
+    db.close()
+    shutil.rmtree(db.fileManager().dataDir, ignore_errors=True)
+    del db
+    return results
+
+  # Crash recovery harness for transactional mode. Each trial loads the dataset into a
+  # transactional database in a child process, indexes orders on its key and customer
+  # with a BDB and a B+-tree index, and performs random insertions, deletions and updates
+  # on orders until the child exits abruptly at a random operation. Even trials crash
+  # between operations, and odd trials while writing the pages of a group in place,
+  # after its commit point. The child reports the live order keys at each commit.
+  #
+  # The database is then reopened, and its orders must hold the keys of the recovered
+  # commit sequence number, while both indexes must agree with the heap file.
+  # Returns a list of (trial, crash point, recovered sequence number, consistent) tuples.
+  def crashRecoveryTest(self, datadir, scaleFactor, trials=4, operations=200, groupCommitSize=16, dataDir='crash/'):
+    results = []
+    for trial in range(trials):
+      shutil.rmtree(dataDir, ignore_errors=True)
+      crashPoint         = "operation" if trial % 2 == 0 else "commit"
+      (receiver, sender) = multiprocessing.Pipe(duplex=False)
+      child = multiprocessing.Process(target=self.crashingWorkload, \
+                                      args=(datadir, scaleFactor, dataDir, groupCommitSize, operations, \
+                                            random.Random(trial), crashPoint, sender))
+      child.start()
+      sender.close()
+
+      committed = {}
+      while True:
+        try:
+          (sequence, keys) = receiver.recv()
+          committed[sequence] = keys
+        except EOFError:
+          break
+      child.join()
+
+      db = Database(dataDir=dataDir, transactional=True, groupCommitSize=groupCommitSize)
+      sequence   = db.fileManager().commitSeq
+      consistent = self.checkOrders(db) == committed.get(sequence, None)
+      tuples     = sum(1 for _ in db.storageEngine().tuples('orders'))
+      results.append((trial, crashPoint, sequence, consistent))
+      print("Trial: " + str(trial) + ", Crash: " + crashPoint + ", Recovered sequence: " + str(sequence) \
+              + ", Tuples: " + str(tuples) + ", Consistent: " + str(consistent))
+
+      db.close()
+      shutil.rmtree(dataDir, ignore_errors=True)
+      del db
+
+    return results
+
+  # The child process of a crash recovery trial, sending (commit sequence number,
+  # sorted order keys) pairs on the given connection as operations are committed.
+  def crashingWorkload(self, datadir, scaleFactor, dataDir, groupCommitSize, operations, rng, crashPoint, conn):
+    db = Database(dataDir=dataDir, transactional=True, groupCommitSize=groupCommitSize)
+    self.createRelations(db)
+    self.loadDataset(db, datadir, scaleFactor)
+
+    fileMgr   = db.fileManager()
+    schema    = self.schemas['orders']
+    keySchema = DBSchema('ordersKey', [('O_ORDERKEY', 'int')])
+    custKey   = DBSchema('ordersCust', [('O_CUSTKEY', 'int')])
+    fileMgr.createIndex('orders', schema, keySchema, True, indexType='bdb', build=True)
+    fileMgr.createIndex('orders', schema, custKey, False, indexType='btree', build=True)
+    db.commit()
+
+    orders  = dict((schema.unpack(tup).O_ORDERKEY, schema.unpack(tup)) for tup in fileMgr.tuples('orders'))
+    nextKey = max(orders) + 1
+    crashAt = rng.randrange(operations)
+    conn.send((fileMgr.commitSeq, sorted(orders)))
+
+    # Crash midway through writing the pages of the first group committed after the crash point.
+    if crashPoint == "commit":
+      writePages = fileMgr.writePages
+      def crashingWrites(pages):
+        if operation >= crashAt:
+          conn.send((fileMgr.commitSeq + 1, sorted(orders)))
+          writePages(dict(list(pages.items())[:len(pages) // 2]))
+          os._exit(1)
+        writePages(pages)
+      fileMgr.writePages = crashingWrites
+
+    for operation in range(operations):
+      if crashPoint == "operation" and operation == crashAt:
+        os._exit(1)
+
+      # The expected keys are updated before each operation, since the operation may commit.
+      sequence = fileMgr.commitSeq
+      action   = rng.random()
+      if action < 0.4:
+        order = schema.instantiate(*((nextKey, rng.randrange(1000)) + tuple(rng.choice(list(orders.values()))[2:])))
+        orders[nextKey] = order
+        nextKey += 1
+        fileMgr.insertTuple('orders', schema.pack(order))
+      elif action < 0.7:
+        key = rng.choice(sorted(orders))
+        del orders[key]
+        fileMgr.deleteByKey('orders', keySchema.pack(keySchema.instantiate(key)))
+      else:
+        key   = rng.choice(sorted(orders))
+        order = orders[key]._replace(O_CUSTKEY=rng.randrange(1000))
+        orders[key] = order
+        fileMgr.updateByKey('orders', keySchema.pack(keySchema.instantiate(key)), schema.pack(order))
+
+      if fileMgr.commitSeq != sequence:
+        conn.send((fileMgr.commitSeq, sorted(orders)))
+
+    os._exit(1)
+
+  # Checks that the primary and customer indexes on orders agree with its heap file,
+  # returning the sorted order keys, or None if an index is inconsistent.
+  def checkOrders(self, db):
+    fileMgr = db.fileManager()
+    schema  = self.schemas['orders']
+    slot    = lambda tupleId: (tupleId.pageId.pageIndex, tupleId.tupleIndex)
+    heap    = sorted((schema.unpack(tup).O_ORDERKEY, schema.unpack(tup).O_CUSTKEY, slot(tupleId)) \
+                       for (tupleId, tup) in fileMgr.tuplesWithIds('orders'))
+
+    for (keySchema, _, indexId) in fileMgr.indexManager.indexes('orders'):
+      field   = keySchema.fields[0]
+      entries = sorted((keySchema.unpack(key)[0], slot(TupleId.unpack(value))) \
+                         for (key, value) in fileMgr.indexManager.scanByIndex(indexId))
+      expected = sorted((key if field == 'O_ORDERKEY' else cust, tupleId) for (key, cust, tupleId) in heap)
+      if entries != expected:
+        return None
+
+    return [key for (key, _, _) in heap]
+
+  # Benchmarks the throughput of single tuple insertions into orders, without transactions
+  # and in transactional mode with each of the given group commit sizes.
+  # Returns a list of (group commit size, tuples, throughput) tuples.
+  def groupCommitBenchmark(self, datadir, scaleFactor, groupSizes=(1, 16, 256)):
+    results = []
+    for groupSize in [None] + list(groupSizes):
+      db = Database(transactional=True, groupCommitSize=groupSize) if groupSize else Database()
+      self.createRelations(db)
+      schema = self.schemas['orders']
+      with open(os.path.join(datadir, "orders.csv")) as f:
+        tuples = [schema.pack(schema.instantiate(*(self.parsers['orders'].parse(line)))) for line in f \
+                    if random.random() <= scaleFactor]
+
+      start = time.time()
+      for tup in tuples:
+        db.insertTuple('orders', tup)
+      db.commit()
+      end = time.time()
+
+      throughput = len(tuples) / (end - start)
+      results.append((groupSize, len(tuples), throughput))
+      print("Group commit size: " + str(groupSize) + ", Tuples: " + str(len(tuples)) + ", Throughput: " + str(throughput))
+
+      db.close()
+      shutil.rmtree(db.fileManager().dataDir, ignore_errors=True)
+      del db
+
+    return results
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
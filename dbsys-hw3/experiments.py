@@ -1,5 +1,6 @@
 import Database
 from Catalog.Schema import DBSchema
+from Query.Operators.TableScan import TableScan
 
 import sys
 import unittest
@@ -12,7 +13,7 @@ def setup():
 def query1(db):
     query = db.query().fromTable('lineitem')\
         .where(
-            "(L_SHIPDATE >= 19940101) and (L_SHIPDATE < 19950101) and (0.06-0.01 <= L_DISCOUNT <= 0.06 + 0.01) and (L_QUANTITY < 24")\
+            "(L_SHIPDATE >= 19940101) and (L_SHIPDATE < 19950101) and (0.06-0.01 <= L_DISCOUNT <= 0.06 + 0.01) and (L_QUANTITY < 24)")\
         .groupBy(
             groupSchema=DBSchema('groupKey', [('ONE', 'int')]),
             groupExpr=(lambda e: 1),
@@ -148,6 +149,21 @@ def query5(db):
         .finalize()
     return query
 
+# Clusters lineitem on its ship date. The zone maps of lineitem's pages then let the
+# date-range selections of query1 and query2 skip the pages outside of the range.
+def clusterLineitem(db):
+    schema    = db.relationSchema('lineitem')
+    keySchema = DBSchema('lineitemShipKey', [('L_SHIPDATE', 'int'), ('L_ORDERKEY', 'int'), ('L_LINENUMBER', 'int')])
+    if not db.storageEngine().hasIndex('lineitem', keySchema):
+        db.storageEngine().createIndex('lineitem', schema, keySchema, True, indexType='btree', build=True)
+    return db.storageEngine().clusterRelation('lineitem')
+
+# Runs a query, returning the pages read and skipped by each of its table scans.
+def scanReport(db, query):
+    for _ in db.processQuery(query):
+        pass
+    return [(op.relId, op.pagesRead, op.pagesSkipped) for (_, op) in query.flatten() if isinstance(op, TableScan)]
+
 
 db = setup()
 testQuery1 = query1(db)